@@ -0,0 +1,100 @@
+"""
+Write-behind activity log.
+
+Audit entries are appended to an in-memory buffer and written with insert_many
+when the buffer reaches a batch size or a flush interval passes, so logging
+costs a write endpoint a list append instead of a MongoDB round trip. Entries
+carry a BSON date timestamp (the TTL index and the newest-first sort both need
+real dates). A flush that cannot reach the server puts its entries back for the
+next attempt; past max_buffer (checked on every log, so a stalled writer cannot
+grow it either) the oldest are dropped rather than growing without bound. insert_many gives each entry its _id on the first attempt, so entries
+that did land before a failure come back as duplicate-key errors on the retry
+and are not written twice.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogger:
+    def __init__(self, collection, batch_size: int = 100, flush_interval: float = 2.0, max_buffer: int = 10000):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._buffer = []
+        self._wake = None
+
+    def log(self, action: str, entity_type: str, entity_id: str, details: str = "", user: str = "system") -> dict:
+        entry = {
+            "id": str(uuid.uuid4()),
+            "action": action,
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "details": details,
+            "user": user,
+            "timestamp": datetime.now(timezone.utc)
+        }
+        self._buffer.append(entry)
+        self._trim()
+        if len(self._buffer) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+        return entry
+
+    def _trim(self):
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self) -> int:
+        """Write everything buffered so far; safe to call concurrently (each entry is taken once)"""
+        if not self._buffer:
+            return 0
+        entries, self._buffer = self._buffer, []
+        try:
+            await self.collection.insert_many(entries, ordered=False)
+        except BulkWriteError as exc:
+            # Per-entry errors are not retryable (or are entries already written); the rest landed
+            errors = exc.details.get("writeErrors", [])
+            written = len(entries) - len(errors)
+            if any(error.get("code") != 11000 for error in errors):
+                logger.warning(f"Activity log flush rejected {len(errors)} of {len(entries)} entries")
+            return written
+        except PyMongoError as exc:
+            # Keep the batch for the next flush; the oldest entries are the first to go past the cap
+            self._buffer = entries + self._buffer
+            self._trim()
+            logger.warning(f"Activity log flush of {len(entries)} entries failed: {exc}")
+            return 0
+        except asyncio.CancelledError:
+            # Stopped mid-write (shutdown): the final flush writes them, or skips those that landed
+            self._buffer = entries + self._buffer
+            raise
+        return len(entries)
+
+    async def run(self):
+        """Flush on the interval, or as soon as a batch fills; cancel to stop, then flush() once more"""
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # e.g. an entry BSON cannot encode: that batch is lost, the writer keeps running
+                logger.exception("Activity log flush failed")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: how long `import server` takes and how much memory a fresh
+worker holds afterwards. Each run is a new interpreter, like a new uvicorn worker.
+
+Usage:
+    python bench_startup.py --runs 5
+    python bench_startup.py --max-import-ms 1500 --max-rss-mb 150   # fail CI on regressions
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+HEAVY_MODULES = ["qrcode", "barcode", "PIL", "numpy", "pandas"]
+
+PROBE = f"""
+import json, resource, sys, time
+started = time.perf_counter()
+import server
+import_ms = (time.perf_counter() - started) * 1000
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "import_ms": import_ms,
+    "rss_mb": rss_kb / 1024,
+    "heavy_loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+}}))
+"""
+
+
+def run_once() -> dict:
+    env = dict(os.environ)
+    # Importing server only needs the settings to exist; Motor connects lazily
+    env.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    env.setdefault('DB_NAME', 'bench_startup')
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure worker import time and RSS")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-rss-mb", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    results = [run_once() for _ in range(args.runs)]
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    rss_mb = statistics.median(r["rss_mb"] for r in results)
+    heavy = sorted({m for r in results for m in r["heavy_loaded"]})
+
+    print(f"import server: median {import_ms:.0f}ms over {args.runs} runs "
+          f"(min {min(r['import_ms'] for r in results):.0f}ms, max {max(r['import_ms'] for r in results):.0f}ms)")
+    print(f"worker RSS after import: median {rss_mb:.1f}MB")
+    print(f"heavy modules loaded at import: {', '.join(heavy) if heavy else 'none'}")
+
+    failed = False
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"❌ import time {import_ms:.0f}ms exceeds {args.max_import_ms:.0f}ms")
+        failed = True
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        print(f"❌ RSS {rss_mb:.1f}MB exceeds {args.max_rss_mb:.1f}MB")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Per-request MongoDB command accounting.
+
+A pymongo CommandListener attributes every database command to the HTTP request
+that issued it through a ContextVar. Motor runs pymongo calls on executor threads
+with a copy of the caller's context, so the listener sees the same RequestStats
+object the request middleware created.
+"""
+
+import contextvars
+import os
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+from pymongo import monitoring
+
+# Requests that issue more commands than this are flagged in the request log
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', '25'))
+# The same command against the same collection this many times in one request looks like N+1
+REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', '10'))
+
+_current_stats = contextvars.ContextVar("mongo_request_stats", default=None)
+
+
+class RequestStats:
+    """Database commands, time and returned documents for one request"""
+
+    def __init__(self, trace: bool = False):
+        self.commands = 0
+        self.failures = 0
+        self.duration_ms = 0.0
+        self.docs_returned = 0
+        self.shapes = Counter()
+        self.trace = [] if trace else None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, key, command_name: str, collection: Optional[str] = None):
+        with self._lock:
+            self._pending[key] = (command_name, collection)
+
+    def finished(self, key, duration_micros: int, docs: int, failed: bool = False):
+        with self._lock:
+            command_name, collection = self._pending.pop(key, ("unknown", None))
+            duration = duration_micros / 1000.0
+            self.commands += 1
+            self.duration_ms += duration
+            self.docs_returned += docs
+            self.shapes[(command_name, collection)] += 1
+            if failed:
+                self.failures += 1
+            if self.trace is not None:
+                self.trace.append({
+                    "command": command_name,
+                    "collection": collection,
+                    "duration_ms": round(duration, 3),
+                    "docs": docs,
+                    "failed": failed
+                })
+
+    @property
+    def over_budget(self) -> bool:
+        return self.commands > QUERY_BUDGET
+
+    def repeated_commands(self):
+        """Command shapes repeated often enough to suggest a query inside a loop"""
+        return [
+            {"command": name, "collection": collection, "count": count}
+            for (name, collection), count in self.shapes.most_common()
+            if count >= REPEAT_THRESHOLD
+        ]
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.duration_ms:.2f}, '
+            f'db-commands;desc="{self.commands}", '
+            f'db-docs;desc="{self.docs_returned}"'
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "db_commands": self.commands,
+            "db_time_ms": round(self.duration_ms, 2),
+            "db_docs": self.docs_returned,
+            "db_failures": self.failures,
+            "over_budget": self.over_budget,
+            "repeated": self.repeated_commands()
+        }
+
+
+def begin_request(trace: bool = False):
+    """Start accounting for the current request; returns (stats, token)"""
+    stats = RequestStats(trace=trace)
+    return stats, _current_stats.set(stats)
+
+
+def end_request(token):
+    _current_stats.reset(token)
+
+
+def current_stats():
+    return _current_stats.get()
+
+
+def parse_server_timing(header: str) -> dict:
+    """Read the db metrics back out of a Server-Timing header"""
+    result = {"db_time_ms": 0.0, "commands": 0, "docs": 0}
+    for entry in (header or "").split(","):
+        name = entry.strip().split(";", 1)[0]
+        dur = re.search(r'dur=([\d.]+)', entry)
+        desc = re.search(r'desc="?(\d+)"?', entry)
+        if name == "db" and dur:
+            result["db_time_ms"] = float(dur.group(1))
+        elif name == "db-commands" and desc:
+            result["commands"] = int(desc.group(1))
+        elif name == "db-docs" and desc:
+            result["docs"] = int(desc.group(1))
+    return result
+
+
+def _docs_in_reply(reply) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        if batch is not None:
+            return len(batch)
+    return 0
+
+
+class CommandAccountingListener(monitoring.CommandListener):
+    """Feeds command events into the RequestStats of the request that issued them"""
+
+    def started(self, event):
+        stats = _current_stats.get()
+        if stats is None:
+            return
+        collection = event.command.get(event.command_name)
+        stats.started(
+            (event.connection_id, event.request_id),
+            event.command_name,
+            collection if isinstance(collection, str) else None
+        )
+
+    def succeeded(self, event):
+        stats = _current_stats.get()
+        if stats is None:
+            return
+        stats.finished((event.connection_id, event.request_id), event.duration_micros, _docs_in_reply(event.reply))
+
+    def failed(self, event):
+        stats = _current_stats.get()
+        if stats is None:
+            return
+        stats.finished((event.connection_id, event.request_id), event.duration_micros, 0, failed=True)
+
+
+command_listener = CommandAccountingListener()
@@ -0,0 +1,128 @@
+"""
+In-process event bus with Server-Sent Events delivery.
+
+Publishers call bus.publish(topic, data, keys=...); every subscriber whose topics
+and key filters match gets the event on its own bounded queue. Keys are the
+entities an event concerns (lot, stock_code, unit), so a scan station can follow
+one lot and a unit screen one unit. A slow client drops its oldest events rather
+than holding memory or blocking publishers.
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 15
+FILTER_KEYS = ("lot", "stock_code", "unit")
+
+
+def event_keys(lot=None, stock_code=None, unit=None) -> Dict[str, List[str]]:
+    """Normalise the entities an event concerns; multi-lot DCs carry comma-joined lot numbers"""
+    keys = {}
+    for name, value in (("lot", lot), ("stock_code", stock_code), ("unit", unit)):
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        flattened = []
+        for item in values:
+            if item:
+                flattened.extend(part.strip() for part in str(item).split(",") if part.strip())
+        if flattened:
+            keys[name] = sorted(set(flattened))
+    return keys
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", topics: Optional[Set[str]] = None, filters: Optional[Dict[str, str]] = None):
+        self.bus = bus
+        self.topics = set(topics) if topics else None
+        self.filters = {k: v for k, v in (filters or {}).items() if v}
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, event: dict) -> bool:
+        if self.topics is not None and event["topic"] not in self.topics:
+            return False
+        keys = event.get("keys") or {}
+        return all(value in keys.get(name, ()) for name, value in self.filters.items())
+
+    def deliver(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventBus:
+    def __init__(self):
+        self._subscriptions = set()
+
+    def subscribe(self, topics: Optional[Set[str]] = None, filters: Optional[Dict[str, str]] = None) -> Subscription:
+        subscription = Subscription(self, topics, filters)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, topic: str, data: dict, event_type: str = None, keys: dict = None) -> dict:
+        """Fan an event out to matching subscribers; never blocks"""
+        return self.dispatch(build_event(topic, data, event_type, keys))
+
+    def dispatch(self, event: dict) -> dict:
+        """Deliver an already built event, e.g. one read back from a change stream"""
+        for subscription in list(self._subscriptions):
+            if subscription.matches(event):
+                subscription.deliver(event)
+        return event
+
+
+def build_event(topic: str, data: dict, event_type: str = None, keys: dict = None) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "topic": topic,
+        "type": event_type or topic,
+        "keys": keys or {},
+        "data": data,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def format_sse(event: dict) -> str:
+    payload = json.dumps(
+        {**event["data"], "_topic": event["topic"], "_keys": event.get("keys", {}), "_timestamp": event["timestamp"]},
+        default=str
+    )
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+async def sse_stream(subscription: Subscription, request, heartbeat: float = HEARTBEAT_SECONDS):
+    """Yield SSE frames until the client disconnects; comments keep proxies from timing out"""
+    with subscription:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event)
+
+
+bus = EventBus()
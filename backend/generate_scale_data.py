@@ -0,0 +1,823 @@
+#!/usr/bin/env python3
+"""
+Synthetic large-factory dataset generator for scale testing.
+
+Writes realistic, internally consistent production data straight into MongoDB
+with insert_many, using the same document shapes the endpoints in server.py
+create. Lots move through the pipeline in date order: the oldest lots are fully
+finished (cutting -> outsourcing -> ironing -> stock -> dispatch) while the
+newest are still at the cutting table, so every list, scan and report endpoint
+has data in every stage.
+
+Usage:
+    python generate_scale_data.py --scale 0.1 --seed 7
+    python generate_scale_data.py --cutting-lots 100000 --outsourcing-orders 300000 \
+        --stock 50000 --dispatches 200000 --drop
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from search import SEARCH_FIELDS, SEARCH_INDEX_SOURCES, search_index_entry, with_search_keys
+from rollups import rollup_delta, rollup_documents
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Default volumes (100x today's factory)
+DEFAULT_CUTTING_LOTS = 100_000
+DEFAULT_OUTSOURCING_ORDERS = 300_000
+DEFAULT_STOCK = 50_000
+DEFAULT_DISPATCHES = 200_000
+
+SIZES = {
+    "Mens": ["M", "L", "XL", "XXL"],
+    "Women": ["S", "M", "L", "XL"],
+    "Kids": ["2/3", "3/4", "5/6", "7/8", "9/10", "11/12", "13/14"],
+}
+STYLES = ["Round Neck", "Polo", "V Neck", "Henley", "Hoodie", "Sweatshirt"]
+COLORS = ["Black", "White", "Navy", "Grey Melange", "Maroon", "Olive", "Sky Blue", "Red", "Mustard", "Bottle Green"]
+FABRIC_TYPES = ["Cotton Single Jersey", "Cotton Lycra", "Pique", "Fleece", "Rib", "Interlock"]
+SUPPLIERS = ["Sri Murugan Textiles", "Balaji Knits", "KPR Mills", "Eastman Fabrics", "Vardhman Yarns", "Loyal Textiles"]
+CUTTING_MASTERS = ["Ravi", "Senthil", "Kumar", "Arun", "Murali", "Prakash"]
+EMBELLISHMENTS = ["Printing", "Embroidery", "Stone", "Sequins", "Sticker"]
+CUSTOMERS = ["Chennai Silks", "Pothys", "Saravana Stores", "Kumaran Fashions", "Reliance Trends", "Walk-in", "Max Retail", "Zudio"]
+RETURN_WINDOW_DAYS = 7
+# Collection -> rollup kind, and the field naming a receipt's DC
+ROLLUP_SOURCES = {
+    "cutting_orders": ("cutting", None),
+    "outsourcing_orders": ("outsourcing", None),
+    "outsourcing_receipts": ("outsourcing_receipt", "outsourcing_order_id"),
+    "ironing_orders": ("ironing", None),
+    "ironing_receipts": ("ironing_receipt", "ironing_order_id"),
+    "bulk_dispatches": ("dispatch", None),
+}
+
+
+class ScaleDataGenerator:
+    def __init__(self, db, seed, batch_size, history_days):
+        self.db = db
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.start = self.now - timedelta(days=history_days)
+        self.buffers = {}
+        self.counts = {}
+        self.stock_seq = 0
+        self.units = {}
+        self.lot_dcs = {}
+        self.ironing_units = {}
+        self.rollups = {}
+        self.rollup_dcs = {}
+        self.pending_receipts = []
+
+    # ==================== WRITE HELPERS ====================
+
+    def add(self, collection, doc):
+        """Buffer a document and flush the collection when the batch is full"""
+        if collection in SEARCH_FIELDS:
+            with_search_keys(collection, doc)
+        if collection in SEARCH_INDEX_SOURCES:
+            self.add("search_index", {**search_index_entry(collection, doc), "indexed_at": self.iso(self.now)})
+        if collection in ROLLUP_SOURCES:
+            self.count_rollup(collection, doc)
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append(doc)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def add_fabric_lot(self, fabric_lot):
+        """A fabric lot and one fabric_rolls record per roll, as create_fabric_lot writes them"""
+        lot = {k: v for k, v in fabric_lot.items() if not k.startswith('_')}
+        self.add("fabric_lots", lot)
+        for i, roll_number in enumerate(lot['roll_numbers']):
+            self.add("fabric_rolls", {
+                "id": self.uid(),
+                "roll_number": roll_number,
+                "fabric_lot_id": lot['id'],
+                **{field: lot[field] for field in ("lot_number", "fabric_type", "supplier_name", "color", "rate_per_kg")},
+                "sequence": i + 1,
+                "weight": lot['roll_weights'][i],
+                "scale_reading": lot['scale_readings'][i],
+                "status": "in_stock",
+                "consumed_by": None,
+                "cutting_lot_number": None,
+                "return_id": None,
+                "created_at": lot['created_at'],
+                "updated_at": lot['created_at']
+            })
+
+    def count_rollup(self, collection, doc):
+        """Fold a document into the daily rollups; receipts wait for add_rollups, when every DC is known"""
+        kind, dc_field = ROLLUP_SOURCES[collection]
+        if dc_field:
+            self.pending_receipts.append((kind, doc, doc[dc_field]))
+            return
+        if kind in ("outsourcing", "ironing"):
+            self.rollup_dcs[doc['id']] = {"category": doc['category'], "style_type": doc['style_type']}
+        rollup_delta(kind, None, doc, buckets=self.rollups)
+
+    def add_rollups(self):
+        """daily_rollups for everything generated, as the daily-rollups migration would build them"""
+        for kind, receipt, dc_id in self.pending_receipts:
+            rollup_delta(kind, None, receipt, self.rollup_dcs.get(dc_id), self.rollups)
+        self.pending_receipts = []
+        for rollup in rollup_documents(self.rollups):
+            self.add("daily_rollups", rollup)
+        self.flush("daily_rollups")
+
+    def flush(self, collection=None):
+        collections = [collection] if collection else list(self.buffers.keys())
+        for name in collections:
+            buffer = self.buffers.get(name)
+            if not buffer:
+                continue
+            self.db[name].insert_many(buffer, ordered=False)
+            self.counts[name] = self.counts.get(name, 0) + len(buffer)
+            self.buffers[name] = []
+
+    # ==================== VALUE HELPERS ====================
+
+    def uid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def iso(self, dt):
+        return dt.isoformat()
+
+    def after(self, dt, min_days, max_days):
+        """A timestamp a few days after dt, never in the future"""
+        offset = timedelta(days=self.rng.uniform(min_days, max_days), seconds=self.rng.randint(0, 86399))
+        return min(dt + offset, self.now)
+
+    def size_distribution(self, category, low, high):
+        return {size: self.rng.randint(low, high) for size in SIZES[category]}
+
+    def received_from(self, sent):
+        """Received quantities with an occasional shortage"""
+        received = {}
+        for size, qty in sent.items():
+            shortage = self.rng.randint(1, 3) if qty > 3 and self.rng.random() < 0.12 else 0
+            received[size] = qty - shortage
+        return received
+
+    def payment_fields(self, total_amount, settled):
+        if settled:
+            paid = total_amount if self.rng.random() < 0.7 else round(total_amount * self.rng.uniform(0.2, 0.9), 2)
+        else:
+            paid = 0.0
+        balance = round(total_amount - paid, 2)
+        status = "Paid" if balance <= 0 else ("Partial" if paid > 0 else "Unpaid")
+        return {"amount_paid": round(paid, 2), "balance": max(0.0, balance), "payment_status": status}
+
+    @staticmethod
+    def shortage_of(sent, received):
+        return {size: qty - received.get(size, 0) for size, qty in sent.items() if qty - received.get(size, 0) > 0}
+
+    @staticmethod
+    def dc_number(prefix, dt, seq):
+        # Same timestamp format as generate_dc_number(), with a sequence suffix so numbers stay distinct
+        return f"{prefix}-{dt.strftime('%Y%m%d%H%M%S')}{seq % 100:02d}"
+
+    # ==================== MASTER DATA ====================
+
+    def generate_master_data(self):
+        for name in FABRIC_TYPES:
+            self.add("fabric_types", {"id": self.uid(), "name": name, "created_at": self.iso(self.start)})
+        for name in SUPPLIERS:
+            self.add("suppliers", {"id": self.uid(), "name": name, "created_at": self.iso(self.start)})
+
+        for operation in EMBELLISHMENTS + ["Stitching", "Ironing"]:
+            names = [f"{operation} Unit {i}" for i in range(1, 6)]
+            self.units[operation] = names
+            for unit_name in names:
+                self.add("outsourcing_units", {
+                    "id": self.uid(),
+                    "unit_name": unit_name,
+                    "operations": [operation],
+                    "contact_person": self.rng.choice(CUTTING_MASTERS),
+                    "phone": f"98{self.rng.randint(10000000, 99999999)}",
+                    "address": "Tiruppur",
+                    "is_active": True,
+                    "created_at": self.iso(self.start)
+                })
+
+    # ==================== PRODUCTION PIPELINE ====================
+
+    def generate_fabric_lot(self, seq, entry_date, lots_per_fabric):
+        color = self.rng.choice(COLORS)
+        lot_number = f"lot {str(seq).zfill(3)}"
+        number_of_rolls = self.rng.randint(6, 30)
+        roll_weights = [round(self.rng.uniform(18, 28), 2) for _ in range(number_of_rolls)]
+        scale_readings = []
+        reading = 0
+        for weight in roll_weights:
+            reading = round(reading + weight, 2)
+            scale_readings.append(reading)
+        quantity = round(sum(roll_weights), 2)
+        rate_per_kg = round(self.rng.uniform(180, 420), 2)
+        rib_quantity = round(self.rng.uniform(10, 40), 2)
+        return {
+            "id": self.uid(),
+            "lot_number": lot_number,
+            "entry_date": self.iso(entry_date),
+            "fabric_type": self.rng.choice(FABRIC_TYPES),
+            "supplier_name": self.rng.choice(SUPPLIERS),
+            "color": color,
+            "quantity": quantity,
+            "rib_quantity": rib_quantity,
+            "rate_per_kg": rate_per_kg,
+            "total_amount": round(quantity * rate_per_kg, 2),
+            "remaining_quantity": quantity,
+            "remaining_rib_quantity": rib_quantity,
+            "number_of_rolls": number_of_rolls,
+            "roll_numbers": [f"{lot_number}{color.replace(' ', '')}{i}" for i in range(1, number_of_rolls + 1)],
+            "roll_weights": roll_weights,
+            "scale_readings": scale_readings,
+            "created_by": "admin",
+            "updated_by": None,
+            "created_at": self.iso(entry_date),
+            # Remaining lots this fabric can still feed (stripped before insert)
+            "_cuts_left": lots_per_fabric
+        }
+
+    def generate_cutting_order(self, seq, fabric_lot, cutting_date):
+        category = self.rng.choice(list(SIZES.keys()))
+        size_distribution = self.size_distribution(category, 20, 120)
+        total_quantity = sum(size_distribution.values())
+
+        # Never draw more than the fabric lot still has
+        share = fabric_lot['quantity'] / max(fabric_lot['_cuts_left'] + 1, 2)
+        fabric_taken = round(min(fabric_lot['remaining_quantity'], share * self.rng.uniform(0.8, 1.0)), 2)
+        fabric_returned = round(fabric_taken * self.rng.uniform(0, 0.05), 2)
+        fabric_used = round(fabric_taken - fabric_returned, 2)
+        rib_taken = round(min(fabric_lot['remaining_rib_quantity'], fabric_lot['rib_quantity'] / 5), 2)
+        rib_returned = round(rib_taken * self.rng.uniform(0, 0.05), 2)
+        rib_used = round(rib_taken - rib_returned, 2)
+        fabric_lot['remaining_quantity'] = round(fabric_lot['remaining_quantity'] - fabric_used, 2)
+        fabric_lot['remaining_rib_quantity'] = round(fabric_lot['remaining_rib_quantity'] - rib_used, 2)
+        fabric_lot['_cuts_left'] -= 1
+
+        cutting_rate = round(self.rng.choice([1.5, 2.0, 2.5, 3.0]), 2)
+        total_cutting_amount = round(total_quantity * cutting_rate, 2)
+        order = {
+            "id": self.uid(),
+            "cutting_lot_number": f"cut {str(seq).zfill(3)}",
+            "cutting_master_name": self.rng.choice(CUTTING_MASTERS),
+            "cutting_date": self.iso(cutting_date),
+            "fabric_lot_id": fabric_lot['id'],
+            "lot_number": fabric_lot['lot_number'],
+            "color": fabric_lot['color'],
+            "category": category,
+            "style_type": self.rng.choice(STYLES),
+            "fabric_taken": fabric_taken,
+            "fabric_returned": fabric_returned,
+            "fabric_used": fabric_used,
+            "rib_taken": rib_taken,
+            "rib_returned": rib_returned,
+            "rib_used": rib_used,
+            "size_distribution": size_distribution,
+            "bundle_distribution": {"Front": total_quantity, "Back": total_quantity, "Sleeve": total_quantity * 2},
+            "total_quantity": total_quantity,
+            "cutting_rate_per_pcs": cutting_rate,
+            "total_cutting_amount": total_cutting_amount,
+            "total_fabric_cost": round(fabric_used * fabric_lot['rate_per_kg'], 2),
+            "used_in_catalog": False,
+            "catalog_id": None,
+            "catalog_name": None,
+            "sent_to_ironing": False,
+            "completed_operations": [],
+            "outsourcing_order_ids": [],
+            "ironing_order_id": None,
+            "stock_id": None,
+            "stage": "cutting",
+            "current_unit": None,
+            "stitching_completed": False,
+            "received_operations": [],
+            "created_by": "admin",
+            "updated_by": None,
+            "created_at": self.iso(cutting_date)
+        }
+        order.update(self.payment_fields(total_cutting_amount, settled=cutting_date < self.now - timedelta(days=30)))
+        return order
+
+    def generate_outsourcing_order(self, seq, cutting_orders, operation_type, dc_date, received):
+        combined = {}
+        lot_details = []
+        for cutting_order in cutting_orders:
+            lot_sizes = cutting_order['size_distribution']
+            lot_details.append({
+                "cutting_order_id": cutting_order['id'],
+                "cutting_lot_number": cutting_order['cutting_lot_number'],
+                "lot_number": cutting_order['lot_number'],
+                "category": cutting_order['category'],
+                "style_type": cutting_order['style_type'],
+                "color": cutting_order['color'],
+                "size_distribution": lot_sizes,
+                "quantity": sum(lot_sizes.values())
+            })
+            for size, qty in lot_sizes.items():
+                combined[size] = combined.get(size, 0) + qty
+            cutting_order['completed_operations'].append(operation_type)
+
+        total_quantity = sum(combined.values())
+        rate_per_pcs = round(self.rng.uniform(2, 14) if operation_type == "Stitching" else self.rng.uniform(0.5, 5), 2)
+        total_amount = round(total_quantity * rate_per_pcs, 2)
+        cutting_lot_numbers = [c['cutting_lot_number'] for c in cutting_orders]
+        order = {
+            "id": self.uid(),
+            "dc_number": self.dc_number("DC", dc_date, seq),
+            "dc_date": self.iso(dc_date),
+            "cutting_order_id": cutting_orders[0]['id'],
+            "cutting_order_ids": [c['id'] for c in cutting_orders],
+            "cutting_lot_number": ', '.join(cutting_lot_numbers),
+            "cutting_lot_numbers": cutting_lot_numbers,
+            "receipt_ids": [],
+            "lot_details": lot_details,
+            "lot_number": ', '.join(sorted({c['lot_number'] for c in cutting_orders})),
+            "color": ', '.join(sorted({c['color'] for c in cutting_orders})),
+            "category": ', '.join(sorted({c['category'] for c in cutting_orders})),
+            "style_type": ', '.join(sorted({c['style_type'] for c in cutting_orders})),
+            "operation_type": operation_type,
+            "unit_name": self.rng.choice(self.units[operation_type]),
+            "size_distribution": combined,
+            "total_quantity": total_quantity,
+            "rate_per_pcs": rate_per_pcs,
+            "total_amount": total_amount,
+            "notes": "",
+            "status": "Sent",
+            "whatsapp_sent": self.rng.random() < 0.5,
+            "created_by": "admin",
+            "updated_by": None,
+            "created_at": self.iso(dc_date)
+        }
+        order.update(self.payment_fields(total_amount, settled=received))
+        for cutting_order in cutting_orders:
+            cutting_order['outsourcing_order_ids'].append(order['id'])
+            self.lot_dcs.setdefault(cutting_order['id'], []).append(order)
+        return order
+
+    def set_lot_stage(self, cutting_order):
+        """Stage fields as the transition endpoints leave them, once the lot's chain is generated"""
+        dcs = sorted(self.lot_dcs.pop(cutting_order['id'], []), key=lambda dc: dc['created_at'])
+        received = [dc for dc in dcs if dc['status'] == 'Received']
+        cutting_order['received_operations'] = sorted({dc['operation_type'] for dc in received})
+        cutting_order['stitching_completed'] = 'Stitching' in cutting_order['received_operations']
+        if cutting_order['stock_id']:
+            cutting_order['stage'] = "stock"
+        elif cutting_order['ironing_order_id']:
+            cutting_order['stage'] = "ironing"
+            cutting_order['current_unit'] = self.ironing_units[cutting_order['ironing_order_id']]
+        elif dcs:
+            latest = dcs[-1]
+            cutting_order['stage'] = "received" if latest['status'] == 'Received' else "outsourcing"
+            if cutting_order['stage'] == "outsourcing":
+                cutting_order['current_unit'] = latest['unit_name']
+
+    def generate_outsourcing_receipt(self, order, receipt_date):
+        sent = order['size_distribution']
+        received = self.received_from(sent)
+        shortage = self.shortage_of(sent, received)
+        mistakes = {}
+        if self.rng.random() < 0.05:
+            size = self.rng.choice(list(received.keys()))
+            mistakes[size] = min(received[size], self.rng.randint(1, 4))
+        total_shortage = sum(shortage.values())
+        total_mistakes = sum(mistakes.values())
+        rate = order['rate_per_pcs']
+        order['status'] = 'Received' if total_shortage == 0 else 'Partial'
+        receipt_id = self.uid()
+        order['receipt_ids'].append(receipt_id)
+        return {
+            "id": receipt_id,
+            "outsourcing_order_id": order['id'],
+            "cutting_order_ids": order['cutting_order_ids'],
+            "cutting_lot_number": order['cutting_lot_number'],
+            "dc_number": order['dc_number'],
+            "receipt_date": self.iso(receipt_date),
+            "unit_name": order['unit_name'],
+            "operation_type": order['operation_type'],
+            "sent_distribution": sent,
+            "received_distribution": received,
+            "shortage_distribution": shortage,
+            "mistake_distribution": mistakes,
+            "total_sent": order['total_quantity'],
+            "total_received": sum(received.values()),
+            "total_shortage": total_shortage,
+            "total_mistakes": total_mistakes,
+            "rate_per_pcs": rate,
+            "shortage_debit_amount": round(total_shortage * rate, 2),
+            "mistake_debit_amount": round(total_mistakes * rate, 2),
+            "sent_to_ironing": False,
+            "created_at": self.iso(receipt_date)
+        }
+
+    def master_pack_ratio(self, category):
+        sizes = SIZES[category]
+        per_size = 1 if len(sizes) > 4 else self.rng.choice([1, 2])
+        return {size: per_size for size in sizes}
+
+    def generate_ironing(self, seq, cutting_order, stitching_receipt, dc_date, received_date):
+        """Ironing order, its receipt (if received) and the auto-created stock entry"""
+        size_distribution = stitching_receipt['received_distribution']
+        total_quantity = sum(size_distribution.values())
+        rate_per_pcs = round(self.rng.uniform(0.8, 2.5), 2)
+        total_amount = round(total_quantity * rate_per_pcs, 2)
+        master_pack_ratio = self.master_pack_ratio(cutting_order['category'])
+        complete_packs, loose_pieces, loose_distribution = calculate_master_packs(size_distribution, master_pack_ratio)
+        order = {
+            "id": self.uid(),
+            "dc_number": self.dc_number("IR", dc_date, seq),
+            "dc_date": self.iso(dc_date),
+            "receipt_id": stitching_receipt['id'],
+            "outsourcing_order_id": stitching_receipt['outsourcing_order_id'],
+            "cutting_order_ids": [cutting_order['id']],
+            "stock_id": None,
+            "cutting_lot_number": cutting_order['cutting_lot_number'],
+            "color": cutting_order['color'],
+            "category": cutting_order['category'],
+            "style_type": cutting_order['style_type'],
+            "unit_name": self.rng.choice(self.units["Ironing"]),
+            "size_distribution": size_distribution,
+            "total_quantity": total_quantity,
+            "rate_per_pcs": rate_per_pcs,
+            "total_amount": total_amount,
+            "master_pack_ratio": master_pack_ratio,
+            "complete_packs": complete_packs,
+            "loose_pieces": loose_pieces,
+            "status": "Sent",
+            "whatsapp_sent": False,
+            "stock_lot_name": "",
+            "stock_color": "",
+            "created_by": "admin",
+            "updated_by": None,
+            "created_at": self.iso(dc_date)
+        }
+        order.update(self.payment_fields(total_amount, settled=received_date is not None))
+        stitching_receipt['sent_to_ironing'] = True
+        self.ironing_units[order['id']] = order['unit_name']
+        cutting_order['sent_to_ironing'] = True
+        cutting_order['ironing_order_id'] = order['id']
+
+        if received_date is None:
+            return order, None, None
+
+        received = self.received_from(size_distribution)
+        shortage = self.shortage_of(size_distribution, received)
+        total_received = sum(received.values())
+        total_shortage = sum(shortage.values())
+        complete_packs, loose_pieces, loose_distribution = calculate_master_packs(received, master_pack_ratio)
+        order['status'] = 'Received'
+        receipt = {
+            "id": self.uid(),
+            "ironing_order_id": order['id'],
+            "cutting_lot_number": order['cutting_lot_number'],
+            "dc_number": order['dc_number'],
+            "receipt_date": self.iso(received_date),
+            "unit_name": order['unit_name'],
+            "sent_distribution": size_distribution,
+            "received_distribution": received,
+            "shortage_distribution": shortage,
+            "mistake_distribution": {},
+            "total_sent": total_quantity,
+            "total_received": total_received,
+            "total_shortage": total_shortage,
+            "total_mistakes": 0,
+            "rate_per_pcs": rate_per_pcs,
+            "shortage_debit_amount": round(total_shortage * rate_per_pcs, 2),
+            "mistake_debit_amount": 0.0,
+            "master_pack_ratio": master_pack_ratio,
+            "complete_packs": complete_packs,
+            "loose_pieces": loose_pieces,
+            "loose_pieces_distribution": loose_distribution,
+            "created_at": self.iso(received_date)
+        }
+        stock = self.new_stock(
+            lot_number=order['cutting_lot_number'],
+            source="ironing",
+            category=order['category'],
+            style_type=order['style_type'],
+            color=order['color'],
+            size_distribution=received,
+            master_pack_ratio=master_pack_ratio,
+            created_at=received_date,
+            notes=f"Auto-created from ironing receipt - DC: {order['dc_number']}"
+        )
+        stock['source_ironing_receipt_id'] = receipt['id']
+        stock['ironing_order_id'] = order['id']
+        stock['cutting_order_ids'] = [cutting_order['id']]
+        order['stock_id'] = receipt['stock_id'] = cutting_order['stock_id'] = stock['id']
+        return order, receipt, stock
+
+    def new_stock(self, lot_number, source, category, style_type, color, size_distribution, master_pack_ratio, created_at, notes):
+        self.stock_seq += 1
+        total_quantity = sum(size_distribution.values())
+        complete_packs, loose_pieces, loose_distribution = calculate_master_packs(size_distribution, master_pack_ratio)
+        return {
+            "id": self.uid(),
+            "stock_code": f"STK-{str(self.stock_seq).zfill(4)}",
+            "lot_number": lot_number,
+            "source": source,
+            "category": category,
+            "style_type": style_type,
+            "color": color,
+            "size_distribution": dict(size_distribution),
+            "total_quantity": total_quantity,
+            "available_quantity": total_quantity,
+            "master_pack_ratio": master_pack_ratio,
+            "complete_packs": complete_packs,
+            "loose_pieces": loose_pieces,
+            "loose_distribution": loose_distribution,
+            "notes": notes,
+            "is_active": True,
+            "created_by": "admin",
+            "created_at": self.iso(created_at),
+            "updated_at": None
+        }
+
+    def generate_pipeline(self, cutting_lots, outsourcing_orders, stock_target):
+        """Cutting lots with their outsourcing, ironing and stock chain, oldest first"""
+        orders_per_lot = max(1.0, outsourcing_orders / max(cutting_lots, 1))
+        # The oldest lots are the ones that already reached stock
+        finished_lots = min(cutting_lots, stock_target)
+        lots_per_fabric = 4
+        span = (self.now - self.start).total_seconds()
+
+        stock_entries = []
+        fabric_lot = None
+        fabric_seq = 0
+        order_seq = 0
+        pending_multi = []
+
+        for i in range(cutting_lots):
+            # Cutting dates advance steadily through the history window
+            cutting_date = self.start + timedelta(seconds=span * (i / max(cutting_lots, 1)) * 0.97)
+
+            if fabric_lot is None or fabric_lot['_cuts_left'] <= 0:
+                if fabric_lot is not None:
+                    self.add_fabric_lot(fabric_lot)
+                fabric_seq += 1
+                fabric_lot = self.generate_fabric_lot(fabric_seq, cutting_date - timedelta(days=2), lots_per_fabric)
+
+            cutting_order = self.generate_cutting_order(i + 1, fabric_lot, cutting_date)
+            age_days = (self.now - cutting_date).days
+
+            # Embellishment rounds before stitching, sized to hit the requested order volume
+            extra_rounds = int(orders_per_lot - 1)
+            if self.rng.random() < (orders_per_lot - 1) - extra_rounds:
+                extra_rounds += 1
+            operations = self.rng.sample(EMBELLISHMENTS, min(extra_rounds, len(EMBELLISHMENTS))) + ["Stitching"]
+
+            step_date = cutting_date
+            stitching_receipt = None
+            for operation_type in operations:
+                if age_days < 2 or step_date >= self.now - timedelta(days=1):
+                    break
+                dc_date = self.after(step_date, 0.5, 2)
+                receipt_date = self.after(dc_date, 3, RETURN_WINDOW_DAYS + 5)
+                received = receipt_date < self.now - timedelta(hours=12)
+
+                # Some embellishment DCs carry several lots to the same unit
+                if operation_type != "Stitching" and self.rng.random() < 0.1:
+                    pending_multi.append((cutting_order, operation_type, dc_date, receipt_date, received))
+                    step_date = receipt_date if received else self.now
+                    if not received:
+                        break
+                    continue
+
+                order_seq += 1
+                order = self.generate_outsourcing_order(order_seq, [cutting_order], operation_type, dc_date, received)
+                if received:
+                    receipt = self.generate_outsourcing_receipt(order, receipt_date)
+                    if operation_type == "Stitching":
+                        stitching_receipt = receipt
+                    else:
+                        self.add("outsourcing_receipts", receipt)
+                self.add("outsourcing_orders", order)
+                if not received:
+                    break
+                step_date = receipt_date
+
+            self.flush_multi_lot(pending_multi, order_seq)
+            order_seq += len(pending_multi)
+            pending_multi = []
+
+            if stitching_receipt is not None:
+                ironing_date = self.after(step_date, 0.5, 2)
+                ironing_received = self.after(ironing_date, 1, 4) if i < finished_lots else None
+                if ironing_date < self.now:
+                    order, receipt, stock = self.generate_ironing(order_seq, cutting_order, stitching_receipt, ironing_date, ironing_received)
+                    self.add("ironing_orders", order)
+                    if receipt:
+                        self.add("ironing_receipts", receipt)
+                        stock_entries.append(stock)
+                self.add("outsourcing_receipts", stitching_receipt)
+
+            self.set_lot_stage(cutting_order)
+            self.add("cutting_orders", cutting_order)
+
+        if fabric_lot is not None:
+            self.add_fabric_lot(fabric_lot)
+
+        # Historical stock entries make up any shortfall against the requested stock volume
+        while len(stock_entries) < stock_target:
+            category = self.rng.choice(list(SIZES.keys()))
+            stock_entries.append(self.new_stock(
+                lot_number=f"OLD-{self.rng.randint(1, 9999):04d}",
+                source="historical",
+                category=category,
+                style_type=self.rng.choice(STYLES),
+                color=self.rng.choice(COLORS),
+                size_distribution=self.size_distribution(category, 10, 80),
+                master_pack_ratio=self.master_pack_ratio(category),
+                created_at=self.start + timedelta(days=self.rng.uniform(0, 30)),
+                notes="Historical stock"
+            ))
+        return stock_entries
+
+    def flush_multi_lot(self, pending, seq):
+        """Group queued embellishment sends by operation into multi-lot DCs"""
+        by_operation = {}
+        for entry in pending:
+            by_operation.setdefault(entry[1], []).append(entry)
+        for offset, (operation_type, entries) in enumerate(by_operation.items()):
+            _, _, dc_date, receipt_date, received = entries[0]
+            order = self.generate_outsourcing_order(seq + offset + 1, [e[0] for e in entries], operation_type, dc_date, received)
+            if received:
+                self.add("outsourcing_receipts", self.generate_outsourcing_receipt(order, receipt_date))
+            self.add("outsourcing_orders", order)
+
+    # ==================== DISPATCH ====================
+
+    def generate_dispatches(self, stock_entries, dispatch_target):
+        """Bulk dispatches drawn from stock; stock quantities are reduced to match"""
+        open_stock = [s for s in stock_entries if s['available_quantity'] > 0]
+        span_start = self.now - timedelta(days=max(1, (self.now - self.start).days // 2))
+        span = (self.now - span_start).total_seconds()
+
+        for i in range(dispatch_target):
+            if not open_stock:
+                break
+            dispatch_date = span_start + timedelta(seconds=span * (i / max(dispatch_target, 1)))
+            items = []
+            grand_total = 0
+            for _ in range(self.rng.randint(1, 4)):
+                if not open_stock:
+                    break
+                index = self.rng.randrange(len(open_stock))
+                stock = open_stock[index]
+                item = self.draw_from_stock(stock)
+                if item is None:
+                    open_stock[index] = open_stock[-1]
+                    open_stock.pop()
+                    continue
+                items.append(item)
+                grand_total += item['total_quantity']
+                if stock['available_quantity'] <= 0:
+                    open_stock[index] = open_stock[-1]
+                    open_stock.pop()
+            if not items:
+                continue
+
+            self.add("bulk_dispatches", {
+                "id": self.uid(),
+                "dispatch_number": self.dc_number("DSP", dispatch_date, i),
+                "dispatch_date": self.iso(dispatch_date),
+                "customer_name": self.rng.choice(CUSTOMERS),
+                "bora_number": f"B-{self.rng.randint(1, 999):03d}",
+                "items": items,
+                "total_items": len(items),
+                "grand_total_quantity": grand_total,
+                "notes": None,
+                "remarks": None,
+                "created_by": "admin",
+                "created_at": self.iso(dispatch_date)
+            })
+
+    def draw_from_stock(self, stock):
+        ratio = stock['master_pack_ratio']
+        sizes = stock['size_distribution']
+        complete_packs, _, _ = calculate_master_packs(sizes, ratio)
+        master_packs = min(complete_packs, self.rng.randint(1, 5)) if complete_packs else 0
+
+        dispatched = {size: master_packs * qty for size, qty in ratio.items()}
+        loose_pcs = {}
+        if self.rng.random() < 0.3:
+            size = self.rng.choice(list(sizes.keys()))
+            spare = sizes[size] - dispatched.get(size, 0)
+            if spare > 0:
+                loose_pcs[size] = min(spare, self.rng.randint(1, 6))
+                dispatched[size] = dispatched.get(size, 0) + loose_pcs[size]
+
+        total = sum(dispatched.values())
+        if total == 0:
+            return None
+
+        for size, qty in dispatched.items():
+            sizes[size] = max(0, sizes.get(size, 0) - qty)
+        stock['available_quantity'] -= total
+        packs, loose, loose_distribution = calculate_master_packs(sizes, ratio)
+        stock['complete_packs'] = packs
+        stock['loose_pieces'] = loose
+        stock['loose_distribution'] = loose_distribution
+        stock['updated_at'] = self.iso(self.now)
+
+        return {
+            "stock_id": stock['id'],
+            "stock_code": stock['stock_code'],
+            "lot_number": stock['lot_number'],
+            "category": stock['category'],
+            "style_type": stock['style_type'],
+            "color": stock['color'],
+            "master_packs": master_packs,
+            "loose_pcs": loose_pcs,
+            "master_pack_ratio": ratio,
+            "size_distribution": {size: qty for size, qty in dispatched.items() if qty > 0},
+            "total_quantity": total
+        }
+
+
+# Same pack arithmetic as server.calculate_master_packs (kept local so the script
+# does not need the API's environment to import)
+def calculate_master_packs(size_distribution, master_pack_ratio):
+    if not master_pack_ratio or not size_distribution:
+        return 0, sum(size_distribution.values()), size_distribution.copy()
+    complete_packs = min(
+        (size_distribution.get(size, 0) // qty for size, qty in master_pack_ratio.items() if qty > 0),
+        default=0
+    )
+    if complete_packs == 0:
+        return 0, sum(size_distribution.values()), size_distribution.copy()
+    loose = {size: qty - complete_packs * master_pack_ratio.get(size, 0) for size, qty in size_distribution.items()}
+    return int(complete_packs), sum(loose.values()), loose
+
+
+GENERATED_COLLECTIONS = [
+    "fabric_types", "suppliers", "outsourcing_units", "fabric_lots", "fabric_rolls", "cutting_orders",
+    "outsourcing_orders", "outsourcing_receipts", "ironing_orders", "ironing_receipts",
+    "stock", "bulk_dispatches", "search_index", "daily_rollups"
+]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate a synthetic large-factory dataset")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier applied to every volume below")
+    parser.add_argument("--cutting-lots", type=int, default=DEFAULT_CUTTING_LOTS)
+    parser.add_argument("--outsourcing-orders", type=int, default=DEFAULT_OUTSOURCING_ORDERS)
+    parser.add_argument("--stock", type=int, default=DEFAULT_STOCK)
+    parser.add_argument("--dispatches", type=int, default=DEFAULT_DISPATCHES)
+    parser.add_argument("--history-days", type=int, default=3 * 365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME'), help="Target database (defaults to DB_NAME)")
+    parser.add_argument("--drop", action="store_true", help="Drop the generated collections first")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mongo_url = os.environ.get('MONGO_URL')
+    if not mongo_url or not args.db_name:
+        print("MONGO_URL and DB_NAME (or --db-name) must be set")
+        return 1
+
+    db = MongoClient(mongo_url)[args.db_name]
+    if args.drop:
+        for name in GENERATED_COLLECTIONS:
+            db[name].drop()
+
+    cutting_lots = int(args.cutting_lots * args.scale)
+    outsourcing_orders = int(args.outsourcing_orders * args.scale)
+    stock_target = int(args.stock * args.scale)
+    dispatches = int(args.dispatches * args.scale)
+
+    print(f"🏭 Generating into {args.db_name}: {cutting_lots} cutting lots, ~{outsourcing_orders} outsourcing orders, "
+          f"{stock_target} stock entries, {dispatches} dispatches (seed {args.seed})")
+    started = time.perf_counter()
+
+    generator = ScaleDataGenerator(db, args.seed, args.batch_size, args.history_days)
+    generator.generate_master_data()
+    stock_entries = generator.generate_pipeline(cutting_lots, outsourcing_orders, stock_target)
+    generator.generate_dispatches(stock_entries, dispatches)
+    for stock in stock_entries:
+        generator.add("stock", stock)
+    generator.flush()
+    generator.add_rollups()
+
+    elapsed = time.perf_counter() - started
+    for name in GENERATED_COLLECTIONS:
+        print(f"   {name}: {generator.counts.get(name, 0)}")
+    print(f"✅ Done in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
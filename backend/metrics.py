@@ -0,0 +1,281 @@
+"""
+Prometheus-style metrics in the text exposition format.
+
+Deliberately dependency-free: each metric is a dict of label tuples guarded by a
+lock, so recording costs a dict lookup and an add. Route labels use the templated
+path (/api/stock/{stock_id}) to keep cardinality bounded.
+"""
+
+import asyncio
+import bisect
+import threading
+import time
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ==================== HTTP ====================
+
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_errors_total = Counter(
+    "http_request_errors_total", "Requests that raised or returned a 5xx", ("method", "route"))
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route"))
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "Requests currently being served")
+http_request_size_bytes = Histogram(
+    "http_request_size_bytes", "Request body size by route", ("method", "route"), buckets=SIZE_BUCKETS)
+http_response_size_bytes = Histogram(
+    "http_response_size_bytes", "Response body size by route", ("method", "route"), buckets=SIZE_BUCKETS)
+
+
+def route_template(request) -> str:
+    """Templated path of the matched route, so path parameters do not explode label cardinality"""
+    route = request.scope.get("route")
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+
+
+def _content_length(headers) -> int:
+    try:
+        return int(headers.get("content-length", ""))
+    except ValueError:
+        return -1
+
+
+async def metrics_middleware(request, call_next):
+    started = time.perf_counter()
+    http_requests_in_flight.inc()
+    status = 500
+    response = None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_requests_in_flight.dec()
+        method = request.method
+        route = route_template(request)
+        http_request_duration_seconds.observe(time.perf_counter() - started, method=method, route=route)
+        http_requests_total.inc(method=method, route=route, status=str(status))
+        if status >= 500:
+            http_request_errors_total.inc(method=method, route=route)
+        request_size = _content_length(request.headers)
+        if request_size >= 0:
+            http_request_size_bytes.observe(request_size, method=method, route=route)
+        if response is not None:
+            response_size = _content_length(response.headers)
+            if response_size >= 0:
+                http_response_size_bytes.observe(response_size, method=method, route=route)
+
+
+# ==================== MONGODB POOL ====================
+
+mongo_pool_checkout_wait_seconds = Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled MongoDB connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0))
+mongo_pool_checked_out = Gauge(
+    "mongo_pool_checked_out_connections", "MongoDB connections currently checked out")
+mongo_pool_checkout_failures_total = Counter(
+    "mongo_pool_checkout_failures_total", "Failed MongoDB connection checkouts", ("reason",))
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Times connection checkouts; checkout started/finished fire on the same thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            mongo_pool_checkout_wait_seconds.observe(time.perf_counter() - started)
+            self._local.started = None
+        mongo_pool_checked_out.inc()
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        mongo_pool_checkout_failures_total.inc(reason=str(event.reason))
+
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+pool_listener = PoolMetricsListener()
+
+
+# ==================== CACHES ====================
+
+cache_requests_total = Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit/miss)", ("cache", "result"))
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    cache_requests_total.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# ==================== TRANSITIONS ====================
+
+transition_duration_seconds = Histogram(
+    "transition_duration_seconds", "Stage transition write latency, retries included", ("transition", "mode"))
+transitions_total = Counter(
+    "transitions_total", "Stage transitions by outcome (committed/rejected/failed)", ("transition", "mode", "outcome"))
+transition_retries_total = Counter(
+    "transition_retries_total", "Transaction attempts retried after a transient error", ("transition",))
+
+
+def record_transition(name: str, mode: str, seconds: float, attempts: int, outcome: str):
+    transition_duration_seconds.observe(seconds, transition=name, mode=mode)
+    transitions_total.inc(transition=name, mode=mode, outcome=outcome)
+    if attempts > 1:
+        transition_retries_total.inc(attempts - 1, transition=name)
+
+
+# ==================== EVENT LOOP ====================
+
+event_loop_lag_seconds = Gauge(
+    "event_loop_lag_seconds", "Most recent event loop scheduling delay")
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds_distribution", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Measure how late a fixed sleep wakes up; the overshoot is time the loop spent blocked"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - scheduled - interval)
+        event_loop_lag_seconds.set(lag)
+        event_loop_lag.observe(lag)
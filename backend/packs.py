@@ -0,0 +1,51 @@
+"""
+Vectorised master-pack breakdown for many stock entries at once.
+
+Per document, complete packs = min over sizes with a positive ratio of
+(quantity // ratio), and loose pieces are what is left after those packs. For a
+backfill or a ratio change across tens of thousands of entries this builds a
+size matrix and a ratio matrix over the union of sizes and does the division in
+one NumPy pass instead of a Python loop per document.
+
+NumPy is imported on first use so it stays off the API's startup path.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+
+def batch_pack_breakdown(entries: Sequence[Tuple[Dict[str, int], Dict[str, int]]]) -> List[dict]:
+    """(size_distribution, master_pack_ratio) pairs -> complete_packs / loose_pieces / loose_distribution,
+    matching calculate_master_packs for every entry"""
+    import numpy as np
+
+    if not entries:
+        return []
+
+    sizes = sorted({size for distribution, ratio in entries for size in (distribution or {})} |
+                   {size for distribution, ratio in entries for size in (ratio or {})})
+    column = {size: i for i, size in enumerate(sizes)}
+    quantities = np.zeros((len(entries), len(sizes)), dtype=np.int64)
+    ratios = np.zeros((len(entries), len(sizes)), dtype=np.int64)
+    for row, (distribution, ratio) in enumerate(entries):
+        for size, qty in (distribution or {}).items():
+            quantities[row, column[size]] = qty
+        for size, qty in (ratio or {}).items():
+            ratios[row, column[size]] = qty
+
+    in_pack = ratios > 0
+    per_size = np.where(in_pack, quantities // np.where(in_pack, ratios, 1), np.iinfo(np.int64).max)
+    packs = per_size.min(axis=1, initial=np.iinfo(np.int64).max)
+    # No positive ratio (or no sizes at all) means no packs
+    packs = np.where(in_pack.any(axis=1), np.maximum(packs, 0), 0)
+    loose = quantities - packs[:, None] * np.where(in_pack, ratios, 0)
+
+    results = []
+    for row, (distribution, _) in enumerate(entries):
+        distribution = distribution or {}
+        loose_distribution = {size: int(loose[row, column[size]]) for size in distribution}
+        results.append({
+            "complete_packs": int(packs[row]),
+            "loose_pieces": sum(loose_distribution.values()),
+            "loose_distribution": loose_distribution,
+        })
+    return results
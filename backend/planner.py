@@ -0,0 +1,106 @@
+"""
+Dispatch allocation planning.
+
+Given candidate stock entries (oldest first) and an order expressed either as a
+number of master packs or as pieces per size, choose which entries to draw from
+and how much to take from each:
+
+* as few stock entries as possible (greedy: take the entry that covers the most
+  of what is still needed, but when one entry can finish the order, take the
+  oldest such entry);
+* complete master packs before loose pieces;
+* FIFO by created_at among otherwise equal choices, so old stock leaves first.
+
+Candidates are plain stock documents carrying size_distribution,
+master_pack_ratio and the stored complete_packs.
+"""
+
+from typing import Dict, List, Tuple
+
+
+def plan_pack_count(candidates: List[dict], packs: int) -> Tuple[List[dict], int]:
+    """Allocate a number of master packs; returns (lines, packs still unallocated)"""
+    pool = [stock for stock in candidates if (stock.get("complete_packs") or 0) > 0]
+    lines = []
+    remaining = packs
+    while remaining > 0 and pool:
+        finishing = next((stock for stock in pool if stock["complete_packs"] >= remaining), None)
+        # max() keeps the first (oldest) of equally large entries
+        chosen = finishing or max(pool, key=lambda stock: stock["complete_packs"])
+        take = min(chosen["complete_packs"], remaining)
+        pool.remove(chosen)
+        remaining -= take
+        ratio = chosen.get("master_pack_ratio") or {}
+        lines.append(_line(chosen, take, {}, {size: take * qty for size, qty in ratio.items() if qty > 0}))
+    return sorted(lines, key=lambda line: line["created_at"] or ""), remaining
+
+
+def _size_mix_take(stock: dict, remaining: Dict[str, int]) -> Tuple[int, Dict[str, int]]:
+    """Packs that fit inside what is still needed, then loose pieces for the rest"""
+    sizes = stock.get("size_distribution") or {}
+    ratio = {size: qty for size, qty in (stock.get("master_pack_ratio") or {}).items() if qty > 0}
+    packs = 0
+    if ratio:
+        packs = min(
+            [stock.get("complete_packs") or 0] + [remaining.get(size, 0) // qty for size, qty in ratio.items()]
+        )
+    loose = {}
+    for size, need in remaining.items():
+        after_packs = need - packs * ratio.get(size, 0)
+        spare = sizes.get(size, 0) - packs * ratio.get(size, 0)
+        take = min(after_packs, spare)
+        if take > 0:
+            loose[size] = take
+    return packs, loose
+
+
+def _covered(stock: dict, packs: int, loose: Dict[str, int]) -> int:
+    ratio = stock.get("master_pack_ratio") or {}
+    return packs * sum(qty for qty in ratio.values() if qty > 0) + sum(loose.values())
+
+
+def plan_size_mix(candidates: List[dict], size_mix: Dict[str, int]) -> Tuple[List[dict], Dict[str, int]]:
+    """Allocate pieces per size; returns (lines, pieces per size still unallocated)"""
+    remaining = {size: qty for size, qty in size_mix.items() if qty > 0}
+    pool = list(candidates)
+    lines = []
+    while remaining and pool:
+        needed = sum(remaining.values())
+        best = None
+        for stock in pool:
+            packs, loose = _size_mix_take(stock, remaining)
+            covered = _covered(stock, packs, loose)
+            if covered == needed:
+                best = (stock, packs, loose, covered)
+                break
+            if covered > 0 and (best is None or covered > best[3]):
+                best = (stock, packs, loose, covered)
+        if best is None:
+            break
+        stock, packs, loose, _ = best
+        pool.remove(stock)
+        ratio = stock.get("master_pack_ratio") or {}
+        pieces = {size: packs * ratio.get(size, 0) + loose.get(size, 0) for size in set(ratio) | set(loose)}
+        pieces = {size: qty for size, qty in pieces.items() if qty > 0}
+        for size, qty in pieces.items():
+            left = remaining.get(size, 0) - qty
+            if left > 0:
+                remaining[size] = left
+            else:
+                remaining.pop(size, None)
+        lines.append(_line(stock, packs, loose, pieces))
+    return sorted(lines, key=lambda line: line["created_at"] or ""), remaining
+
+
+def _line(stock: dict, packs: int, loose: Dict[str, int], pieces: Dict[str, int]) -> dict:
+    return {
+        "stock_id": stock["id"],
+        "stock_code": stock.get("stock_code"),
+        "lot_number": stock.get("lot_number"),
+        "color": stock.get("color", ""),
+        "created_at": stock.get("created_at"),
+        "master_packs": packs,
+        "loose_pcs": loose,
+        "size_distribution": pieces,
+        "total_quantity": sum(pieces.values()),
+    }
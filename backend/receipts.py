@@ -0,0 +1,58 @@
+"""
+Shortage, mistake and debit arithmetic for outsourcing and ironing receipts.
+
+Per receipt, the shortage of a size is what was sent minus what came back when
+that is positive (a size that was not sent cannot be short), and the debits are
+the shortage and mistake piece counts times the DC's rate. A unit returning
+dozens of DCs at once is one sent matrix, one received matrix and one mistake
+matrix over the union of sizes, so the whole batch is a single NumPy pass.
+
+NumPy is imported on first use so it stays off the API's startup path.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+ReceiptRow = Tuple[Dict[str, int], Dict[str, int], Optional[Dict[str, int]], float]
+
+
+def batch_receipt_totals(rows: Sequence[ReceiptRow]) -> List[dict]:
+    """(sent, received, mistakes, rate) per receipt -> shortage_distribution, totals and debit amounts"""
+    import numpy as np
+
+    if not rows:
+        return []
+
+    sizes = sorted({size for sent, received, mistakes, _ in rows
+                    for distribution in (sent, received, mistakes) for size in (distribution or {})})
+    column = {size: i for i, size in enumerate(sizes)}
+    matrices = np.zeros((3, len(rows), len(sizes)), dtype=np.int64)
+    for row, (sent, received, mistakes, _) in enumerate(rows):
+        for plane, distribution in enumerate((sent, received, mistakes)):
+            for size, qty in (distribution or {}).items():
+                matrices[plane, row, column[size]] = qty
+    sent, received, mistakes = matrices
+
+    shortage = np.where(sent - received > 0, sent - received, 0)
+    totals = np.stack([sent.sum(axis=1), received.sum(axis=1), shortage.sum(axis=1), mistakes.sum(axis=1)], axis=1)
+
+    results = []
+    for row, (sent_distribution, _, _, rate) in enumerate(rows):
+        total_sent, total_received, total_shortage, total_mistakes = (int(value) for value in totals[row])
+        results.append({
+            # Keyed in the DC's own size order, as the per-receipt loop produced it
+            "shortage_distribution": {size: int(shortage[row, column[size]]) for size in sent_distribution
+                                      if shortage[row, column[size]] > 0},
+            "total_sent": total_sent,
+            "total_received": total_received,
+            "total_shortage": total_shortage,
+            "total_mistakes": total_mistakes,
+            # Python rounding on the Python float, so amounts match what was stored before
+            "shortage_debit_amount": round(total_shortage * (rate or 0), 2),
+            "mistake_debit_amount": round(total_mistakes * (rate or 0), 2),
+        })
+    return results
+
+
+def receipt_totals(sent: Dict[str, int], received: Dict[str, int], mistakes: Optional[Dict[str, int]], rate: float) -> dict:
+    """Totals for a single receipt"""
+    return batch_receipt_totals([(sent, received, mistakes, rate)])[0]
@@ -0,0 +1,74 @@
+"""
+QR code and barcode rendering.
+
+qrcode, python-barcode and PIL are imported on first use rather than at module
+load, so workers that only serve JSON never pay their import time or memory.
+Set WARM_RENDERING=1 to load them in the background at startup instead, when
+the first label request should not absorb the cost.
+"""
+
+import io
+import logging
+import os
+import time
+
+QR_BOX_SIZE = 10
+QR_BORDER = 4
+BARCODE_OPTIONS = {
+    'module_width': 0.3,
+    'module_height': 10,
+    'font_size': 10,
+    'text_distance': 5,
+    'quiet_zone': 3
+}
+
+
+def qr_png(data: str) -> bytes:
+    """Render data as a black-on-white QR code PNG"""
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, box_size=QR_BOX_SIZE, border=QR_BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def code128_png(value: str, options: dict = None) -> bytes:
+    """Render value as a Code128 barcode PNG"""
+    import barcode
+    from barcode.writer import ImageWriter
+
+    code128 = barcode.get_barcode_class('code128')
+    barcode_instance = code128(value, writer=ImageWriter())
+
+    buffer = io.BytesIO()
+    barcode_instance.write(buffer, options=options or BARCODE_OPTIONS)
+    return buffer.getvalue()
+
+
+def warm_up() -> float:
+    """Import the rendering libraries and render once; returns seconds taken"""
+    started = time.perf_counter()
+    qr_png("warm-up")
+    code128_png("WARMUP")
+    elapsed = time.perf_counter() - started
+    logging.info(f"Rendering libraries warmed up in {elapsed * 1000:.0f}ms")
+    return elapsed
+
+
+def warm_up_enabled() -> bool:
+    return os.environ.get('WARM_RENDERING', '').lower() in ('1', 'true', 'yes')
+
+
+def html_to_pdf(html: str):
+    """Render an HTML document to PDF bytes, or None when WeasyPrint is not installed.
+    CPU-heavy: call it in a worker process, not on the event loop."""
+    try:
+        from weasyprint import HTML
+    except ImportError:
+        return None
+    return HTML(string=html).write_pdf()
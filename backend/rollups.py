@@ -0,0 +1,131 @@
+"""
+Daily production rollups.
+
+A rollup document holds the totals of one (day, category, style_type, unit)
+bucket: pieces cut, sent and received, shortages and mistakes, pieces
+dispatched and the costs behind them. The unit is the outsourcing or ironing
+unit for DCs and receipts, the cutting master for cutting orders and the
+customer for dispatches. Write paths turn each document they change into $inc
+updates on its buckets (the new document's contribution minus the old one's),
+and the backfill folds whole collections into the same buckets, so a period
+report reads a few hundred rows however much history there is. Months are the
+daily rows grouped by their month field.
+"""
+
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+BucketKey = Tuple[str, str, str, str]
+Buckets = Dict[BucketKey, Dict[str, float]]
+
+ROLLUP_FIELDS = [
+    "cutting_lots", "pieces_cut", "fabric_cost", "cutting_cost",
+    "outsourcing_dcs", "outsourcing_sent", "outsourcing_cost",
+    "outsourcing_received", "outsourcing_shortage", "outsourcing_shortage_debit",
+    "outsourcing_mistakes", "outsourcing_mistake_debit",
+    "ironing_dcs", "ironing_sent", "ironing_cost",
+    "ironing_received", "ironing_shortage", "ironing_shortage_debit",
+    "ironing_mistakes", "ironing_mistake_debit",
+    "pieces_dispatched",
+]
+
+
+def day_of(value) -> str:
+    """YYYY-MM-DD of a stored date (ISO string or datetime), the UTC day the reports bucket by"""
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    return (value or "")[:10]
+
+
+def contributions(kind: str, doc: dict, dc: Optional[dict] = None) -> List[Tuple[BucketKey, Dict[str, float]]]:
+    """What one document adds to its buckets; receipts take category and style from their DC"""
+    if kind == "cutting":
+        key = (day_of(doc.get('cutting_date')), doc.get('category') or "", doc.get('style_type') or "",
+               doc.get('cutting_master_name') or "")
+        return [(key, {
+            "cutting_lots": 1,
+            "pieces_cut": doc.get('total_quantity') or 0,
+            "fabric_cost": doc.get('total_fabric_cost') or 0,
+            "cutting_cost": doc.get('total_cutting_amount') or 0,
+        })]
+    if kind in ("outsourcing", "ironing"):
+        # Older scan-created ironing DCs have no dc_date, only sent_date
+        dc_date = doc.get('dc_date') or doc.get('sent_date') or doc.get('created_at')
+        key = (day_of(dc_date), doc.get('category') or "", doc.get('style_type') or "", doc.get('unit_name') or "")
+        return [(key, {
+            f"{kind}_dcs": 1,
+            f"{kind}_sent": doc.get('total_quantity') or 0,
+            f"{kind}_cost": doc.get('total_amount') or 0,
+        })]
+    if kind in ("outsourcing_receipt", "ironing_receipt"):
+        stage = kind[:-len("_receipt")]
+        dc = dc or {}
+        key = (day_of(doc.get('receipt_date')), dc.get('category') or "", dc.get('style_type') or "", doc.get('unit_name') or "")
+        return [(key, {
+            f"{stage}_received": doc.get('total_received') or 0,
+            f"{stage}_shortage": doc.get('total_shortage') or 0,
+            f"{stage}_shortage_debit": doc.get('shortage_debit_amount') or 0,
+            f"{stage}_mistakes": doc.get('total_mistakes') or 0,
+            f"{stage}_mistake_debit": doc.get('mistake_debit_amount') or 0,
+        })]
+    if kind == "dispatch":
+        day = day_of(doc.get('dispatch_date'))
+        return [((day, item.get('category') or "", item.get('style_type') or "", doc.get('customer_name') or ""),
+                 {"pieces_dispatched": item.get('total_quantity') or 0})
+                for item in doc.get('items') or []]
+    raise ValueError(f"Unknown rollup kind: {kind}")
+
+
+def add_contributions(buckets: Buckets, kind: str, doc: Optional[dict], dc: Optional[dict] = None, sign: int = 1) -> Buckets:
+    if doc:
+        for key, fields in contributions(kind, doc, dc):
+            bucket = buckets.setdefault(key, defaultdict(int))
+            for field, value in fields.items():
+                bucket[field] += sign * value
+    return buckets
+
+
+def rollup_delta(kind: str, old: Optional[dict] = None, new: Optional[dict] = None, dc: Optional[dict] = None,
+                 buckets: Optional[Buckets] = None) -> Buckets:
+    """new's contribution minus old's: a create has no old, a delete no new"""
+    buckets = {} if buckets is None else buckets
+    add_contributions(buckets, kind, old, dc, sign=-1)
+    add_contributions(buckets, kind, new, dc)
+    return buckets
+
+
+def _clean(fields: Dict[str, float]) -> Dict[str, float]:
+    # Amounts are stored to the paisa; adding and taking away a float must cancel exactly
+    cleaned = {field: round(value, 2) if isinstance(value, float) else value for field, value in fields.items()}
+    return {field: value for field, value in cleaned.items() if value}
+
+
+def rollup_updates(buckets: Buckets) -> List[UpdateOne]:
+    """One upserting $inc per bucket that changed"""
+    writes = []
+    for (day, category, style_type, unit), fields in buckets.items():
+        increments = _clean(fields)
+        if not increments or not day:
+            continue
+        writes.append(UpdateOne(
+            {"day": day, "category": category, "style_type": style_type, "unit": unit},
+            {"$inc": increments, "$setOnInsert": {"id": str(uuid.uuid4()), "month": day[:7]}},
+            upsert=True
+        ))
+    return writes
+
+
+def rollup_documents(buckets: Buckets) -> List[dict]:
+    """Whole rollup documents, for writing a rebuilt history"""
+    return [{
+        "id": str(uuid.uuid4()),
+        "day": day,
+        "month": day[:7],
+        "category": category,
+        "style_type": style_type,
+        "unit": unit,
+        **_clean(fields),
+    } for (day, category, style_type, unit), fields in buckets.items() if day]
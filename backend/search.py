@@ -0,0 +1,159 @@
+"""
+Normalised prefix search keys.
+
+Searchable documents carry a `search_keys` array: the lower-cased alphanumeric
+tokens of their searchable fields plus every prefix of each token. With a
+multikey index on that array a search box query becomes an indexed equality
+match ({"search_keys": {"$all": terms}}) instead of a set of unanchored regexes
+that scan the whole collection on every keystroke.
+"""
+
+import re
+from typing import Dict, Iterable, List, Sequence
+
+# Prefixes longer than this are not stored; the full token always is
+MAX_PREFIX_LENGTH = 20
+MAX_QUERY_TERMS = 6
+# List searches rank the newest this-many matches; older matches follow unranked, newest first
+SEARCH_CANDIDATE_LIMIT = 500
+
+# Searchable fields per collection; the first field is the document's code and ranks highest
+SEARCH_FIELDS: Dict[str, Sequence[str]] = {
+    "cutting_orders": ("cutting_lot_number", "lot_number", "cutting_master_name", "style_type", "color"),
+    "stock": ("stock_code", "lot_number", "category", "style_type", "color"),
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(value) -> List[str]:
+    if value is None:
+        return []
+    return _TOKEN.findall(str(value).lower())
+
+
+def search_keys(values: Iterable) -> List[str]:
+    """Tokens and token prefixes for a document's searchable values"""
+    keys = set()
+    for value in values:
+        tokens = tokenize(value)
+        # "STK-0007" is also searchable as "stk0007" when typed without the dash
+        compact = "".join(tokens)
+        if len(tokens) > 1:
+            tokens.append(compact)
+        for token in tokens:
+            keys.add(token)
+            for end in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+                keys.add(token[:end])
+    return sorted(keys)
+
+
+def with_search_keys(collection: str, doc: dict) -> dict:
+    """Set doc['search_keys'] from the collection's searchable fields (in place) and return doc"""
+    doc["search_keys"] = search_keys(doc.get(field) for field in SEARCH_FIELDS[collection])
+    return doc
+
+
+def touches_search_fields(collection: str, update: dict) -> bool:
+    return any(field in update for field in SEARCH_FIELDS[collection])
+
+
+def query_terms(search: str) -> List[str]:
+    """Terms a search string must match; punctuation and regex syntax are dropped"""
+    terms = []
+    for token in tokenize(search):
+        term = token[:MAX_PREFIX_LENGTH]
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def search_filter(search: str) -> dict:
+    """Mongo filter for a search string, or {} when it has no searchable characters"""
+    terms = query_terms(search)
+    if not terms:
+        return {}
+    if len(terms) == 1:
+        return {"search_keys": terms[0]}
+    return {"search_keys": {"$all": terms}}
+
+
+def rank(collection: str, doc: dict, terms: List[str]) -> int:
+    """Whole-token matches beat prefix matches; matches on the document's code beat other fields"""
+    fields = SEARCH_FIELDS[collection]
+    code_tokens = set(tokenize(doc.get(fields[0])))
+    code_tokens.add("".join(tokenize(doc.get(fields[0]))))
+    other_tokens = set()
+    for field in fields[1:]:
+        other_tokens.update(tokenize(doc.get(field)))
+    score = 0
+    for term in terms:
+        if term in code_tokens:
+            score += 4
+        elif term in other_tokens:
+            score += 2
+        elif any(token.startswith(term) for token in code_tokens):
+            score += 1
+    return score
+
+
+def rank_results(collection: str, docs: List[dict], search: str) -> List[dict]:
+    """Stable sort by rank, so equally ranked documents keep their newest-first order"""
+    terms = query_terms(search)
+    return sorted(docs, key=lambda doc: -rank(collection, doc, terms))
+
+
+# ==================== GLOBAL SEARCH INDEX ====================
+# One search_index entry per findable document, so a single indexed query can find
+# "that DC" or "that bora" without knowing which screen it belongs to.
+
+SEARCH_INDEX_SOURCES = {
+    "cutting_orders": {
+        "type": "lot", "code": "cutting_lot_number",
+        "fields": SEARCH_FIELDS["cutting_orders"], "detail": ("category", "style_type", "color")},
+    "outsourcing_orders": {
+        "type": "outsourcing_dc", "code": "dc_number",
+        "fields": ("dc_number", "cutting_lot_number", "unit_name", "operation_type"),
+        "detail": ("operation_type", "unit_name", "cutting_lot_number")},
+    "ironing_orders": {
+        "type": "ironing_dc", "code": "dc_number",
+        "fields": ("dc_number", "cutting_lot_number", "unit_name"), "detail": ("unit_name", "cutting_lot_number")},
+    "stock": {
+        "type": "stock", "code": "stock_code",
+        "fields": SEARCH_FIELDS["stock"], "detail": ("lot_number", "style_type", "color")},
+    "bulk_dispatches": {
+        "type": "dispatch", "code": "dispatch_number",
+        "fields": ("dispatch_number", "bora_number", "customer_name"), "detail": ("customer_name", "bora_number")},
+    "catalogs": {
+        "type": "catalog", "code": "catalog_code",
+        "fields": ("catalog_code", "catalog_name", "color"), "detail": ("catalog_name", "color")},
+}
+
+SEARCH_INDEX_TYPES = {source["type"] for source in SEARCH_INDEX_SOURCES.values()}
+
+
+def search_index_entry(collection: str, doc: dict) -> dict:
+    source = SEARCH_INDEX_SOURCES[collection]
+    return {
+        "collection": collection,
+        "entity_id": doc["id"],
+        "type": source["type"],
+        "code": doc.get(source["code"]),
+        "detail": " · ".join(str(doc[field]) for field in source["detail"] if doc.get(field)),
+        "keys": search_keys(doc.get(field) for field in source["fields"]),
+        "created_at": doc.get("created_at"),
+    }
+
+
+def rank_search_hits(hits: List[dict], search: str) -> List[dict]:
+    """Exact code matches first, then code prefix matches, then matches on other fields"""
+    terms = query_terms(search)
+
+    def score(hit):
+        code_tokens = tokenize(hit.get("code"))
+        code_tokens.append("".join(code_tokens))
+        exact = sum(1 for term in terms if term in code_tokens)
+        prefix = sum(1 for term in terms if any(token.startswith(term) for token in code_tokens))
+        return -(exact * 4 + prefix)
+
+    return sorted(hits, key=score)
@@ -10,21 +10,34 @@ import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, validator
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import uuid
 from datetime import datetime, timezone, date, timedelta
-import barcode
-from barcode.writer import ImageWriter
-import qrcode
-from qrcode.image.pil import PilImage
-import io
 import hashlib
 import jwt
 import json
+from collections import defaultdict
 import re
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from db_monitor import command_listener, begin_request, end_request, current_stats
+from profiler import StackSampler, wants_profile, elapsed_ms
+from events import bus, sse_stream, build_event, event_keys
+from search import (with_search_keys, touches_search_fields, search_filter, query_terms, rank, rank_results, SEARCH_FIELDS,
+                    SEARCH_CANDIDATE_LIMIT, SEARCH_INDEX_SOURCES, SEARCH_INDEX_TYPES, search_index_entry, rank_search_hits)
+from packs import batch_pack_breakdown
+from planner import plan_pack_count, plan_size_mix
+from receipts import receipt_totals, batch_receipt_totals
+from activity import ActivityLogger
+from rollups import rollup_delta, rollup_updates, rollup_documents, ROLLUP_FIELDS
+from rendering import qr_png, code128_png, html_to_pdf, warm_up as warm_up_rendering, warm_up_enabled as rendering_warm_up_enabled
+from metrics import metrics_middleware, pool_listener, render_metrics, monitor_event_loop_lag, record_transition, record_cache_lookup
+import asyncio
+import time
+import zlib
+from pymongo import IndexModel, ASCENDING, DESCENDING, UpdateOne, UpdateMany, InsertOne, ReplaceOne, ReturnDocument
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, BulkWriteError, PyMongoError
 
 # Rate limiter for API protection
 limiter = Limiter(key_func=get_remote_address)
@@ -39,7 +52,7 @@ UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[command_listener, pool_listener])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -67,6 +80,101 @@ async def add_security_headers(request: Request, call_next):
     response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
     return response
 
+# ==================== REQUEST PROFILER ====================
+PROFILE_COLLECTION_BYTES = int(os.environ.get('PROFILE_COLLECTION_BYTES', str(64 * 1024 * 1024)))
+
+async def get_profiling_admin(request: Request):
+    """Admin user behind the request's bearer token, or None"""
+    auth_header = request.headers.get("authorization", "")
+    if not auth_header.lower().startswith("bearer "):
+        return None
+    try:
+        payload = decode_token(auth_header[7:])
+    except HTTPException:
+        return None
+    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0, "id": 1, "username": 1, "role": 1})
+    if not user or user.get('role') != 'admin':
+        return None
+    return user
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Sample admin requests that opt in with X-Profile or ?profile=1"""
+    if not wants_profile(request):
+        return await call_next(request)
+    user = await get_profiling_admin(request)
+    if not user:
+        return await call_next(request)
+
+    sampler = StackSampler().start()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        sampler.stop()
+    duration_ms = elapsed_ms(started)
+
+    stats = current_stats()
+    profile_id = str(uuid.uuid4())
+    await db.request_profiles.insert_one({
+        "id": profile_id,
+        "method": request.method,
+        "path": request.url.path,
+        "query": str(request.query_params),
+        "status": response.status_code,
+        "duration_ms": duration_ms,
+        "samples": sampler.samples,
+        "sample_interval_ms": sampler.interval * 1000,
+        "folded": [{"stack": stack, "count": count} for stack, count in sampler.stacks.most_common()],
+        "top_functions": sampler.top_functions(),
+        "db": stats.as_dict() if stats else None,
+        "db_trace": stats.trace if stats else [],
+        "profiled_by": user['username'],
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+async def ensure_profile_collection():
+    """Profiles live in a capped collection so old ones age out on their own"""
+    try:
+        await db.create_collection("request_profiles", capped=True, size=PROFILE_COLLECTION_BYTES)
+    except CollectionInvalid:
+        pass
+
+# ==================== QUERY ACCOUNTING MIDDLEWARE ====================
+request_stats_logger = logging.getLogger("request_stats")
+
+@app.middleware("http")
+async def track_db_commands(request: Request, call_next):
+    """Count database commands per request and report them via Server-Timing"""
+    # Keep the per-command trace only for requests that ask to be profiled
+    stats, token = begin_request(trace=wants_profile(request))
+    try:
+        response = await call_next(request)
+    finally:
+        end_request(token)
+    response.headers["Server-Timing"] = stats.server_timing()
+
+    entry = {"method": request.method, "path": request.url.path, "status": response.status_code, **stats.as_dict()}
+    if stats.over_budget or entry["repeated"]:
+        request_stats_logger.warning(json.dumps(entry))
+    else:
+        request_stats_logger.info(json.dumps(entry))
+    return response
+
+# ==================== METRICS ====================
+# Registered last so it wraps the other middleware and times the whole request
+app.middleware("http")(metrics_middleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if metrics_token and request.headers.get("authorization") != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
 # ==================== INPUT SANITIZATION ====================
 def sanitize_string(value: str, max_length: int = 500) -> str:
     """Sanitize string input to prevent injection attacks"""
@@ -84,59 +192,209 @@ def sanitize_search(value: str) -> str:
     # Escape regex special characters
     return re.escape(value.strip()[:100])
 
+# Idempotency keys from offline scan sync are remembered this long
+SYNC_DEDUP_TTL_DAYS = int(os.environ.get('SYNC_DEDUP_TTL_DAYS', '30'))
+# Audit entries older than this are removed by the activity_logs TTL index
+ACTIVITY_LOG_RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', '365'))
+
 # ==================== DATABASE INDEXES ====================
-# Create indexes on startup for better query performance
-async def create_indexes():
-    """Create database indexes for better performance"""
+# Every index the API relies on, per collection. Startup applies the manifest with one
+# createIndexes command per collection, all collections concurrently, and records a
+# fingerprint so workers booting against an unchanged manifest skip the work.
+INDEX_MANIFEST = {
+    "cutting_orders": [
+        IndexModel([("cutting_lot_number", ASCENDING)], unique=True, sparse=True),
+        IndexModel([("created_at", ASCENDING)]),
+        IndexModel([("category", ASCENDING)]),
+        IndexModel([("search_keys", ASCENDING), ("created_at", DESCENDING)]),
+        # WIP board: $match on stage, $group by stage and unit, summed from the index alone
+        IndexModel([("stage", ASCENDING), ("current_unit", ASCENDING), ("total_quantity", ASCENDING)]),
+        IndexModel([("cutting_date", ASCENDING)]),
+    ],
+    "fabric_lots": [
+        IndexModel([("lot_number", ASCENDING)]),
+        IndexModel([("created_at", ASCENDING)]),
+    ],
+    "fabric_rolls": [
+        IndexModel([("roll_number", ASCENDING)]),
+        IndexModel([("fabric_lot_id", ASCENDING), ("sequence", ASCENDING)]),
+        IndexModel([("fabric_lot_id", ASCENDING), ("roll_number", ASCENDING)], unique=True),
+        IndexModel([("consumed_by", ASCENDING)]),
+        IndexModel([("return_id", ASCENDING)]),
+    ],
+    "fabric_consumption": [
+        IndexModel([("fabric_lot_id", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("cutting_order_id", ASCENDING)]),
+    ],
+    "outsourcing_orders": [
+        IndexModel([("cutting_lot_number", ASCENDING)]),
+        IndexModel([("cutting_order_ids", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("unit_name", ASCENDING)]),
+        # Multikey: each lot of a multi-lot DC is its own index key
+        IndexModel([("cutting_lot_numbers", ASCENDING), ("operation_type", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("dc_date", ASCENDING)]),
+        IndexModel([("payment_status", ASCENDING), ("balance", ASCENDING)]),
+        IndexModel([("dc_date", ASCENDING)]),
+    ],
+    "outsourcing_receipts": [
+        IndexModel([("outsourcing_order_id", ASCENDING)]),
+        IndexModel([("cutting_lot_number", ASCENDING)]),
+    ],
+    "ironing_orders": [
+        IndexModel([("cutting_lot_number", ASCENDING)]),
+        IndexModel([("cutting_order_ids", ASCENDING)]),
+        IndexModel([("receipt_id", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("dc_date", ASCENDING)]),
+        IndexModel([("dc_date", ASCENDING)]),
+    ],
+    "ironing_receipts": [
+        IndexModel([("ironing_order_id", ASCENDING)]),
+    ],
+    "stock": [
+        IndexModel([("stock_code", ASCENDING)], unique=True, sparse=True),
+        IndexModel([("lot_number", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("available_quantity", DESCENDING)]),
+        IndexModel([("available_quantity", ASCENDING)]),
+        IndexModel([("search_keys", ASCENDING), ("is_active", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("category", ASCENDING), ("style_type", ASCENDING), ("color", ASCENDING),
+                    ("is_active", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "bulk_dispatches": [
+        IndexModel([("dispatch_number", ASCENDING)]),
+        IndexModel([("created_at", ASCENDING)]),
+        IndexModel([("dispatch_date", ASCENDING)]),
+    ],
+    # One document per day x category x style x unit; period reports range over day
+    "daily_rollups": [
+        IndexModel([("day", ASCENDING), ("category", ASCENDING), ("style_type", ASCENDING), ("unit", ASCENDING)],
+                   unique=True),
+    ],
+    "catalogs": [
+        IndexModel([("catalog_code", ASCENDING)]),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True),
+    ],
+    "notifications": [
+        IndexModel([("dedup_key", ASCENDING)], unique=True),
+        IndexModel([("active", ASCENDING), ("raised_at", ASCENDING)]),
+    ],
+    "system_meta": [
+        IndexModel([("type", ASCENDING)], unique=True),
+    ],
+    "search_index": [
+        IndexModel([("collection", ASCENDING), ("entity_id", ASCENDING)], unique=True),
+        IndexModel([("keys", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "dc_snapshots": [
+        # DC numbers are not unique (scan DCs are numbered to the second), so versions count per order
+        IndexModel([("order_id", ASCENDING), ("kind", ASCENDING), ("version", DESCENDING)], unique=True),
+        IndexModel([("dc_number", ASCENDING), ("version", DESCENDING)]),
+    ],
+    "activity_logs": [
+        # Newest-first listing, and TTL retention; both need timestamp stored as a BSON date
+        IndexModel([("timestamp", DESCENDING)], expireAfterSeconds=ACTIVITY_LOG_RETENTION_DAYS * 86400),
+        IndexModel([("entity_type", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "sync_operations": [
+        IndexModel([("idempotency_key", ASCENDING)], unique=True),
+        IndexModel([("applied_at", ASCENDING)], expireAfterSeconds=SYNC_DEDUP_TTL_DAYS * 86400),
+    ],
+    "live_events": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=3600),
+    ],
+}
+
+def index_manifest_fingerprint() -> str:
+    """Stable hash of the manifest; changes whenever an index is added or altered"""
+    spec = {
+        collection: [dict(model.document) for model in models]
+        for collection, models in sorted(INDEX_MANIFEST.items())
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+async def apply_collection_indexes(collection: str, models: list) -> list:
+    """Create one collection's indexes in a single command, falling back to one at a time to pinpoint failures"""
+    names = [model.document["name"] for model in models]
     try:
-        # Cutting orders indexes
-        await db.cutting_orders.create_index("cutting_lot_number", unique=True, sparse=True)
-        await db.cutting_orders.create_index("created_at")
-        await db.cutting_orders.create_index("category")
-        
-        # Fabric lots indexes
-        await db.fabric_lots.create_index("lot_number")
-        await db.fabric_lots.create_index("created_at")
-        
-        # Outsourcing indexes
-        await db.outsourcing_orders.create_index("cutting_lot_number")
-        await db.outsourcing_orders.create_index("status")
-        await db.outsourcing_orders.create_index("unit_name")
-        await db.outsourcing_orders.create_index([("cutting_lot_number", 1), ("operation_type", 1)])
-        
-        await db.outsourcing_receipts.create_index("outsourcing_order_id")
-        await db.outsourcing_receipts.create_index("cutting_lot_number")
-        
-        # Ironing indexes
-        await db.ironing_orders.create_index("cutting_lot_number")
-        await db.ironing_orders.create_index("status")
-        
-        await db.ironing_receipts.create_index("ironing_order_id")
-        
-        # Stock indexes
-        await db.stock.create_index("stock_code", unique=True, sparse=True)
-        await db.stock.create_index("lot_number")
-        await db.stock.create_index("is_active")
-        await db.stock.create_index([("is_active", 1), ("available_quantity", -1)])
-        
-        # Dispatch indexes
-        await db.bulk_dispatches.create_index("dispatch_number")
-        await db.bulk_dispatches.create_index("created_at")
-        
-        # Catalog indexes
-        await db.catalogs.create_index("catalog_code")
-        
-        # Users index
-        await db.users.create_index("username", unique=True)
-        
-        logging.info("Database indexes created successfully")
-    except Exception as e:
-        logging.warning(f"Index creation warning (may already exist): {e}")
+        await db[collection].create_indexes(models)
+        return [{"collection": collection, "name": name, "status": "ok"} for name in names]
+    except Exception:
+        results = []
+        for name, model in zip(names, models):
+            try:
+                await db[collection].create_indexes([model])
+                results.append({"collection": collection, "name": name, "status": "ok"})
+            except Exception as e:
+                results.append({"collection": collection, "name": name, "status": "error", "error": str(e)})
+        return results
+
+async def create_indexes(force: bool = False) -> dict:
+    """Apply INDEX_MANIFEST unless the stored fingerprint says it is already in place"""
+    fingerprint = index_manifest_fingerprint()
+    if not force:
+        applied = await db.system_meta.find_one({"type": "index_manifest"}, {"_id": 0})
+        if applied and applied.get('fingerprint') == fingerprint and applied.get('failed', 0) == 0:
+            logging.info(f"Index manifest {fingerprint[:12]} already applied, skipping")
+            return {**applied, "skipped": True}
+
+    started = time.perf_counter()
+    per_collection = await asyncio.gather(*[
+        apply_collection_indexes(collection, models) for collection, models in INDEX_MANIFEST.items()
+    ])
+    results = [result for collection_results in per_collection for result in collection_results]
+    failed = [result for result in results if result['status'] != 'ok']
+    for result in failed:
+        logging.warning(f"Index {result['collection']}.{result['name']} failed: {result['error']}")
+
+    status = {
+        "type": "index_manifest",
+        "fingerprint": fingerprint,
+        "applied_at": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        "total": len(results),
+        "failed": len(failed),
+        "results": results
+    }
+    await db.system_meta.update_one({"type": "index_manifest"}, {"$set": status}, upsert=True)
+    logging.info(f"Index manifest {fingerprint[:12]} applied: {len(results) - len(failed)}/{len(results)} indexes ok in {status['duration_ms']}ms")
+    return {**status, "skipped": False}
 
 @app.on_event("startup")
 async def startup_event():
     """Run on application startup"""
-    await create_indexes()
+    try:
+        await create_indexes()
+    except Exception as e:
+        logging.error(f"Index bootstrap failed: {e}")
+    await ensure_profile_collection()
+    try:
+        await ensure_search_keys()
+    except Exception as e:
+        logging.error(f"search_keys backfill failed: {e}")
+    try:
+        await ensure_cutting_lot_numbers()
+    except Exception as e:
+        logging.error(f"cutting_lot_numbers backfill failed: {e}")
+    try:
+        await ensure_lot_stages()
+    except Exception as e:
+        logging.error(f"Lot stage backfill failed: {e}")
+    try:
+        await ensure_daily_rollups()
+    except Exception as e:
+        logging.error(f"Daily rollup bootstrap failed: {e}")
+    if rendering_warm_up_enabled():
+        # Off the event loop so the warm-up never delays serving
+        asyncio.get_running_loop().run_in_executor(None, warm_up_rendering)
+    app.state.loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+    app.state.notification_task = asyncio.create_task(run_notification_engine())
+    app.state.activity_log_task = asyncio.create_task(activity_logger.run())
+    if EVENT_SOURCE == 'change_stream':
+        app.state.live_events_task = asyncio.create_task(tail_live_events())
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'garment-manufacturing-secret-key-2025')
@@ -228,7 +486,8 @@ class FabricLot(BaseModel):
     total_amount: float
     remaining_quantity: float
     remaining_rib_quantity: float
-    number_of_rolls: Optional[int] = 1
+    number_of_rolls: Optional[int] = 1  # Rolls not returned to the supplier
+    # As received; per-roll weight, status and consumption live in fabric_rolls
     roll_numbers: Optional[List[str]] = []
     roll_weights: Optional[List[float]] = []  # Individual weight of each roll
     scale_readings: Optional[List[float]] = []  # Cumulative scale reading after each roll
@@ -318,6 +577,14 @@ class CuttingOrder(BaseModel):
     catalog_name: Optional[str] = None
     sent_to_ironing: Optional[bool] = False
     completed_operations: Optional[List[str]] = []  # Track operations done (Printing, Stitching, etc.)
+    roll_numbers: Optional[List[str]] = []  # Fabric rolls cut for this order
+    outsourcing_order_ids: Optional[List[str]] = []  # Lineage: DCs this lot went out on
+    ironing_order_id: Optional[str] = None  # Lineage: ironing DC
+    stock_id: Optional[str] = None  # Lineage: stock entry created on ironing receipt
+    stage: Optional[str] = "cutting"  # Kept current by every transition; see LOT_STAGE_RANK
+    current_unit: Optional[str] = None  # Unit holding the lot while it is out on a DC
+    stitching_completed: Optional[bool] = False
+    received_operations: Optional[List[str]] = []  # Operations whose DC came back in full
     created_by: Optional[str] = None
     updated_by: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -339,6 +606,7 @@ class CuttingOrderCreate(BaseModel):
     bundle_distribution: Optional[Dict[str, int]] = {}
     cutting_rate_per_pcs: float
     is_old_lot: Optional[bool] = False  # Flag for old cutting lots without fabric entry
+    roll_numbers: Optional[List[str]] = []  # Fabric rolls cut for this order
 
 class CuttingOrderUpdate(BaseModel):
     cutting_lot_number: Optional[str] = None
@@ -369,6 +637,7 @@ class OutsourcingOrder(BaseModel):
     cutting_order_ids: Optional[List[str]] = []  # Multiple cutting order IDs
     cutting_lot_number: Optional[str] = ""
     cutting_lot_numbers: Optional[List[str]] = []  # Multiple lot numbers
+    receipt_ids: Optional[List[str]] = []  # Lineage: receipts against this DC
     lot_details: Optional[List[Dict]] = []  # Lot-wise details: [{lot_number, cutting_lot_number, category, style_type, color, size_distribution, quantity}]
     lot_number: str  # Fabric lot number
     color: Optional[str] = ""
@@ -430,6 +699,7 @@ class OutsourcingReceipt(BaseModel):
     
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     outsourcing_order_id: str
+    cutting_order_ids: Optional[List[str]] = []  # Lineage: lots on the DC
     dc_number: str
     receipt_date: datetime
     unit_name: str
@@ -454,13 +724,19 @@ class OutsourcingReceiptCreate(BaseModel):
     received_distribution: Dict[str, int]
     mistake_distribution: Optional[Dict[str, int]] = {}  # Mistakes in received goods
 
+class OutsourcingReceiptBulkCreate(BaseModel):
+    receipts: List[OutsourcingReceiptCreate]
+
 class IroningOrder(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     dc_number: str
     dc_date: datetime
-    receipt_id: str  # outsourcing_receipt_id
+    receipt_id: Optional[str] = None  # outsourcing_receipt_id
+    outsourcing_order_id: Optional[str] = None  # Lineage: stitching DC the goods came back on
+    cutting_order_ids: Optional[List[str]] = []  # Lineage: lots on the DC
+    stock_id: Optional[str] = None  # Lineage: stock entry created on receipt
     cutting_lot_number: str
     color: Optional[str] = ""
     category: str
@@ -516,6 +792,7 @@ class IroningReceipt(BaseModel):
     complete_packs: Optional[int] = 0
     loose_pieces: Optional[int] = 0
     loose_pieces_distribution: Optional[Dict[str, int]] = {}
+    stock_id: Optional[str] = None  # Lineage: stock entry created from this receipt
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class IroningReceiptCreate(BaseModel):
@@ -555,6 +832,11 @@ class Stock(BaseModel):
     total_quantity: int
     available_quantity: int
     master_pack_ratio: Optional[Dict[str, int]] = {}  # {"M": 2, "L": 2, ...}
+    complete_packs: Optional[int] = 0  # Kept in step with size_distribution on every write
+    loose_pieces: Optional[int] = 0
+    loose_distribution: Optional[Dict[str, int]] = {}
+    ironing_order_id: Optional[str] = None  # Lineage, for stock created on ironing receipt
+    cutting_order_ids: Optional[List[str]] = []
     notes: Optional[str] = None
     is_active: bool = True
     created_by: Optional[str] = None
@@ -570,6 +852,13 @@ class StockCreate(BaseModel):
     master_pack_ratio: Optional[Dict[str, int]] = {}
     notes: Optional[str] = None
 
+class MasterPackRatioUpdate(BaseModel):
+    master_pack_ratio: Dict[str, int]
+    # At least one filter; the ratio applies to every active stock entry matching all of them
+    category: Optional[str] = None
+    style_type: Optional[str] = None
+    lot_number: Optional[str] = None
+
 class StockDispatch(BaseModel):
     master_packs: int
     loose_pcs: Dict[str, int]
@@ -630,6 +919,54 @@ class BulkDispatchCreate(BaseModel):
     notes: Optional[str] = None
     remarks: Optional[str] = None
 
+class DispatchPlanRequest(BaseModel):
+    # What to send: either a number of master packs or pieces per size
+    master_packs: Optional[int] = None
+    size_mix: Optional[Dict[str, int]] = None
+    # Which stock may be used
+    category: Optional[str] = None
+    style_type: Optional[str] = None
+    color: Optional[str] = None
+    # Copied into the suggested BulkDispatchCreate payload
+    customer_name: Optional[str] = ""
+    bora_number: Optional[str] = ""
+    dispatch_date: Optional[datetime] = None
+    notes: Optional[str] = None
+
+
+# Batch scan models
+class ScanOperation(BaseModel):
+    op: str  # send_outsourcing, receive_outsourcing, create_ironing, receive_ironing
+    lot_number: str
+    unit_name: Optional[str] = None
+    operation_type: Optional[str] = None
+    rate_per_pcs: float = 0
+    expected_return_date: Optional[str] = None
+    master_pack_ratio: Optional[Dict[str, int]] = {}
+    received_distribution: Optional[Dict[str, int]] = {}
+    mistake_distribution: Optional[Dict[str, int]] = {}
+
+class ScanBatch(BaseModel):
+    operations: List[ScanOperation]
+
+class SyncOperation(ScanOperation):
+    idempotency_key: str  # generated on the device when the scan is queued
+    client_timestamp: Optional[str] = None
+
+class SyncBatch(BaseModel):
+    device_id: Optional[str] = None
+    operations: List[SyncOperation]
+
+
+# Bulk QR lookup models
+MAX_BULK_LOOKUP = 500
+
+class StockCodesLookup(BaseModel):
+    codes: List[str]  # in scan order
+
+class LotNumbersLookup(BaseModel):
+    lot_numbers: List[str]  # in scan order
+
 
 # Helper function to calculate master packs
 def calculate_master_packs(size_distribution: Dict[str, int], master_pack_ratio: Dict[str, int]):
@@ -665,6 +1002,29 @@ def calculate_master_packs(size_distribution: Dict[str, int], master_pack_ratio:
     
     return int(complete_packs), total_loose, loose_pieces_distribution
 
+def pack_breakdown(size_distribution: Dict[str, int], master_pack_ratio: Dict[str, int]) -> dict:
+    """The pack fields stored on a stock document"""
+    packs, loose, loose_dist = calculate_master_packs(size_distribution or {}, master_pack_ratio or {})
+    return {"complete_packs": packs, "loose_pieces": loose, "loose_distribution": loose_dist}
+
+def with_master_packs(stock: dict) -> dict:
+    """Stock documents store their pack breakdown; entries written before that was stored get it computed"""
+    if 'loose_distribution' not in stock:
+        stock.update(pack_breakdown(stock.get('size_distribution'), stock.get('master_pack_ratio')))
+    return stock
+
+def validate_bulk_lookup(values: List[str]) -> List[str]:
+    """Distinct values of a bulk QR lookup, enforcing the size limit"""
+    if not values:
+        raise HTTPException(status_code=400, detail="No codes provided")
+    if len(values) > MAX_BULK_LOOKUP:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_LOOKUP} codes per lookup")
+    return list(dict.fromkeys(values))
+
+def bulk_lookup_response(results: list) -> dict:
+    found = sum(1 for r in results if r['status'] == 'ok')
+    return {"total": len(results), "found": found, "missing": len(results) - found, "results": results}
+
 # Helper function to generate DC number
 def generate_dc_number():
     timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
@@ -917,6 +1277,9 @@ async def create_fabric_lot(lot: FabricLotCreate, current_user: dict = Depends(g
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.fabric_lots.insert_one(doc)
+    rolls = build_fabric_rolls(doc)
+    if rolls:
+        await db.fabric_rolls.insert_many(rolls)
     return lot_obj
 
 @api_router.get("/fabric-lots", response_model=List[FabricLot])
@@ -954,15 +1317,6 @@ async def return_fabric_to_supplier(lot_id: str, fabric_return: FabricReturnCrea
     if not fabric_lot:
         raise HTTPException(status_code=404, detail="Fabric lot not found")
     
-    # Validate returned rolls exist
-    lot_rolls = fabric_lot.get('roll_numbers', [])
-    for roll in fabric_return.returned_rolls:
-        if roll not in lot_rolls:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Roll {roll} not found in fabric lot {fabric_lot.get('lot_number', 'N/A')}"
-            )
-    
     # Validate quantity
     if fabric_return.quantity_returned > fabric_lot.get('remaining_quantity', 0):
         raise HTTPException(
@@ -970,45 +1324,39 @@ async def return_fabric_to_supplier(lot_id: str, fabric_return: FabricReturnCrea
             detail=f"Cannot return {fabric_return.quantity_returned}kg. Only {fabric_lot.get('remaining_quantity', 0)}kg remaining in lot."
         )
     
-    # Create return record
     return_dict = fabric_return.model_dump()
     return_dict['id'] = str(uuid.uuid4())
     return_dict['fabric_lot_id'] = lot_id
     return_dict['lot_number'] = fabric_lot.get('lot_number', 'N/A')
     return_dict['return_date'] = datetime.now(timezone.utc)
-    
     return_obj = FabricReturn(**return_dict)
     
-    # Save return record
+    # Claim the rolls first so two returns of the same roll cannot both reduce the lot
+    returned_rolls = list(dict.fromkeys(fabric_return.returned_rolls))
+    await claim_fabric_rolls(fabric_lot, returned_rolls, {"status": "returned", "return_id": return_obj.id})
+    
+    qty = fabric_return.quantity_returned
+    updated = await db.fabric_lots.find_one_and_update(
+        {"id": lot_id, "remaining_quantity": {"$gte": qty}},
+        [{"$set": {
+            "quantity": {"$round": [{"$subtract": [{"$ifNull": ["$quantity", 0]}, qty]}, 2]},
+            "remaining_quantity": {"$round": [{"$subtract": ["$remaining_quantity", qty]}, 2]},
+            "number_of_rolls": {"$max": [0, {"$subtract": [{"$ifNull": ["$number_of_rolls", 0]}, len(returned_rolls)]}]}
+        }}],
+        projection={"_id": 0, "id": 1}
+    )
+    if not updated:
+        await release_fabric_rolls({"return_id": return_obj.id})
+        current = await db.fabric_lots.find_one({"id": lot_id}, {"_id": 0, "remaining_quantity": 1}) or {}
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot return {qty}kg. Only {current.get('remaining_quantity', 0)}kg remaining in lot."
+        )
+    
     doc = return_obj.model_dump()
     doc['return_date'] = doc['return_date'].isoformat()
     await db.fabric_returns.insert_one(doc)
     
-    # Update fabric lot - reduce quantity
-    new_remaining_qty = fabric_lot.get('remaining_quantity', 0) - fabric_return.quantity_returned
-    new_total_qty = fabric_lot.get('quantity', 0) - fabric_return.quantity_returned
-    
-    # Remove returned rolls from roll_numbers
-    updated_roll_numbers = [roll for roll in lot_rolls if roll not in fabric_return.returned_rolls]
-    
-    # Update roll weights if they exist
-    updated_roll_weights = []
-    if fabric_lot.get('roll_weights'):
-        for i, roll in enumerate(lot_rolls):
-            if roll not in fabric_return.returned_rolls:
-                updated_roll_weights.append(fabric_lot['roll_weights'][i])
-    
-    await db.fabric_lots.update_one(
-        {"id": lot_id},
-        {"$set": {
-            "quantity": round(new_total_qty, 2),
-            "remaining_quantity": round(new_remaining_qty, 2),
-            "roll_numbers": updated_roll_numbers,
-            "roll_weights": updated_roll_weights,
-            "number_of_rolls": len(updated_roll_numbers)
-        }}
-    )
-    
     return return_obj
 
 @api_router.delete("/fabric-lots/{lot_id}")
@@ -1037,6 +1385,7 @@ async def delete_fabric_lot(lot_id: str):
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Fabric lot not found")
+    await db.fabric_rolls.delete_many({"fabric_lot_id": lot_id})
     
     return {
         "message": f"Fabric lot {fabric_lot.get('lot_number', 'N/A')} returned successfully",
@@ -1083,6 +1432,9 @@ async def update_fabric_lot(lot_id: str, update_data: FabricLotUpdate, current_u
     if update_dict:
         update_dict['updated_by'] = current_user['username']
         await db.fabric_lots.update_one({"id": lot_id}, {"$set": update_dict})
+        roll_fields = {field: update_dict[field] for field in ROLL_LOT_FIELDS if field in update_dict}
+        if roll_fields:
+            await db.fabric_rolls.update_many({"fabric_lot_id": lot_id}, {"$set": roll_fields})
     
     updated_lot = await db.fabric_lots.find_one({"id": lot_id}, {"_id": 0})
     return updated_lot
@@ -1114,7 +1466,8 @@ async def update_roll_weights(lot_id: str, weights_update: RollWeightsUpdate):
     
     scale_readings = weights_update.scale_readings
     restart_points = weights_update.restart_points or []
-    number_of_rolls = fabric_lot.get('number_of_rolls', len(fabric_lot.get('roll_numbers', [])))
+    rolls = await lot_rolls(fabric_lot, {"status": {"$ne": "returned"}})
+    number_of_rolls = len(rolls) if rolls else fabric_lot.get('number_of_rolls', 0)
     
     # Validate number of readings matches number of rolls
     if len(scale_readings) != number_of_rolls:
@@ -1164,6 +1517,12 @@ async def update_roll_weights(lot_id: str, weights_update: RollWeightsUpdate):
             "total_amount": total_amount
         }}
     )
+    now = datetime.now(timezone.utc).isoformat()
+    if rolls:
+        await db.fabric_rolls.bulk_write([
+            UpdateOne({"id": roll['id']}, {"$set": {"weight": roll_weights[i], "scale_reading": scale_readings[i], "updated_at": now}})
+            for i, roll in enumerate(rolls)
+        ], ordered=False)
     
     updated_lot = await db.fabric_lots.find_one({"id": lot_id}, {"_id": 0})
     
@@ -1175,7 +1534,7 @@ async def update_roll_weights(lot_id: str, weights_update: RollWeightsUpdate):
         "total_weight": round(total_calculated, 2),
         "roll_details": [
             {
-                "roll_number": updated_lot['roll_numbers'][i],
+                "roll_number": rolls[i]['roll_number'] if rolls else None,
                 "weight": roll_weights[i],
                 "scale_reading": scale_readings[i]
             }
@@ -1184,6 +1543,195 @@ async def update_roll_weights(lot_id: str, weights_update: RollWeightsUpdate):
     }
 
 
+# ==================== FABRIC ROLLS ====================
+# One fabric_rolls record per physical roll: scanning a roll label resolves lot, weight and
+# status with one indexed read, and returns and cutting touch only the rolls involved.
+# The lot's roll_numbers / roll_weights arrays stay as the as-received snapshot.
+
+ROLL_LOT_FIELDS = ("lot_number", "fabric_type", "supplier_name", "color", "rate_per_kg")
+
+def build_fabric_rolls(lot: dict) -> List[dict]:
+    """Roll records for a lot from its roll_numbers and (when weighed) roll_weights / scale_readings"""
+    weights = lot.get('roll_weights') or []
+    readings = lot.get('scale_readings') or []
+    now = datetime.now(timezone.utc).isoformat()
+    return [{
+        "id": str(uuid.uuid4()),
+        "roll_number": roll_number,
+        "fabric_lot_id": lot['id'],
+        **{field: lot.get(field) for field in ROLL_LOT_FIELDS},
+        "sequence": i + 1,
+        "weight": weights[i] if i < len(weights) else None,
+        "scale_reading": readings[i] if i < len(readings) else None,
+        "status": "in_stock",  # in_stock, consumed, returned
+        "consumed_by": None,
+        "cutting_lot_number": None,
+        "return_id": None,
+        "created_at": now,
+        "updated_at": now
+    } for i, roll_number in enumerate(lot.get('roll_numbers') or [])]
+
+async def ensure_fabric_rolls(lots: List[dict]) -> int:
+    """Create missing roll records for lots entered before rolls were stored separately"""
+    writes = [
+        UpdateOne({"fabric_lot_id": roll['fabric_lot_id'], "roll_number": roll['roll_number']},
+                  {"$setOnInsert": roll}, upsert=True)
+        for lot in lots for roll in build_fabric_rolls(lot)
+    ]
+    if not writes:
+        return 0
+    result = await db.fabric_rolls.bulk_write(writes, ordered=False)
+    return result.upserted_count
+
+async def lot_rolls(lot: dict, query: dict = None) -> List[dict]:
+    """A lot's rolls in roll order, backfilling them on first use for older lots"""
+    query = {"fabric_lot_id": lot['id'], **(query or {})}
+    rolls = await db.fabric_rolls.find(query, {"_id": 0}).sort("sequence", 1).to_list(None)
+    if not rolls and lot.get('roll_numbers') and await ensure_fabric_rolls([lot]):
+        rolls = await db.fabric_rolls.find(query, {"_id": 0}).sort("sequence", 1).to_list(None)
+    return rolls
+
+async def claim_fabric_rolls(lot: dict, roll_numbers: List[str], fields: dict):
+    """Move in-stock rolls of a lot to another status in one update; if any roll is missing or
+    no longer in stock the claim is undone and a 400 names it"""
+    if not roll_numbers:
+        return
+    query = {"fabric_lot_id": lot['id'], "roll_number": {"$in": roll_numbers}}
+    if not await db.fabric_rolls.count_documents(query, limit=1) and lot.get('roll_numbers'):
+        await ensure_fabric_rolls([lot])
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.fabric_rolls.update_many({**query, "status": "in_stock"}, {"$set": {**fields, "updated_at": now}})
+    if result.modified_count == len(roll_numbers):
+        return
+    claim_key = "return_id" if "return_id" in fields else "consumed_by"
+    await release_fabric_rolls({"fabric_lot_id": lot['id'], claim_key: fields[claim_key]})
+    rolls = await db.fabric_rolls.find(query, {"_id": 0, "roll_number": 1, "status": 1}).to_list(None)
+    statuses = {roll['roll_number']: roll['status'] for roll in rolls}
+    for roll_number in roll_numbers:
+        if roll_number not in statuses:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Roll {roll_number} not found in fabric lot {lot.get('lot_number', 'N/A')}"
+            )
+    unavailable = ", ".join(f"{rn} ({status})" for rn, status in statuses.items() if status != "in_stock")
+    raise HTTPException(status_code=400, detail=f"Rolls no longer in stock: {unavailable or 'claimed by another entry'}")
+
+async def release_fabric_rolls(query: dict) -> int:
+    """Put rolls matching query back in stock"""
+    result = await db.fabric_rolls.update_many(query, {"$set": {
+        "status": "in_stock", "consumed_by": None, "cutting_lot_number": None, "return_id": None,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }})
+    return result.modified_count
+
+@api_router.get("/fabric-rolls/{roll_number}")
+async def get_fabric_roll(roll_number: str):
+    """Resolve a scanned roll label"""
+    roll = await db.fabric_rolls.find_one({"roll_number": roll_number}, {"_id": 0}, sort=[("created_at", -1)])
+    if not roll:
+        raise HTTPException(status_code=404, detail=f"Roll {roll_number} not found")
+    return roll
+
+@api_router.get("/fabric-lots/{lot_id}/rolls")
+async def get_fabric_lot_rolls(lot_id: str, status: Optional[str] = None):
+    """Rolls of a lot in roll order, optionally only one status"""
+    lot = await db.fabric_lots.find_one({"id": lot_id}, {"_id": 0})
+    if not lot:
+        raise HTTPException(status_code=404, detail="Fabric lot not found")
+    rolls = await lot_rolls(lot)
+    if status:
+        rolls = [roll for roll in rolls if roll['status'] == status]
+    return rolls
+
+async def backfill_fabric_rolls() -> dict:
+    """Roll records for every lot that predates them"""
+    scanned = created = 0
+    batch = []
+    async for lot in db.fabric_lots.find({"roll_numbers.0": {"$exists": True}}, {"_id": 0}):
+        scanned += 1
+        batch.append(lot)
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            created += await ensure_fabric_rolls(batch)
+            batch = []
+    created += await ensure_fabric_rolls(batch)
+    return {"lots_scanned": scanned, "rolls_created": created}
+
+
+# ==================== FABRIC CONSUMPTION LEDGER ====================
+# Cutting orders draw fabric and rib from a lot with one guarded, rounded update, so two
+# masters cutting from the same lot cannot both pass validation and lose a decrement.
+# Every draw, adjustment and release is also written to fabric_consumption.
+
+async def adjust_fabric_lot(fabric_lot_id: str, fabric_kg: float, rib_kg: float, kind: str, cutting_order: dict,
+                            created_by: str = None, require_fabric: float = None, require_rib: float = None) -> Optional[dict]:
+    """Take (positive) or give back (negative) fabric and rib; returns the updated lot, or None when the
+    lot does not hold the required amounts (by default the amounts being taken)"""
+    fabric_kg = round(fabric_kg, 2)
+    rib_kg = round(rib_kg, 2)
+    require_fabric = fabric_kg if require_fabric is None else require_fabric
+    require_rib = rib_kg if require_rib is None else require_rib
+    query = {"id": fabric_lot_id}
+    if require_fabric > 0:
+        query["remaining_quantity"] = {"$gte": require_fabric}
+    if require_rib > 0:
+        query["remaining_rib_quantity"] = {"$gte": require_rib}
+    lot = await db.fabric_lots.find_one_and_update(
+        query,
+        [{"$set": {
+            "remaining_quantity": {"$round": [{"$subtract": [{"$ifNull": ["$remaining_quantity", 0]}, fabric_kg]}, 2]},
+            "remaining_rib_quantity": {"$round": [{"$subtract": [{"$ifNull": ["$remaining_rib_quantity", 0]}, rib_kg]}, 2]}
+        }}],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if lot is None:
+        return None
+    await db.fabric_consumption.insert_one({
+        "id": str(uuid.uuid4()),
+        "fabric_lot_id": fabric_lot_id,
+        "lot_number": lot.get('lot_number'),
+        "cutting_order_id": cutting_order.get('id'),
+        "cutting_lot_number": cutting_order.get('cutting_lot_number'),
+        "kind": kind,  # draw, adjust, release
+        "fabric_kg": fabric_kg,
+        "rib_kg": rib_kg,
+        "remaining_quantity": lot.get('remaining_quantity'),
+        "remaining_rib_quantity": lot.get('remaining_rib_quantity'),
+        "created_by": created_by,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    return lot
+
+async def insufficient_fabric_error(fabric_lot_id: str, fabric_kg: float, rib_kg: float) -> HTTPException:
+    """Explain a refused draw using the lot as it is now"""
+    lot = await db.fabric_lots.find_one(
+        {"id": fabric_lot_id}, {"_id": 0, "lot_number": 1, "remaining_quantity": 1, "remaining_rib_quantity": 1}
+    )
+    if not lot:
+        return HTTPException(status_code=404, detail="Fabric lot not found")
+    if fabric_kg > lot.get('remaining_quantity', 0):
+        return HTTPException(
+            status_code=400,
+            detail=f"Fabric taken ({fabric_kg} kg) exceeds available fabric ({lot.get('remaining_quantity', 0)} kg) in lot {lot.get('lot_number')}"
+        )
+    return HTTPException(
+        status_code=400,
+        detail=f"Rib taken ({rib_kg} kg) exceeds available rib ({lot.get('remaining_rib_quantity', 0)} kg) in lot {lot.get('lot_number')}"
+    )
+
+@api_router.get("/fabric-lots/{lot_id}/consumption")
+async def get_fabric_consumption(lot_id: str):
+    """Ledger of draws against a fabric lot, oldest first, with the lot's current remaining quantities"""
+    lot = await db.fabric_lots.find_one(
+        {"id": lot_id}, {"_id": 0, "id": 1, "lot_number": 1, "quantity": 1, "remaining_quantity": 1,
+                         "rib_quantity": 1, "remaining_rib_quantity": 1}
+    )
+    if not lot:
+        raise HTTPException(status_code=404, detail="Fabric lot not found")
+    entries = await db.fabric_consumption.find({"fabric_lot_id": lot_id}, {"_id": 0}).sort("created_at", 1).to_list(None)
+    return {**lot, "entries": entries}
+
+
 # Cutting Order Routes
 @api_router.post("/cutting-orders", response_model=CuttingOrder)
 async def create_cutting_order(order: CuttingOrderCreate, current_user: dict = Depends(get_current_user)):
@@ -1234,25 +1782,11 @@ async def create_cutting_order(order: CuttingOrderCreate, current_user: dict = D
         order_dict['fabric_lot_id'] = None
         
     else:
-        # Get fabric lot to calculate cost and validate availability
+        # Get fabric lot to calculate cost
         fabric_lot = await db.fabric_lots.find_one({"id": order_dict['fabric_lot_id']}, {"_id": 0})
         if not fabric_lot:
             raise HTTPException(status_code=404, detail="Fabric lot not found")
         
-        # Validate fabric taken doesn't exceed available quantity
-        if order_dict['fabric_taken'] > fabric_lot.get('remaining_quantity', 0):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Fabric taken ({order_dict['fabric_taken']} kg) exceeds available fabric ({fabric_lot.get('remaining_quantity', 0)} kg) in lot {fabric_lot.get('lot_number')}"
-            )
-        
-        # Validate rib taken doesn't exceed available rib quantity
-        if order_dict['rib_taken'] > fabric_lot.get('remaining_rib_quantity', 0):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Rib taken ({order_dict['rib_taken']} kg) exceeds available rib ({fabric_lot.get('remaining_rib_quantity', 0)} kg) in lot {fabric_lot.get('lot_number')}"
-            )
-        
         # Calculate total fabric cost
         total_fabric_cost = fabric_used * fabric_lot['rate_per_kg']
         order_dict['total_fabric_cost'] = round(total_fabric_cost, 2)
@@ -1261,28 +1795,59 @@ async def create_cutting_order(order: CuttingOrderCreate, current_user: dict = D
         if not order_dict.get('color'):
             order_dict['color'] = fabric_lot.get('color', '')
         
-        # Update fabric lot remaining quantities
-        new_remaining_qty = fabric_lot['remaining_quantity'] - fabric_used
-        new_remaining_rib_qty = fabric_lot['remaining_rib_quantity'] - rib_used
-        
-        await db.fabric_lots.update_one(
-            {"id": order_dict['fabric_lot_id']},
-            {"$set": {
-                "remaining_quantity": round(new_remaining_qty, 2),
-                "remaining_rib_quantity": round(new_remaining_rib_qty, 2)
-            }}
-        )
-    
     order_obj = CuttingOrder(**order_dict)
     
     doc = order_obj.model_dump()
     doc['cutting_date'] = doc['cutting_date'].isoformat()
     doc['created_at'] = doc['created_at'].isoformat()
+    with_search_keys("cutting_orders", doc)
     
-    await db.cutting_orders.insert_one(doc)
+    doc['roll_numbers'] = list(dict.fromkeys(doc.get('roll_numbers') or [])) if doc['fabric_lot_id'] else []
+    if doc['roll_numbers']:
+        await claim_fabric_rolls(fabric_lot, doc['roll_numbers'], {
+            "status": "consumed", "consumed_by": doc['id'], "cutting_lot_number": doc['cutting_lot_number']
+        })
+    
+    if doc['fabric_lot_id']:
+        # Claim the fabric and rib atomically; the taken amounts must be available, the used amounts leave the lot
+        claimed = await adjust_fabric_lot(
+            doc['fabric_lot_id'], fabric_used, rib_used, "draw", doc, order_dict['created_by'],
+            require_fabric=order_dict['fabric_taken'], require_rib=order_dict['rib_taken']
+        )
+        if not claimed:
+            await release_fabric_rolls({"consumed_by": doc['id']})
+            raise await insufficient_fabric_error(doc['fabric_lot_id'], order_dict['fabric_taken'], order_dict['rib_taken'])
+    
+    try:
+        await db.cutting_orders.insert_one(doc)
+    except Exception:
+        if doc['fabric_lot_id']:
+            await adjust_fabric_lot(doc['fabric_lot_id'], -fabric_used, -rib_used, "release", doc, order_dict['created_by'])
+            await release_fabric_rolls({"consumed_by": doc['id']})
+        raise
+    await apply_rollup("cutting", new=doc)
+    await index_for_search("cutting_orders", [doc])
+    await emit_event("lot", "cut", {"cutting_lot_number": doc['cutting_lot_number'], "total_quantity": doc['total_quantity']},
+                     lot=doc['cutting_lot_number'])
     
     return order_obj
 
+async def search_page(collection: str, query: dict, search: str, skip: int, limit: int) -> List[dict]:
+    """One page of a list search: the newest SEARCH_CANDIDATE_LIMIT matches come ranked, older
+    matches follow newest first, paged in the database, so every match is reachable"""
+    sort = [("created_at", DESCENDING), ("id", ASCENDING)]
+    results = []
+    if skip < SEARCH_CANDIDATE_LIMIT:
+        candidates = await db[collection].find(query, {"_id": 0}).sort(sort).limit(SEARCH_CANDIDATE_LIMIT).to_list(SEARCH_CANDIDATE_LIMIT)
+        results = rank_results(collection, candidates, search)[skip:skip + limit]
+        if len(candidates) < SEARCH_CANDIDATE_LIMIT:
+            return results
+    remaining = limit - len(results)
+    if remaining > 0:
+        results += await db[collection].find(query, {"_id": 0}).sort(sort).skip(
+            max(skip, SEARCH_CANDIDATE_LIMIT)).limit(remaining).to_list(remaining)
+    return results
+
 @api_router.get("/cutting-orders", response_model=List[CuttingOrder])
 async def get_cutting_orders(exclude_ironing: bool = False, limit: int = 200, skip: int = 0, search: str = None):
     """
@@ -1293,17 +1858,15 @@ async def get_cutting_orders(exclude_ironing: bool = False, limit: int = 200, sk
     if exclude_ironing:
         query["sent_to_ironing"] = {"$ne": True}
     
-    # Add search filter if provided
     if search:
-        query["$or"] = [
-            {"cutting_lot_number": {"$regex": search, "$options": "i"}},
-            {"lot_number": {"$regex": search, "$options": "i"}},
-            {"cutting_master_name": {"$regex": search, "$options": "i"}},
-            {"style_type": {"$regex": search, "$options": "i"}},
-            {"color": {"$regex": search, "$options": "i"}}
-        ]
-    
-    orders = await db.cutting_orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+        # Indexed prefix match on search_keys
+        search_query = search_filter(search)
+        if not search_query:
+            return []
+        query.update(search_query)
+        orders = await search_page("cutting_orders", query, search, skip, limit)
+    else:
+        orders = await db.cutting_orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
     for order in orders:
         if isinstance(order['cutting_date'], str):
@@ -1361,35 +1924,31 @@ async def update_cutting_order(order_id: str, order_update: CuttingOrderUpdate):
             )
     
     # If fabric/rib quantities changed, recalculate
+    fabric_diff = 0
+    rib_diff = 0
     if 'fabric_taken' in update_data or 'fabric_returned' in update_data:
         fabric_taken = update_data.get('fabric_taken', existing_order['fabric_taken'])
         fabric_returned = update_data.get('fabric_returned', existing_order['fabric_returned'])
         fabric_used = fabric_taken - fabric_returned
         update_data['fabric_used'] = round(fabric_used, 2)
-        
-        # Update fabric lot quantities
-        old_fabric_used = existing_order['fabric_used']
-        fabric_diff = fabric_used - old_fabric_used
-        
-        await db.fabric_lots.update_one(
-            {"id": existing_order['fabric_lot_id']},
-            {"$inc": {"remaining_quantity": -fabric_diff}}
-        )
+        fabric_diff = fabric_used - existing_order.get('fabric_used', 0)
     
     if 'rib_taken' in update_data or 'rib_returned' in update_data:
         rib_taken = update_data.get('rib_taken', existing_order['rib_taken'])
         rib_returned = update_data.get('rib_returned', existing_order['rib_returned'])
         rib_used = rib_taken - rib_returned
         update_data['rib_used'] = round(rib_used, 2)
-        
-        # Update rib lot quantities
-        old_rib_used = existing_order['rib_used']
-        rib_diff = rib_used - old_rib_used
-        
-        await db.fabric_lots.update_one(
-            {"id": existing_order['fabric_lot_id']},
-            {"$inc": {"remaining_rib_quantity": -rib_diff}}
-        )
+        rib_diff = rib_used - existing_order.get('rib_used', 0)
+    
+    # Old cutting lots have no fabric lot to draw from or give back to
+    fabric_lot_id = existing_order.get('fabric_lot_id')
+    fabric_lot = None
+    adjusts_fabric = bool(fabric_lot_id and (round(fabric_diff, 2) or round(rib_diff, 2)))
+    if adjusts_fabric:
+        # Extra usage must still be available in the lot; reduced usage goes back to it
+        fabric_lot = await adjust_fabric_lot(fabric_lot_id, fabric_diff, rib_diff, "adjust", existing_order)
+        if not fabric_lot:
+            raise await insufficient_fabric_error(fabric_lot_id, round(fabric_diff, 2), round(rib_diff, 2))
     
     # Recalculate totals if size distribution or rate changed
     if 'size_distribution' in update_data:
@@ -1398,10 +1957,12 @@ async def update_cutting_order(order_id: str, order_update: CuttingOrderUpdate):
         
         cutting_rate = update_data.get('cutting_rate_per_pcs', existing_order.get('cutting_rate_per_pcs', 0))
         update_data['total_cutting_amount'] = round(total_quantity * cutting_rate, 2)
-        
-        fabric_lot = await db.fabric_lots.find_one({"id": existing_order['fabric_lot_id']}, {"_id": 0})
-        fabric_used = update_data.get('fabric_used', existing_order['fabric_used'])
-        update_data['total_fabric_cost'] = round(fabric_used * fabric_lot['rate_per_kg'], 2)
+    
+    if fabric_lot_id and ('size_distribution' in update_data or 'fabric_used' in update_data):
+        fabric_lot = fabric_lot or await db.fabric_lots.find_one({"id": fabric_lot_id}, {"_id": 0, "rate_per_kg": 1})
+        if fabric_lot:
+            fabric_used = update_data.get('fabric_used', existing_order['fabric_used'])
+            update_data['total_fabric_cost'] = round(fabric_used * fabric_lot.get('rate_per_kg', 0), 2)
     
     if 'cutting_rate_per_pcs' in update_data:
         total_quantity = update_data.get('total_quantity', existing_order['total_quantity'])
@@ -1411,35 +1972,501 @@ async def update_cutting_order(order_id: str, order_update: CuttingOrderUpdate):
     if 'cutting_date' in update_data and update_data['cutting_date']:
         update_data['cutting_date'] = update_data['cutting_date'].isoformat()
     
+    if touches_search_fields("cutting_orders", update_data):
+        update_data['search_keys'] = with_search_keys("cutting_orders", {**existing_order, **update_data})['search_keys']
+    
+    # The fabric adjustment was worked out from the usage read above; a concurrent edit must not land on top of it
     result = await db.cutting_orders.update_one(
-        {"id": order_id},
+        {"id": order_id, "fabric_used": existing_order.get('fabric_used'), "rib_used": existing_order.get('rib_used')},
         {"$set": update_data}
     )
     
     if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Cutting order not found")
-    
+        if adjusts_fabric:
+            await adjust_fabric_lot(fabric_lot_id, -fabric_diff, -rib_diff, "adjust", existing_order,
+                                    require_fabric=0, require_rib=0)
+        if not await db.cutting_orders.find_one({"id": order_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Cutting order not found")
+        raise HTTPException(status_code=409, detail="Cutting order was changed by another edit; please reload and retry")
+    
+    await apply_rollup("cutting", existing_order, {**existing_order, **update_data})
+    await reindex_for_search("cutting_orders", order_id)
     return await get_cutting_order(order_id)
 
 @api_router.delete("/cutting-orders/{order_id}")
 async def delete_cutting_order(order_id: str):
-    order = await db.cutting_orders.find_one({"id": order_id}, {"_id": 0})
+    # Only the request whose delete matched gives the fabric back, so concurrent deletes release it once
+    order = await db.cutting_orders.find_one_and_delete({"id": order_id}, projection={"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Cutting order not found")
     
-    # Restore fabric lot quantities
-    await db.fabric_lots.update_one(
-        {"id": order['fabric_lot_id']},
-        {"$inc": {
-            "remaining_quantity": order['fabric_used'],
-            "remaining_rib_quantity": order['rib_used']
-        }}
-    )
+    # Give the fabric back to the lot (old cutting lots have none)
+    if order.get('fabric_lot_id'):
+        await adjust_fabric_lot(order['fabric_lot_id'], -order.get('fabric_used', 0), -order.get('rib_used', 0),
+                                "release", order)
+        await release_fabric_rolls({"consumed_by": order_id})
     
-    result = await db.cutting_orders.delete_one({"id": order_id})
+    await apply_rollup("cutting", old=order)
+    await unindex_for_search("cutting_orders", [order_id])
     return {"message": "Cutting order deleted successfully"}
 
 
+# ==================== TRANSITION ENGINE ====================
+# A stage transition (send, receive, ironing, stock creation) is a handful of writes that
+# must land together: a receipt without its DC status, or a "Received" ironing DC without
+# its stock entry, is a lot stuck between stages. Endpoints validate first and buffer the
+# writes on a Transition; run_transition applies them in one session transaction,
+# retrying transient errors, with one bulk_write per collection. A standalone mongod has
+# no transactions: there the guards are checked with reads before anything is written,
+# the documents the writes will touch are read first, and if a write fails part-way the
+# touched documents are put back and the inserts removed (best effort, not isolation).
+
+# Inserts before updates, parents before children, so a standalone partial failure never leaves a child without its parent
+TRANSITION_WRITE_ORDER = ["outsourcing_orders", "outsourcing_receipts", "ironing_orders", "dc_snapshots", "ironing_receipts",
+                          "stock", "cutting_orders"]
+
+class Transition:
+    """Writes of one stage transition, buffered until run_transition"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.guards = []
+        self.inserts = {}
+        self.updates = {}
+        self.rollups = {}
+        self.events = []
+
+    def guard(self, collection: str, filter_doc: dict, update_doc: dict, detail: str, expected: int = 1,
+              status_code: int = 409):
+        """A conditional update that must match `expected` documents, or the whole transition is rejected"""
+        self.guards.append((collection, filter_doc, update_doc, detail, expected, status_code))
+
+    def insert(self, collection: str, doc: dict):
+        self.inserts.setdefault(collection, []).append(doc)
+
+    def update(self, collection: str, filter_doc: dict, update_doc: dict):
+        # The filter is kept next to the request: a standalone run reads what the write will touch
+        self.updates.setdefault(collection, []).append((filter_doc, UpdateOne(filter_doc, update_doc)))
+
+    def cutting_order_writes(self, writes: list):
+        """(filter, update) pairs from lot_stage_writes"""
+        self.updates.setdefault("cutting_orders", []).extend(
+            (filter_doc, UpdateMany(filter_doc, update_doc)) for filter_doc, update_doc in writes)
+
+    def rollup(self, kind: str, doc: dict, dc: dict = None):
+        """Count a new document into the daily rollups; a batch folds its documents into one $inc per bucket"""
+        rollup_delta(kind, None, doc, dc, self.rollups)
+
+_transactions_supported = None
+
+async def transactions_supported() -> bool:
+    """Transactions need a replica set or mongos; checked once per process"""
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await client.admin.command("hello")
+        _transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        if not _transactions_supported:
+            logger.warning("MongoDB is standalone: stage transitions run without transactions")
+    return _transactions_supported
+
+async def apply_transition_writes(transition: Transition, session=None):
+    for collection, filter_doc, update_doc, detail, expected, status_code in transition.guards:
+        result = await db[collection].update_many(filter_doc, update_doc, session=session)
+        if result.matched_count != expected:
+            raise HTTPException(status_code=status_code, detail=detail)
+    for collection in TRANSITION_WRITE_ORDER:
+        # A copy, so the driver's _id never lands on the buffered documents (reused on a transaction retry)
+        requests = [InsertOne(dict(doc)) for doc in transition.inserts.get(collection, [])]
+        requests += [request for _, request in transition.updates.get(collection, [])]
+        if requests:
+            await db[collection].bulk_write(requests, ordered=True, session=session)
+
+async def apply_rollup_writes(transition: Transition, session=None):
+    rollup_writes = rollup_updates(transition.rollups)
+    if rollup_writes:
+        await db.daily_rollups.bulk_write(rollup_writes, ordered=False, session=session)
+
+async def apply_transition(transition: Transition, session=None):
+    await apply_transition_writes(transition, session)
+    await apply_rollup_writes(transition, session)
+
+async def apply_transition_standalone(transition: Transition):
+    """Without a session: reject on the guards before writing, and undo the writes if one fails part-way"""
+    for collection, filter_doc, update_doc, detail, expected, status_code in transition.guards:
+        if await db[collection].count_documents(filter_doc) != expected:
+            raise HTTPException(status_code=status_code, detail=detail)
+    before = {}
+    targets = [(collection, filter_doc) for collection, filter_doc, *_ in transition.guards]
+    targets += [(collection, filter_doc) for collection in TRANSITION_WRITE_ORDER
+                for filter_doc, _ in transition.updates.get(collection, [])]
+    for collection, filter_doc in targets:
+        async for doc in db[collection].find(filter_doc):
+            before.setdefault(collection, {})[doc['_id']] = doc
+    try:
+        await apply_transition_writes(transition)
+    except Exception:
+        await undo_transition_writes(transition, before)
+        raise
+    try:
+        await apply_rollup_writes(transition)
+    except PyMongoError as e:
+        # Derived data: the transition stands, and the daily-rollups migration rebuilds the totals
+        logger.error(f"Rollup writes for {transition.name} failed: {e}")
+
+async def undo_transition_writes(transition: Transition, before: dict):
+    for collection, docs in transition.inserts.items():
+        # Every transition document carries its own uuid id
+        await db[collection].delete_many({"id": {"$in": [doc['id'] for doc in docs]}})
+    for collection, docs in before.items():
+        await db[collection].bulk_write([ReplaceOne({"_id": _id}, doc) for _id, doc in docs.items()], ordered=False)
+    logger.warning(f"Standalone transition {transition.name} failed part-way; its writes were undone")
+
+async def run_transition(transition: Transition):
+    """Apply a transition atomically where the deployment allows it, then index and announce it"""
+    started = time.perf_counter()
+    attempts = 0
+    mode = "transaction" if await transactions_supported() else "standalone"
+
+    async def attempt(session):
+        nonlocal attempts
+        attempts += 1
+        if session is None:
+            await apply_transition_standalone(transition)
+        else:
+            await apply_transition(transition, session)
+
+    outcome = "failed"
+    try:
+        if mode == "transaction":
+            # with_transaction retries TransientTransactionError and unknown commit results
+            async with await client.start_session() as session:
+                await session.with_transaction(attempt)
+        else:
+            await attempt(None)
+        outcome = "committed"
+    except HTTPException:
+        outcome = "rejected"
+        raise
+    finally:
+        record_transition(transition.name, mode, time.perf_counter() - started, attempts, outcome)
+
+    # The search index and the event stream are derived data, written once the transition is in
+    for collection in TRANSITION_WRITE_ORDER:
+        if collection in SEARCH_INDEX_SOURCES and transition.inserts.get(collection):
+            await index_for_search(collection, transition.inserts[collection])
+    schedule_dc_pdfs(transition.inserts.get("dc_snapshots", []))
+    for topic, event_type, data, keys in transition.events:
+        await emit_event(topic, event_type, data, **keys)
+
+
+# ==================== LOT LINEAGE ====================
+# Each transition writes the IDs it links: cutting order -> outsourcing DCs -> receipts ->
+# ironing DC -> stock. Stage lookups follow an ID with one indexed read instead of matching
+# lot numbers or DC number patterns.
+
+def order_cutting_ids(order: dict) -> List[str]:
+    """Cutting orders an outsourcing or ironing DC covers"""
+    if order.get('cutting_order_ids'):
+        return order['cutting_order_ids']
+    return [order['cutting_order_id']] if order.get('cutting_order_id') else []
+
+async def find_stitching_receipt(cutting_order: dict) -> Tuple[Optional[dict], Optional[dict]]:
+    """A lot's received stitching DC and the latest receipt against it"""
+    if cutting_order.get('outsourcing_order_ids'):
+        query = {"id": {"$in": cutting_order['outsourcing_order_ids']}}
+    else:
+        query = lot_numbers_query(cutting_order.get('cutting_lot_number') or cutting_order.get('lot_number', ''))
+    stitching = await db.outsourcing_orders.find_one(
+        {**query, "operation_type": "Stitching", "status": "Received"}, {"_id": 0}, sort=[("created_at", -1)]
+    )
+    if not stitching:
+        return None, None
+    if stitching.get('receipt_ids'):
+        receipt = await db.outsourcing_receipts.find_one({"id": stitching['receipt_ids'][-1]}, {"_id": 0})
+    else:
+        receipt = await db.outsourcing_receipts.find_one(
+            {"outsourcing_order_id": stitching['id']}, {"_id": 0}, sort=[("created_at", -1)]
+        )
+    return stitching, receipt
+
+async def find_ironing_cutting_order(ironing_order: dict) -> Optional[dict]:
+    """The (first) cutting order behind an ironing DC"""
+    cutting_ids = ironing_order.get('cutting_order_ids')
+    if cutting_ids:
+        return await db.cutting_orders.find_one({"id": cutting_ids[0]}, {"_id": 0})
+    lot_number = ironing_order.get('cutting_lot_number', '')
+    return await db.cutting_orders.find_one(
+        {"$or": [{"cutting_lot_number": lot_number}, {"lot_number": lot_number}]}, {"_id": 0}
+    )
+
+def stock_lineage_writes(transition: Transition, ironing_order: dict, stock_entry: dict, guarded: bool = True):
+    """Mark the ironing DC received and point it and its cutting orders at the stock entry created on receipt
+    (the receipt carries stock_id when inserted). Unguarded only for a DC the same transition inserts."""
+    received = {"$set": {"status": "Received", "stock_id": stock_entry['id']}}
+    if guarded:
+        transition.guard("ironing_orders", {"id": ironing_order['id'], "status": {"$ne": "Received"}}, received,
+                         "Ironing order has already been received")
+    else:
+        transition.update("ironing_orders", {"id": ironing_order['id']}, received)
+    transition.cutting_order_writes(lot_stage_writes(stock_entry['cutting_order_ids'], "stock", None,
+                                                     {"$set": {"stock_id": stock_entry['id']}}))
+
+async def backfill_lot_lineage() -> dict:
+    """Lineage IDs for orders, receipts and stock written before transitions recorded them"""
+    counts = {"outsourcing_orders": 0, "cutting_orders": 0, "ironing_orders": 0, "stock": 0}
+
+    async def flush(collection, writes):
+        if writes:
+            counts[collection] += (await db[collection].bulk_write(writes, ordered=False)).modified_count
+        return []
+
+    # Outsourcing DCs: receipt_ids, and the DC id on every cutting order it carried
+    receipts_by_order = {}
+    async for receipt in db.outsourcing_receipts.find({}, {"_id": 0, "id": 1, "outsourcing_order_id": 1}).sort("created_at", 1):
+        receipts_by_order.setdefault(receipt['outsourcing_order_id'], []).append(receipt['id'])
+    cutting_ids_by_order = {}
+    order_writes, cutting_writes = [], []
+    async for order in db.outsourcing_orders.find({}, {"_id": 0, "id": 1, "cutting_order_id": 1, "cutting_order_ids": 1}):
+        cutting_ids = order_cutting_ids(order)
+        cutting_ids_by_order[order['id']] = cutting_ids
+        order_writes.append(UpdateOne({"id": order['id']}, {"$set": {
+            "cutting_order_ids": cutting_ids, "receipt_ids": receipts_by_order.get(order['id'], [])
+        }}))
+        if cutting_ids:
+            cutting_writes.append(UpdateMany({"id": {"$in": cutting_ids}}, {"$addToSet": {"outsourcing_order_ids": order['id']}}))
+        if len(order_writes) >= MIGRATION_BATCH_SIZE:
+            order_writes = await flush("outsourcing_orders", order_writes)
+            cutting_writes = await flush("cutting_orders", cutting_writes)
+    await flush("outsourcing_orders", order_writes)
+    await flush("cutting_orders", cutting_writes)
+
+    # Ironing DCs: the stitching DC and lots behind the receipt they were created from
+    order_by_receipt = {}
+    async for receipt in db.outsourcing_receipts.find({}, {"_id": 0, "id": 1, "outsourcing_order_id": 1}):
+        order_by_receipt[receipt['id']] = receipt['outsourcing_order_id']
+    cutting_id_by_lot = {}
+    async for cutting_order in db.cutting_orders.find({}, {"_id": 0, "id": 1, "cutting_lot_number": 1}):
+        if cutting_order.get('cutting_lot_number'):
+            cutting_id_by_lot.setdefault(cutting_order['cutting_lot_number'], cutting_order['id'])
+    # Ironing DCs that already carry their lots; the loop below adds the ones it backfills
+    ironing_cutting_ids = {}
+    async for ironing in db.ironing_orders.find({"cutting_order_ids.0": {"$exists": True}}, {"_id": 0, "id": 1, "cutting_order_ids": 1}):
+        ironing_cutting_ids[ironing['id']] = ironing['cutting_order_ids']
+    ironing_writes, cutting_writes = [], []
+    async for ironing in db.ironing_orders.find(
+        {"cutting_order_ids.0": {"$exists": False}}, {"_id": 0, "id": 1, "receipt_id": 1, "cutting_lot_number": 1}
+    ):
+        outsourcing_order_id = order_by_receipt.get(ironing.get('receipt_id'))
+        cutting_ids = cutting_ids_by_order.get(outsourcing_order_id) or []
+        if not cutting_ids and ironing.get('cutting_lot_number') in cutting_id_by_lot:
+            cutting_ids = [cutting_id_by_lot[ironing['cutting_lot_number']]]
+        ironing_cutting_ids[ironing['id']] = cutting_ids
+        ironing_writes.append(UpdateOne({"id": ironing['id']}, {"$set": {
+            "outsourcing_order_id": outsourcing_order_id, "cutting_order_ids": cutting_ids
+        }}))
+        if cutting_ids:
+            cutting_writes.append(UpdateMany({"id": {"$in": cutting_ids}}, {"$set": {"ironing_order_id": ironing['id']}}))
+        if len(ironing_writes) >= MIGRATION_BATCH_SIZE:
+            ironing_writes = await flush("ironing_orders", ironing_writes)
+            cutting_writes = await flush("cutting_orders", cutting_writes)
+    await flush("ironing_orders", ironing_writes)
+    await flush("cutting_orders", cutting_writes)
+
+    # Stock created on ironing receipt: the ironing DC and its lots
+    ironing_by_receipt = {}
+    async for receipt in db.ironing_receipts.find({}, {"_id": 0, "id": 1, "ironing_order_id": 1}):
+        ironing_by_receipt[receipt['id']] = receipt['ironing_order_id']
+    stock_writes, ironing_writes, cutting_writes = [], [], []
+    async for stock in db.stock.find(
+        {"source_ironing_receipt_id": {"$exists": True}, "ironing_order_id": None}, {"_id": 0, "id": 1, "source_ironing_receipt_id": 1}
+    ):
+        ironing_id = ironing_by_receipt.get(stock['source_ironing_receipt_id'])
+        if not ironing_id:
+            continue
+        cutting_ids = ironing_cutting_ids.get(ironing_id, [])
+        stock_writes.append(UpdateOne({"id": stock['id']}, {"$set": {"ironing_order_id": ironing_id, "cutting_order_ids": cutting_ids}}))
+        ironing_writes.append(UpdateOne({"id": ironing_id}, {"$set": {"stock_id": stock['id']}}))
+        if cutting_ids:
+            cutting_writes.append(UpdateMany({"id": {"$in": cutting_ids}}, {"$set": {"stock_id": stock['id']}}))
+        if len(stock_writes) >= MIGRATION_BATCH_SIZE:
+            stock_writes = await flush("stock", stock_writes)
+            ironing_writes = await flush("ironing_orders", ironing_writes)
+            cutting_writes = await flush("cutting_orders", cutting_writes)
+    await flush("stock", stock_writes)
+    await flush("ironing_orders", ironing_writes)
+    await flush("cutting_orders", cutting_writes)
+    return counts
+
+
+# ==================== LOT STAGE ====================
+# Each cutting order carries its current stage, the unit holding it and whether stitching
+# is done, written by the transition that moves it. Scans and the WIP board read these
+# fields instead of probing outsourcing, ironing and stock on every request.
+
+LOT_STAGE_RANK = {"cutting": 0, "outsourcing": 1, "received": 1, "ironing": 2, "ironing-received": 3, "stock": 4}
+WIP_STAGES = ["cutting", "outsourcing", "received", "ironing", "ironing-received"]
+
+def lot_stage_writes(cutting_order_ids: List[str], stage: str, unit: str = None, extra: dict = None) -> list:
+    """Cutting-order (filter, update) pairs for a transition: the transition's own updates, then the stage
+    move, which never takes a lot back past a later stage (e.g. a receipt edited after ironing)"""
+    if not cutting_order_ids:
+        return []
+    writes = [({"id": {"$in": cutting_order_ids}}, extra)] if extra else []
+    allowed = [name for name, rank in LOT_STAGE_RANK.items() if rank <= LOT_STAGE_RANK[stage]]
+    writes.append((
+        {"id": {"$in": cutting_order_ids}, "stage": {"$in": allowed + [None]}},
+        {"$set": {"stage": stage, "current_unit": unit, "stage_updated_at": datetime.now(timezone.utc).isoformat()}}
+    ))
+    return writes
+
+def receipt_stage_writes(outsourcing_order: dict, status: str) -> list:
+    """A receipt against an outsourcing DC: received in full, or still partly out with the unit"""
+    operation_type = outsourcing_order.get('operation_type')
+    stitching = operation_type == 'Stitching'
+    if status == 'Received':
+        extra = {"$addToSet": {"received_operations": operation_type}}
+        if stitching:
+            extra["$set"] = {"stitching_completed": True}
+        return lot_stage_writes(order_cutting_ids(outsourcing_order), "received", None, extra)
+    extra = {"$pull": {"received_operations": operation_type}}
+    if stitching:
+        extra["$set"] = {"stitching_completed": False}
+    return lot_stage_writes(order_cutting_ids(outsourcing_order), "outsourcing", outsourcing_order.get('unit_name'), extra)
+
+async def write_lot_stage(writes: list):
+    if writes:
+        await db.cutting_orders.bulk_write([UpdateMany(filter_doc, update_doc) for filter_doc, update_doc in writes],
+                                           ordered=True)
+
+def lot_stage_fields(outsourcing_orders: List[dict], ironing: Optional[dict], stock: Optional[dict]) -> dict:
+    """Stage fields derived from a lot's DCs (oldest first), ironing DC and stock entry"""
+    latest = outsourcing_orders[-1] if outsourcing_orders else None
+    stage = derive_lot_stage(latest, ironing, stock)
+    unit = None
+    if stage == "ironing":
+        unit = ironing.get('unit_name')
+    elif stage == "outsourcing":
+        unit = latest.get('unit_name')
+    received = [o for o in outsourcing_orders if o.get('status') == 'Received']
+    return {
+        "stage": stage,
+        "current_unit": unit,
+        "stitching_completed": any(o.get('operation_type') == 'Stitching' for o in received),
+        "received_operations": sorted({o.get('operation_type') for o in received if o.get('operation_type')}),
+        "sent_to_ironing": ironing is not None
+    }
+
+async def recompute_lot_stages(cutting_orders: List[dict]) -> int:
+    """Re-derive stage fields for a batch of cutting orders from their DCs and stock"""
+    if not cutting_orders:
+        return 0
+    ids = [order['id'] for order in cutting_orders]
+    id_set = set(ids)
+    id_by_lot = {(order.get('cutting_lot_number') or order.get('lot_number', '')): order['id'] for order in cutting_orders}
+    lot_nums = list(id_by_lot)
+
+    def owners(doc: dict) -> set:
+        found = {cid for cid in order_cutting_ids(doc) if cid in id_set}
+        found.update(id_by_lot[lot] for lot in order_lot_numbers(doc) if lot in id_by_lot)
+        return found
+
+    projection = {"_id": 0, "id": 1, "cutting_order_id": 1, "cutting_order_ids": 1, "cutting_lot_number": 1,
+                  "cutting_lot_numbers": 1, "lot_details": 1, "operation_type": 1, "status": 1, "unit_name": 1}
+    outsourcing, ironing, stocked = {}, {}, {}
+    async for dc in db.outsourcing_orders.find(
+        {"$or": [{"cutting_order_ids": {"$in": ids}}, lot_numbers_query(lot_nums)]}, projection
+    ).sort("created_at", 1):
+        for cid in owners(dc):
+            outsourcing.setdefault(cid, []).append(dc)
+    async for dc in db.ironing_orders.find(
+        {"$or": [{"cutting_order_ids": {"$in": ids}}, {"cutting_lot_number": {"$in": lot_nums}}]}, projection
+    ).sort("created_at", 1):
+        for cid in owners(dc):
+            ironing[cid] = dc
+    stock_ids = [order['stock_id'] for order in cutting_orders if order.get('stock_id')]
+    stock_by_id, stock_by_lot = {}, {}
+    async for stock in db.stock.find(
+        {"$or": [{"id": {"$in": stock_ids}}, {"lot_number": {"$in": lot_nums}}], "is_active": True},
+        {"_id": 0, "id": 1, "lot_number": 1}
+    ):
+        stock_by_id[stock['id']] = stock
+        stock_by_lot.setdefault(stock['lot_number'], stock)
+    for order in cutting_orders:
+        lot_num = order.get('cutting_lot_number') or order.get('lot_number', '')
+        stock = stock_by_id.get(order.get('stock_id')) or stock_by_lot.get(lot_num)
+        if stock:
+            stocked[order['id']] = stock
+
+    now = datetime.now(timezone.utc).isoformat()
+    writes = []
+    for cid in ids:
+        dcs = outsourcing.get(cid, [])
+        fields = lot_stage_fields(dcs, ironing.get(cid), stocked.get(cid))
+        operations = sorted({dc['operation_type'] for dc in dcs if dc.get('operation_type')})
+        writes.append(UpdateOne({"id": cid}, {
+            "$set": {**fields, "completed_operations": operations, "stage_updated_at": now}
+        }))
+    result = await db.cutting_orders.bulk_write(writes, ordered=False)
+    return result.modified_count
+
+async def refresh_lot_stages(cutting_order_ids: List[str]):
+    """Re-derive stages after a DC is deleted, since the lot may have to move back"""
+    if cutting_order_ids:
+        orders = await db.cutting_orders.find({"id": {"$in": cutting_order_ids}}, {"_id": 0}).to_list(None)
+        await recompute_lot_stages(orders)
+
+async def backfill_lot_stages() -> dict:
+    """Stage fields for every cutting order"""
+    scanned = updated = 0
+    batch = []
+    async for order in db.cutting_orders.find(
+        {}, {"_id": 0, "id": 1, "cutting_lot_number": 1, "lot_number": 1, "stock_id": 1}
+    ):
+        scanned += 1
+        batch.append(order)
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            updated += await recompute_lot_stages(batch)
+            batch = []
+    updated += await recompute_lot_stages(batch)
+    return {"scanned": scanned, "updated": updated}
+
+async def ensure_lot_stages():
+    """The WIP board reads only stored stages, so lots cut before stages were stored get theirs at startup
+    until a run of the migration is on record"""
+    if await db.system_meta.find_one({"type": "migration:lot-stages"}, {"_id": 1}):
+        return
+    started = time.perf_counter()
+    result = await backfill_lot_stages()
+    await record_migration_run("lot-stages", result, started, "startup")
+    logger.info(f"Backfilled lot stages at startup: {result}")
+
+@api_router.get("/wip")
+async def get_wip_board():
+    """Lots and pieces at each production stage, and with each unit, from the persisted stage fields"""
+    rows = await db.cutting_orders.aggregate([
+        {"$match": {"stage": {"$in": WIP_STAGES}}},
+        {"$group": {
+            "_id": {"stage": "$stage", "unit": "$current_unit"},
+            "lots": {"$sum": 1},
+            "pieces": {"$sum": "$total_quantity"}
+        }}
+    ]).to_list(None)
+    stages = {stage: {"stage": stage, "lots": 0, "pieces": 0, "units": []} for stage in WIP_STAGES}
+    for row in rows:
+        entry = stages[row['_id']['stage']]
+        entry['lots'] += row['lots']
+        entry['pieces'] += row['pieces']
+        if row['_id'].get('unit'):
+            entry['units'].append({"unit_name": row['_id']['unit'], "lots": row['lots'], "pieces": row['pieces']})
+    for entry in stages.values():
+        entry['units'].sort(key=lambda unit: -unit['pieces'])
+    return {
+        "stages": list(stages.values()),
+        "total_lots": sum(entry['lots'] for entry in stages.values()),
+        "total_pieces": sum(entry['pieces'] for entry in stages.values())
+    }
+
+
 # ==================== LOT QR CODE ROUTES ====================
 
 @api_router.get("/cutting-orders/{order_id}/qrcode")
@@ -1462,20 +2489,57 @@ async def get_cutting_lot_qrcode(order_id: str):
         "total": order.get('total_quantity', 0)
     })
     
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to bytes
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    
-    return Response(content=buffer.getvalue(), media_type="image/png")
+    return Response(content=qr_png(qr_data), media_type="image/png")
+
+
+def order_lot_numbers(order: dict) -> List[str]:
+    """Cutting lot numbers an outsourcing order covers; multi-lot orders join them in cutting_lot_number"""
+    if order.get('cutting_lot_numbers'):
+        return order['cutting_lot_numbers']
+    if order.get('lot_details'):
+        return [lot['cutting_lot_number'] for lot in order['lot_details'] if lot.get('cutting_lot_number')]
+    return [part.strip() for part in (order.get('cutting_lot_number') or '').split(',') if part.strip()]
 
+def lot_numbers_query(lot_numbers) -> dict:
+    """Outsourcing orders covering a lot (or any of several), on the multikey cutting_lot_numbers index"""
+    if isinstance(lot_numbers, str):
+        return {"cutting_lot_numbers": lot_numbers}
+    return {"cutting_lot_numbers": {"$in": list(lot_numbers)}}
+
+async def unstitched_lots(lot_numbers: List[str]) -> List[str]:
+    """Lots without a received stitching DC; ironing is refused for these"""
+    stitched = await db.outsourcing_orders.distinct(
+        "cutting_lot_numbers", {**lot_numbers_query(lot_numbers), "operation_type": "Stitching", "status": "Received"}
+    )
+    return [lot for lot in lot_numbers if lot not in stitched]
+
+async def backfill_cutting_lot_numbers() -> dict:
+    """cutting_lot_numbers for outsourcing orders written before every order carried it"""
+    scanned = updated = 0
+    writes = []
+    async for order in db.outsourcing_orders.find(
+        {"cutting_lot_numbers.0": {"$exists": False}},
+        {"_id": 0, "id": 1, "cutting_lot_number": 1, "lot_details": 1}
+    ):
+        scanned += 1
+        writes.append(UpdateOne({"id": order['id']}, {"$set": {"cutting_lot_numbers": order_lot_numbers(order)}}))
+        if len(writes) >= MIGRATION_BATCH_SIZE:
+            updated += (await db.outsourcing_orders.bulk_write(writes, ordered=False)).modified_count
+            writes = []
+    if writes:
+        updated += (await db.outsourcing_orders.bulk_write(writes, ordered=False)).modified_count
+    return {"scanned": scanned, "updated": updated}
+
+async def ensure_cutting_lot_numbers():
+    """Lot lookups only match inside cutting_lot_numbers, so orders written before it are backfilled
+    at startup until a run of the migration is on record"""
+    if await db.system_meta.find_one({"type": "migration:cutting-lot-numbers"}, {"_id": 1}):
+        return
+    started = time.perf_counter()
+    result = await backfill_cutting_lot_numbers()
+    await record_migration_run("cutting-lot-numbers", result, started, "startup")
+    if result["updated"]:
+        logger.info(f"Backfilled cutting_lot_numbers at startup: {result}")
 
 @api_router.get("/lot/by-number/{lot_number}")
 async def get_lot_by_number(lot_number: str):
@@ -1493,10 +2557,23 @@ async def get_lot_by_number(lot_number: str):
     # Get current status
     lot_num = order.get('cutting_lot_number') or order.get('lot_number', '')
     
+    if order.get('stage'):
+        # Stage is kept on the lot; the linked records are single reads by ID
+        outsourcing_ids = order.get('outsourcing_order_ids') or []
+        outsourcing = await db.outsourcing_orders.find_one({"id": outsourcing_ids[-1]}, {"_id": 0}) if outsourcing_ids else None
+        ironing = await db.ironing_orders.find_one({"id": order['ironing_order_id']}, {"_id": 0}) if order.get('ironing_order_id') else None
+        stock = await db.stock.find_one({"id": order['stock_id'], "is_active": True}, {"_id": 0}) if order.get('stock_id') else None
+        return {
+            "order": order,
+            "stage": order['stage'],
+            "outsourcing": outsourcing,
+            "ironing": ironing,
+            "stock": stock,
+            "stitching_completed": bool(order.get('stitching_completed'))
+        }
+    
     # Check outsourcing status
-    outsourcing = await db.outsourcing_orders.find_one(
-        {"cutting_lot_number": lot_num}, {"_id": 0}
-    )
+    outsourcing = await db.outsourcing_orders.find_one(lot_numbers_query(lot_num), {"_id": 0})
     
     # Check ironing status
     ironing = await db.ironing_orders.find_one(
@@ -1510,32 +2587,11 @@ async def get_lot_by_number(lot_number: str):
     }, {"_id": 0})
     
     # Check if stitching outsourcing is completed (required before ironing)
-    stitching_order = await db.outsourcing_orders.find_one({
-        "cutting_lot_number": lot_num,
-        "operation_type": "Stitching",
-        "status": "Received"
-    }, {"_id": 0})
-    stitching_completed = stitching_order is not None
-    
-    # Determine current stage
-    if stock:
-        stage = "stock"
-    elif ironing:
-        if ironing.get('status') == 'Received':
-            stage = "ironing-received"
-        else:
-            stage = "ironing"
-    elif outsourcing:
-        if outsourcing.get('status') == 'Received':
-            stage = "received"
-        else:
-            stage = "outsourcing"
-    else:
-        stage = "cutting"
+    stitching_completed = not await unstitched_lots([lot_num])
     
     return {
         "order": order,
-        "stage": stage,
+        "stage": derive_lot_stage(outsourcing, ironing, stock),
         "outsourcing": outsourcing,
         "ironing": ironing,
         "stock": stock,
@@ -1543,6 +2599,83 @@ async def get_lot_by_number(lot_number: str):
     }
 
 
+def derive_lot_stage(outsourcing: Optional[dict], ironing: Optional[dict], stock: Optional[dict]) -> str:
+    """Current stage of a lot from its latest records"""
+    if stock:
+        return "stock"
+    if ironing:
+        return "ironing-received" if ironing.get('status') == 'Received' else "ironing"
+    if outsourcing:
+        return "received" if outsourcing.get('status') == 'Received' else "outsourcing"
+    return "cutting"
+
+
+@api_router.post("/lot/by-numbers")
+async def get_lots_by_numbers(request: LotNumbersLookup):
+    """Resolve many scanned lot QR codes at once; unknown lots are reported in place"""
+    lot_numbers = validate_bulk_lookup(request.lot_numbers)
+
+    orders = await db.cutting_orders.find({
+        "$or": [
+            {"cutting_lot_number": {"$in": lot_numbers}},
+            {"lot_number": {"$in": lot_numbers}}
+        ]
+    }, {"_id": 0}).to_list(None)
+    by_scanned = {}
+    for order in orders:
+        if order.get('lot_number') in lot_numbers:
+            by_scanned.setdefault(order['lot_number'], order)
+    for order in orders:
+        if order.get('cutting_lot_number') in lot_numbers:
+            by_scanned[order['cutting_lot_number']] = order
+
+    lot_nums = list({o.get('cutting_lot_number') or o.get('lot_number', '') for o in by_scanned.values()})
+    outsourcing_by_lot, ironing_by_lot, stock_by_lot, stitched = {}, {}, {}, set()
+    async for outsourcing in db.outsourcing_orders.find(lot_numbers_query(lot_nums), {"_id": 0}):
+        for lot in order_lot_numbers(outsourcing):
+            outsourcing_by_lot.setdefault(lot, outsourcing)
+            if outsourcing.get('operation_type') == 'Stitching' and outsourcing.get('status') == 'Received':
+                stitched.add(lot)
+    async for ironing in db.ironing_orders.find({"cutting_lot_number": {"$in": lot_nums}}, {"_id": 0}):
+        ironing_by_lot.setdefault(ironing['cutting_lot_number'], ironing)
+    async for stock in db.stock.find({"lot_number": {"$in": lot_nums}, "is_active": True}, {"_id": 0}):
+        stock_by_lot.setdefault(stock['lot_number'], stock)
+
+    results = []
+    seen = set()
+    for lot_number in request.lot_numbers:
+        order = by_scanned.get(lot_number)
+        entry = {"lot_number": lot_number, "duplicate": lot_number in seen}
+        seen.add(lot_number)
+        if not order:
+            results.append({**entry, "status": "not_found", "detail": "Lot not found"})
+            continue
+        lot_num = order.get('cutting_lot_number') or order.get('lot_number', '')
+        outsourcing = outsourcing_by_lot.get(lot_num)
+        ironing = ironing_by_lot.get(lot_num)
+        stock = stock_by_lot.get(lot_num)
+        results.append({
+            **entry,
+            "status": "ok",
+            "order": order,
+            "stage": order.get('stage') or derive_lot_stage(outsourcing, ironing, stock),
+            "outsourcing": outsourcing,
+            "ironing": ironing,
+            "stock": stock,
+            "stitching_completed": bool(order.get('stitching_completed')) or lot_num in stitched
+        })
+    return bulk_lookup_response(results)
+
+
+def parse_expected_return_date(value: Optional[str], now: datetime) -> datetime:
+    """Expected return date sent with a scan; a week from now when none is given"""
+    if not value:
+        return now + timedelta(days=7)
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid expected return date '{value}'")
+
 @api_router.post("/scan/send-outsourcing")
 async def scan_send_outsourcing(data: dict):
     """Quick send to outsourcing by scanning lot QR"""
@@ -1566,7 +2699,7 @@ async def scan_send_outsourcing(data: dict):
     lot_num = order.get('cutting_lot_number') or order.get('lot_number', '')
     
     # Check if already sent
-    existing = await db.outsourcing_orders.find_one({"cutting_lot_number": lot_num})
+    existing = await db.outsourcing_orders.find_one(lot_numbers_query(lot_num), {"_id": 0, "id": 1})
     if existing:
         raise HTTPException(status_code=400, detail="Lot already sent to outsourcing")
     
@@ -1574,19 +2707,16 @@ async def scan_send_outsourcing(data: dict):
     count = await db.outsourcing_orders.count_documents({})
     dc_number = f"DC-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
-    # Parse expected return date
-    exp_date = None
-    if expected_return_date:
-        exp_date = datetime.fromisoformat(expected_return_date)
-    else:
-        exp_date = datetime.now(timezone.utc) + timedelta(days=7)
+    exp_date = parse_expected_return_date(expected_return_date, datetime.now(timezone.utc))
     
     outsourcing_dict = {
         "id": str(uuid.uuid4()),
         "dc_number": dc_number,
         "dc_date": datetime.now(timezone.utc).isoformat(),
         "cutting_order_id": order.get('id', ''),
+        "cutting_order_ids": [order['id']],
         "cutting_lot_number": lot_num,
+        "cutting_lot_numbers": [lot_num],
         "lot_number": lot_num,
         "category": order.get('category', ''),
         "style_type": order.get('style_type', ''),
@@ -1603,7 +2733,18 @@ async def scan_send_outsourcing(data: dict):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.outsourcing_orders.insert_one(outsourcing_dict)
+    transition = Transition("scan_send_outsourcing")
+    transition.guard("cutting_orders", {"id": order['id'], "outsourcing_order_ids": {"$in": [None, []]}},
+                     {"$addToSet": {"outsourcing_order_ids": outsourcing_dict['id'], "completed_operations": operation_type}},
+                     "Lot already sent to outsourcing", status_code=400)
+    transition.insert("outsourcing_orders", outsourcing_dict)
+    transition.rollup("outsourcing", outsourcing_dict)
+    transition.insert("dc_snapshots", dc_snapshot("outsourcing", outsourcing_dict))
+    transition.cutting_order_writes(lot_stage_writes([order['id']], "outsourcing", unit_name))
+    transition.events.append(("lot", "sent_to_outsourcing",
+                              {"cutting_lot_number": lot_num, "dc_number": dc_number, "operation_type": operation_type, "unit_name": unit_name},
+                              {"lot": lot_num, "unit": unit_name}))
+    await run_transition(transition)
     
     return {"message": "Sent to outsourcing successfully", "dc_number": dc_number}
 
@@ -1617,34 +2758,24 @@ async def scan_receive_outsourcing(data: dict):
     
     # Find outsourcing order
     order = await db.outsourcing_orders.find_one({
-        "cutting_lot_number": lot_number,
+        **lot_numbers_query(lot_number),
         "status": {"$ne": "Received"}
     }, {"_id": 0})
     
     if not order:
         raise HTTPException(status_code=404, detail="No pending outsourcing order found for this lot")
     
-    # Calculate shortage
-    shortage_distribution = {}
-    for size, sent_qty in order['size_distribution'].items():
-        received_qty = received_distribution.get(size, 0)
-        shortage = sent_qty - received_qty
-        if shortage > 0:
-            shortage_distribution[size] = shortage
-    
-    total_received = sum(received_distribution.values())
-    total_shortage = sum(shortage_distribution.values())
-    total_mistakes = sum((mistake_distribution or {}).values())
-    
-    # Calculate debit
+    # Calculate shortage and debits
     rate = order.get('rate_per_pcs', 0)
-    shortage_debit = round(total_shortage * rate, 2)
-    mistake_debit = round(total_mistakes * rate, 2)
+    totals = receipt_totals(order['size_distribution'], received_distribution, mistake_distribution, rate)
+    total_received = totals['total_received']
+    total_shortage = totals['total_shortage']
     
     # Create receipt
     receipt_dict = {
         "id": str(uuid.uuid4()),
         "outsourcing_order_id": order['id'],
+        "cutting_order_ids": order_cutting_ids(order),
         "cutting_lot_number": order.get('cutting_lot_number', lot_number),
         "dc_number": order['dc_number'],
         "unit_name": order['unit_name'],
@@ -1653,25 +2784,32 @@ async def scan_receive_outsourcing(data: dict):
         "sent_distribution": order.get('size_distribution', {}),
         "received_distribution": received_distribution,
         "mistake_distribution": mistake_distribution or {},
-        "shortage_distribution": shortage_distribution,
+        "shortage_distribution": totals['shortage_distribution'],
         "total_sent": order['total_quantity'],
         "total_received": total_received,
         "total_shortage": total_shortage,
-        "total_mistakes": total_mistakes,
+        "total_mistakes": totals['total_mistakes'],
         "rate_per_pcs": rate,
-        "shortage_debit_amount": shortage_debit,
-        "mistake_debit_amount": mistake_debit,
+        "shortage_debit_amount": totals['shortage_debit_amount'],
+        "mistake_debit_amount": totals['mistake_debit_amount'],
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.outsourcing_receipts.insert_one(receipt_dict)
-    
-    # Update order status
+    # Receipt, DC status and lot stage land together; the guard stops a second scan of the same DC
     new_status = 'Received' if total_shortage == 0 else 'Partial'
-    await db.outsourcing_orders.update_one(
-        {"id": order['id']},
-        {"$set": {"status": new_status}}
-    )
+    transition = Transition("scan_receive_outsourcing")
+    transition.guard("outsourcing_orders", {"id": order['id'], "status": order['status']},
+                     {"$set": {"status": new_status}, "$push": {"receipt_ids": receipt_dict['id']}},
+                     "Outsourcing order was received by another scan")
+    transition.insert("outsourcing_receipts", receipt_dict)
+    transition.rollup("outsourcing_receipt", receipt_dict, order)
+    transition.cutting_order_writes(receipt_stage_writes(order, new_status))
+    transition.events.append(("receipt", "outsourcing_received",
+                              {"cutting_lot_number": receipt_dict['cutting_lot_number'], "dc_number": order['dc_number'],
+                               "operation_type": receipt_dict['operation_type'], "status": new_status,
+                               "received": total_received, "shortage": total_shortage},
+                              {"lot": receipt_dict['cutting_lot_number'], "unit": order['unit_name']}))
+    await run_transition(transition)
     
     return {"message": "Receipt recorded successfully", "received": total_received, "shortage": total_shortage}
 
@@ -1698,12 +2836,7 @@ async def scan_create_ironing(data: dict):
     lot_num = order.get('cutting_lot_number') or order.get('lot_number', '')
     
     # BUSINESS RULE: Check if stitching outsourcing is completed before allowing ironing
-    stitching_order = await db.outsourcing_orders.find_one({
-        "cutting_lot_number": lot_num,
-        "operation_type": "Stitching",
-        "status": "Received"
-    }, {"_id": 0})
-    
+    stitching_order, outsourcing_receipt = await find_stitching_receipt(order)
     if not stitching_order:
         raise HTTPException(
             status_code=400, 
@@ -1711,15 +2844,11 @@ async def scan_create_ironing(data: dict):
         )
     
     # Check if already exists
-    existing = await db.ironing_orders.find_one({"cutting_lot_number": lot_num})
+    existing = order.get('ironing_order_id') or await db.ironing_orders.find_one({"cutting_lot_number": lot_num}, {"_id": 0, "id": 1})
     if existing:
         raise HTTPException(status_code=400, detail="Ironing order already exists for this lot")
     
-    # Get size distribution from outsourcing receipt or cutting
-    outsourcing_receipt = await db.outsourcing_receipts.find_one({
-        "dc_number": {"$regex": lot_num, "$options": "i"}
-    }, {"_id": 0})
-    
+    # Ironing takes what came back from stitching
     if outsourcing_receipt:
         size_dist = outsourcing_receipt.get('received_distribution', {})
     else:
@@ -1733,6 +2862,9 @@ async def scan_create_ironing(data: dict):
     ironing_dict = {
         "id": str(uuid.uuid4()),
         "dc_number": dc_number,
+        "receipt_id": outsourcing_receipt['id'] if outsourcing_receipt else None,
+        "outsourcing_order_id": stitching_order['id'],
+        "cutting_order_ids": [order['id']],
         "cutting_lot_number": lot_num,
         "unit_name": unit_name,
         "size_distribution": size_dist,
@@ -1742,11 +2874,22 @@ async def scan_create_ironing(data: dict):
         "total_amount": total_qty * rate_per_pcs,
         "amount_paid": 0,
         "status": "Sent",
+        "dc_date": datetime.now(timezone.utc).isoformat(),
         "sent_date": datetime.now(timezone.utc).isoformat(),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.ironing_orders.insert_one(ironing_dict)
+    transition = Transition("scan_create_ironing")
+    transition.guard("cutting_orders", {"id": order['id'], "ironing_order_id": None},
+                     {"$set": {"ironing_order_id": ironing_dict['id'], "sent_to_ironing": True}},
+                     "Ironing order already exists for this lot", status_code=400)
+    transition.insert("ironing_orders", ironing_dict)
+    transition.rollup("ironing", ironing_dict)
+    transition.insert("dc_snapshots", dc_snapshot("ironing", ironing_dict))
+    transition.cutting_order_writes(lot_stage_writes([order['id']], "ironing", unit_name))
+    transition.events.append(("lot", "sent_to_ironing", {"cutting_lot_number": lot_num, "dc_number": dc_number, "unit_name": unit_name},
+                              {"lot": lot_num, "unit": unit_name}))
+    await run_transition(transition)
     
     return {"message": "Ironing order created successfully", "dc_number": dc_number}
 
@@ -1767,22 +2910,11 @@ async def scan_receive_ironing(data: dict):
     if not ironing_order:
         raise HTTPException(status_code=404, detail="No pending ironing order found for this lot")
     
-    # Calculate shortage
-    shortage_distribution = {}
-    for size, sent_qty in ironing_order['size_distribution'].items():
-        received_qty = received_distribution.get(size, 0)
-        shortage = sent_qty - received_qty
-        if shortage > 0:
-            shortage_distribution[size] = shortage
-    
-    total_received = sum(received_distribution.values())
-    total_shortage = sum(shortage_distribution.values())
-    total_mistakes = sum((mistake_distribution or {}).values())
-    
-    # Calculate debit
+    # Calculate shortage and debits
     rate = ironing_order.get('rate_per_pcs', 0)
-    shortage_debit = round(total_shortage * rate, 2)
-    mistake_debit = round(total_mistakes * rate, 2)
+    totals = receipt_totals(ironing_order['size_distribution'], received_distribution, mistake_distribution, rate)
+    total_received = totals['total_received']
+    total_shortage = totals['total_shortage']
     
     # Calculate master packs
     master_pack_ratio = ironing_order.get('master_pack_ratio', {})
@@ -1804,15 +2936,15 @@ async def scan_receive_ironing(data: dict):
         "receipt_date": datetime.now(timezone.utc).isoformat(),
         "received_distribution": received_distribution,
         "mistake_distribution": mistake_distribution or {},
-        "shortage_distribution": shortage_distribution,
+        "shortage_distribution": totals['shortage_distribution'],
         "sent_distribution": ironing_order['size_distribution'],
         "total_sent": ironing_order['total_quantity'],
         "total_received": total_received,
         "total_shortage": total_shortage,
-        "total_mistakes": total_mistakes,
+        "total_mistakes": totals['total_mistakes'],
         "rate_per_pcs": rate,
-        "shortage_debit_amount": shortage_debit,
-        "mistake_debit_amount": mistake_debit,
+        "shortage_debit_amount": totals['shortage_debit_amount'],
+        "mistake_debit_amount": totals['mistake_debit_amount'],
         "master_pack_ratio": master_pack_ratio,
         "complete_packs": complete_packs,
         "loose_pieces": loose_pieces,
@@ -1820,21 +2952,8 @@ async def scan_receive_ironing(data: dict):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.ironing_receipts.insert_one(receipt_dict)
-    
-    # Update ironing order status
-    await db.ironing_orders.update_one(
-        {"id": ironing_order['id']},
-        {"$set": {"status": "Received"}}
-    )
-    
     # AUTO-CREATE STOCK ENTRY
-    cutting_order = await db.cutting_orders.find_one({
-        "$or": [
-            {"cutting_lot_number": lot_number},
-            {"lot_number": lot_number}
-        ]
-    }, {"_id": 0})
+    cutting_order = await find_ironing_cutting_order(ironing_order)
     
     stock_count = await db.stock.count_documents({})
     stock_code = f"STK-{str(stock_count + 1).zfill(4)}"
@@ -1849,6 +2968,8 @@ async def scan_receive_ironing(data: dict):
         "lot_number": stock_lot_name,  # Use custom lot name if provided
         "source": "ironing",
         "source_ironing_receipt_id": receipt_id,
+        "ironing_order_id": ironing_order['id'],
+        "cutting_order_ids": order_cutting_ids(ironing_order) or ([cutting_order['id']] if cutting_order else []),
         "category": ironing_order.get('category', '') or (cutting_order.get('category', 'Mens') if cutting_order else 'Mens'),
         "style_type": ironing_order.get('style_type', '') or (cutting_order.get('style_type', '') if cutting_order else ''),
         "color": stock_color,  # Use custom color if provided
@@ -1858,12 +2979,27 @@ async def scan_receive_ironing(data: dict):
         "master_pack_ratio": master_pack_ratio,
         "complete_packs": complete_packs,
         "loose_pieces": loose_pieces,
+        "loose_distribution": loose_dist,
         "notes": f"Auto-created from ironing - DC: {ironing_order['dc_number']}",
         "is_active": True,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.stock.insert_one(stock_entry)
+    # Receipt, DC status, stock entry and lineage land together: never a "Received" DC without its stock
+    receipt_dict['stock_id'] = stock_entry['id']
+    transition = Transition("scan_receive_ironing")
+    stock_lineage_writes(transition, ironing_order, stock_entry)
+    transition.insert("ironing_receipts", receipt_dict)
+    transition.rollup("ironing_receipt", receipt_dict, ironing_order)
+    transition.insert("stock", with_search_keys("stock", stock_entry))
+    transition.events.append(("receipt", "ironing_received",
+                              {"cutting_lot_number": receipt_dict['cutting_lot_number'], "dc_number": ironing_order['dc_number'],
+                               "received": total_received, "shortage": total_shortage},
+                              {"lot": receipt_dict['cutting_lot_number'], "unit": ironing_order['unit_name']}))
+    transition.events.append(("stock", "stock_created",
+                              {"stock_code": stock_code, "lot_number": stock_entry['lot_number'], "available_quantity": total_received},
+                              {"lot": receipt_dict['cutting_lot_number'], "stock_code": stock_code}))
+    await run_transition(transition)
     
     return {
         "message": "Ironing receipt recorded & Stock created!",
@@ -1875,6 +3011,529 @@ async def scan_receive_ironing(data: dict):
     }
 
 
+# ==================== BATCH SCAN ====================
+# A phone can queue a whole bundle pile (send or receive 30-60 lots) and submit it at
+# once. All lots are resolved with $in queries up front, each operation is validated
+# against in-memory state (so a receive followed by create-ironing in the same batch
+# sees the stitching completion), and the writes go out as one bulk_write per collection.
+MAX_SCAN_BATCH = 500
+
+class ScanBatchState(Transition):
+    """Everything the batch's operations read, loaded once and updated as operations apply"""
+
+    def __init__(self):
+        super().__init__("scan_batch")
+        self.now = datetime.now(timezone.utc)
+        self.cutting_orders = {}
+        self.outsourcing_orders = {}
+        self.ironing_orders = {}
+        self.stitching_receipts = {}
+        self.next_stock_number = None
+        self.dc_sequence = 0
+
+    def next_dc_number(self, prefix: str) -> str:
+        # Scan DCs are timestamped to the second; a batch numbers its DCs within that second
+        self.dc_sequence += 1
+        return f"{prefix}-{self.now.strftime('%Y%m%d%H%M%S')}-{self.dc_sequence:02d}"
+
+    def checkpoint(self) -> tuple:
+        """Where the buffered writes stand before an operation, so a failed operation leaves nothing behind"""
+        return (len(self.guards), {c: len(docs) for c, docs in self.inserts.items()},
+                {c: len(requests) for c, requests in self.updates.items()},
+                {key: defaultdict(int, fields) for key, fields in self.rollups.items()},
+                len(self.events), self.next_stock_number, self.dc_sequence)
+
+    def rollback(self, checkpoint: tuple):
+        guards, inserts, updates, rollups, events, self.next_stock_number, self.dc_sequence = checkpoint
+        del self.guards[guards:]
+        for collection, docs in self.inserts.items():
+            del docs[inserts.get(collection, 0):]
+        for collection, requests in self.updates.items():
+            del requests[updates.get(collection, 0):]
+        self.rollups = rollups
+        del self.events[events:]
+
+    def inserted(self, collection: str, doc_id: str) -> bool:
+        """Whether the batch itself creates this document; guards only see what was in the database before it"""
+        return any(doc['id'] == doc_id for doc in self.inserts.get(collection, []))
+
+    def cutting_order(self, lot_number: str) -> dict:
+        order = self.cutting_orders.get(lot_number)
+        if not order:
+            raise HTTPException(status_code=404, detail="Lot not found")
+        return order
+
+async def load_scan_batch_state(operations: List[ScanOperation]) -> ScanBatchState:
+    state = ScanBatchState()
+    lot_numbers = list({op.lot_number for op in operations})
+
+    cutting_orders = await db.cutting_orders.find({
+        "$or": [
+            {"cutting_lot_number": {"$in": lot_numbers}},
+            {"lot_number": {"$in": lot_numbers}}
+        ]
+    }, {"_id": 0}).to_list(None)
+    # Same precedence as the single-lot endpoints: cutting lot number first, then fabric lot number
+    for order in cutting_orders:
+        if order.get('lot_number') in lot_numbers:
+            state.cutting_orders.setdefault(order['lot_number'], order)
+    for order in cutting_orders:
+        if order.get('cutting_lot_number') in lot_numbers:
+            state.cutting_orders[order['cutting_lot_number']] = order
+
+    lot_keys = set(lot_numbers)
+    lot_keys.update(o.get('cutting_lot_number') or o.get('lot_number', '') for o in cutting_orders)
+    lot_keys = list(lot_keys)
+
+    # Oldest first per lot; DCs the batch creates are appended after them
+    async for order in db.outsourcing_orders.find(lot_numbers_query(lot_keys), {"_id": 0}).sort("created_at", 1):
+        for lot in order_lot_numbers(order):
+            state.outsourcing_orders.setdefault(lot, []).append(order)
+    async for order in db.ironing_orders.find({"cutting_lot_number": {"$in": lot_keys}}, {"_id": 0}):
+        state.ironing_orders.setdefault(order['cutting_lot_number'], []).append(order)
+
+    stitching_ids = [
+        o['id'] for orders in state.outsourcing_orders.values() for o in orders if o.get('operation_type') == 'Stitching'
+    ]
+    if stitching_ids:
+        async for receipt in db.outsourcing_receipts.find(
+            {"outsourcing_order_id": {"$in": stitching_ids}}, {"_id": 0}
+        ).sort("created_at", 1):
+            state.stitching_receipts[receipt['outsourcing_order_id']] = receipt
+
+    if any(op.op == "receive_ironing" for op in operations):
+        state.next_stock_number = await db.stock.count_documents({}) + 1
+    return state
+
+def apply_scan_send_outsourcing(state: ScanBatchState, op: ScanOperation) -> dict:
+    order = state.cutting_order(op.lot_number)
+    lot_num = order.get('cutting_lot_number') or order.get('lot_number', '')
+    if state.outsourcing_orders.get(lot_num):
+        raise HTTPException(status_code=400, detail="Lot already sent to outsourcing")
+
+    now_iso = state.now.isoformat()
+    exp_date = parse_expected_return_date(op.expected_return_date, state.now)
+    size_distribution = order.get('bundle_distribution', {})
+    total_quantity = sum(size_distribution.values())
+    dc_number = state.next_dc_number("DC")
+    outsourcing_dict = {
+        "id": str(uuid.uuid4()),
+        "dc_number": dc_number,
+        "dc_date": now_iso,
+        "cutting_order_id": order.get('id', ''),
+        "cutting_order_ids": [order['id']],
+        "cutting_lot_number": lot_num,
+        "cutting_lot_numbers": [lot_num],
+        "lot_number": lot_num,
+        "category": order.get('category', ''),
+        "style_type": order.get('style_type', ''),
+        "unit_name": op.unit_name,
+        "operation_type": op.operation_type,
+        "size_distribution": size_distribution,
+        "total_quantity": total_quantity,
+        "rate_per_pcs": op.rate_per_pcs,
+        "total_amount": total_quantity * op.rate_per_pcs,
+        "amount_paid": 0,
+        "status": "Sent",
+        "sent_date": now_iso,
+        "expected_return_date": exp_date.isoformat(),
+        "created_at": now_iso
+    }
+    # The state was read outside the transaction: another device may have sent the lot since
+    state.guard("cutting_orders", {"id": order['id'], "outsourcing_order_ids": {"$in": [None, []]}},
+                {"$addToSet": {"outsourcing_order_ids": outsourcing_dict['id'], "completed_operations": op.operation_type}},
+                "Lot already sent to outsourcing", status_code=400)
+    state.insert("outsourcing_orders", outsourcing_dict)
+    state.rollup("outsourcing", outsourcing_dict)
+    state.insert("dc_snapshots", dc_snapshot("outsourcing", outsourcing_dict))
+    state.cutting_order_writes(lot_stage_writes([order['id']], "outsourcing", op.unit_name))
+    state.outsourcing_orders.setdefault(lot_num, []).append(outsourcing_dict)
+    state.events.append(("lot", "sent_to_outsourcing",
+                         {"cutting_lot_number": lot_num, "dc_number": dc_number, "operation_type": op.operation_type,
+                          "unit_name": op.unit_name},
+                         {"lot": lot_num, "unit": op.unit_name}))
+    return {"message": "Sent to outsourcing successfully", "dc_number": dc_number}
+
+def apply_scan_receive_outsourcing(state: ScanBatchState, op: ScanOperation) -> dict:
+    pending = [o for o in state.outsourcing_orders.get(op.lot_number, []) if o.get('status') != 'Received']
+    if not pending:
+        raise HTTPException(status_code=404, detail="No pending outsourcing order found for this lot")
+    order = pending[0]
+
+    received_distribution = op.received_distribution or {}
+    totals = receipt_totals(order['size_distribution'], received_distribution, op.mistake_distribution,
+                                 order.get('rate_per_pcs', 0))
+    now_iso = state.now.isoformat()
+    receipt_dict = {
+        "id": str(uuid.uuid4()),
+        "outsourcing_order_id": order['id'],
+        "cutting_order_ids": order_cutting_ids(order),
+        "cutting_lot_number": order.get('cutting_lot_number', op.lot_number),
+        "dc_number": order['dc_number'],
+        "unit_name": order['unit_name'],
+        "operation_type": order.get('operation_type', ''),
+        "receipt_date": now_iso,
+        "sent_distribution": order.get('size_distribution', {}),
+        "received_distribution": received_distribution,
+        "mistake_distribution": op.mistake_distribution or {},
+        "shortage_distribution": totals['shortage_distribution'],
+        "total_sent": order['total_quantity'],
+        "total_received": totals['total_received'],
+        "total_shortage": totals['total_shortage'],
+        "total_mistakes": totals['total_mistakes'],
+        "rate_per_pcs": order.get('rate_per_pcs', 0),
+        "shortage_debit_amount": totals['shortage_debit_amount'],
+        "mistake_debit_amount": totals['mistake_debit_amount'],
+        "created_at": now_iso
+    }
+    new_status = 'Received' if totals['total_shortage'] == 0 else 'Partial'
+    status_update = {"$set": {"status": new_status}, "$push": {"receipt_ids": receipt_dict['id']}}
+    if state.inserted("outsourcing_orders", order['id']):
+        state.update("outsourcing_orders", {"id": order['id']}, status_update)
+    else:
+        # Stops a second device (or a replayed sync) receiving the same DC
+        state.guard("outsourcing_orders", {"id": order['id'], "status": order['status']}, status_update,
+                    "Outsourcing order was received by another scan")
+    state.insert("outsourcing_receipts", receipt_dict)
+    state.rollup("outsourcing_receipt", receipt_dict, order)
+    state.cutting_order_writes(receipt_stage_writes(order, new_status))
+    order['status'] = new_status
+    if order.get('operation_type') == 'Stitching':
+        state.stitching_receipts[order['id']] = receipt_dict
+    state.events.append(("receipt", "outsourcing_received",
+                         {"cutting_lot_number": receipt_dict['cutting_lot_number'], "dc_number": order['dc_number'],
+                          "operation_type": receipt_dict['operation_type'], "status": new_status,
+                          "received": totals['total_received'], "shortage": totals['total_shortage']},
+                         {"lot": receipt_dict['cutting_lot_number'], "unit": order['unit_name']}))
+    return {"message": "Receipt recorded successfully", "received": totals['total_received'], "shortage": totals['total_shortage']}
+
+def apply_scan_create_ironing(state: ScanBatchState, op: ScanOperation) -> dict:
+    order = state.cutting_order(op.lot_number)
+    lot_num = order.get('cutting_lot_number') or order.get('lot_number', '')
+
+    # BUSINESS RULE: stitching must be received before ironing
+    stitching_orders = [
+        o for o in state.outsourcing_orders.get(lot_num, [])
+        if o.get('operation_type') == 'Stitching' and o.get('status') == 'Received'
+    ]
+    if not stitching_orders:
+        raise HTTPException(
+            status_code=400,
+            detail="Ironing requires completed stitching. Please complete stitching outsourcing first and receive the goods back."
+        )
+    if state.ironing_orders.get(lot_num):
+        raise HTTPException(status_code=400, detail="Ironing order already exists for this lot")
+
+    # Ironing takes what came back from the latest stitching DC, as the single scan does
+    stitching_order = stitching_orders[-1]
+    stitching_receipt = state.stitching_receipts.get(stitching_order['id'])
+    if stitching_receipt:
+        size_dist = stitching_receipt.get('received_distribution', {})
+    else:
+        size_dist = order.get('bundle_distribution', {})
+    total_qty = sum(size_dist.values())
+
+    now_iso = state.now.isoformat()
+    dc_number = state.next_dc_number("IR")
+    ironing_dict = {
+        "id": str(uuid.uuid4()),
+        "dc_number": dc_number,
+        "receipt_id": stitching_receipt['id'] if stitching_receipt else None,
+        "outsourcing_order_id": stitching_order['id'],
+        "cutting_order_ids": [order['id']],
+        "cutting_lot_number": lot_num,
+        "unit_name": op.unit_name,
+        "size_distribution": size_dist,
+        "total_quantity": total_qty,
+        "master_pack_ratio": op.master_pack_ratio or {},
+        "rate_per_pcs": op.rate_per_pcs,
+        "total_amount": total_qty * op.rate_per_pcs,
+        "amount_paid": 0,
+        "status": "Sent",
+        "dc_date": now_iso,
+        "sent_date": now_iso,
+        "created_at": now_iso
+    }
+    state.guard("cutting_orders", {"id": order['id'], "ironing_order_id": None},
+                {"$set": {"ironing_order_id": ironing_dict['id'], "sent_to_ironing": True}},
+                "Ironing order already exists for this lot", status_code=400)
+    state.insert("ironing_orders", ironing_dict)
+    state.rollup("ironing", ironing_dict)
+    state.insert("dc_snapshots", dc_snapshot("ironing", ironing_dict))
+    state.cutting_order_writes(lot_stage_writes([order['id']], "ironing", op.unit_name))
+    state.ironing_orders.setdefault(lot_num, []).append(ironing_dict)
+    state.events.append(("lot", "sent_to_ironing",
+                         {"cutting_lot_number": lot_num, "dc_number": dc_number, "unit_name": op.unit_name},
+                         {"lot": lot_num, "unit": op.unit_name}))
+    return {"message": "Ironing order created successfully", "dc_number": dc_number}
+
+def apply_scan_receive_ironing(state: ScanBatchState, op: ScanOperation) -> dict:
+    pending = [o for o in state.ironing_orders.get(op.lot_number, []) if o.get('status') != 'Received']
+    if not pending:
+        raise HTTPException(status_code=404, detail="No pending ironing order found for this lot")
+    ironing_order = pending[0]
+
+    received_distribution = op.received_distribution or {}
+    rate = ironing_order.get('rate_per_pcs', 0)
+    totals = receipt_totals(ironing_order['size_distribution'], received_distribution, op.mistake_distribution, rate)
+    total_received = totals['total_received']
+
+    master_pack_ratio = ironing_order.get('master_pack_ratio', {})
+    if master_pack_ratio:
+        complete_packs, loose_pieces, loose_dist = calculate_master_packs(received_distribution, master_pack_ratio)
+    else:
+        complete_packs, loose_pieces, loose_dist = 0, total_received, received_distribution.copy()
+
+    now_iso = state.now.isoformat()
+    receipt_id = str(uuid.uuid4())
+    receipt_dict = {
+        "id": receipt_id,
+        "ironing_order_id": ironing_order['id'],
+        "cutting_lot_number": ironing_order.get('cutting_lot_number', op.lot_number),
+        "dc_number": ironing_order['dc_number'],
+        "unit_name": ironing_order['unit_name'],
+        "receipt_date": now_iso,
+        "received_distribution": received_distribution,
+        "mistake_distribution": op.mistake_distribution or {},
+        "shortage_distribution": totals['shortage_distribution'],
+        "sent_distribution": ironing_order['size_distribution'],
+        "total_sent": ironing_order['total_quantity'],
+        "total_received": total_received,
+        "total_shortage": totals['total_shortage'],
+        "total_mistakes": totals['total_mistakes'],
+        "rate_per_pcs": rate,
+        "shortage_debit_amount": totals['shortage_debit_amount'],
+        "mistake_debit_amount": totals['mistake_debit_amount'],
+        "master_pack_ratio": master_pack_ratio,
+        "complete_packs": complete_packs,
+        "loose_pieces": loose_pieces,
+        "loose_pieces_distribution": loose_dist,
+        "created_at": now_iso
+    }
+    state.insert("ironing_receipts", receipt_dict)
+    state.rollup("ironing_receipt", receipt_dict, ironing_order)
+
+    # AUTO-CREATE STOCK ENTRY
+    cutting_order = state.cutting_orders.get(op.lot_number)
+    stock_code = f"STK-{str(state.next_stock_number).zfill(4)}"
+    state.next_stock_number += 1
+    stock_lot_name = ironing_order.get('stock_lot_name', '') or op.lot_number
+    stock_entry = {
+        "id": str(uuid.uuid4()),
+        "stock_code": stock_code,
+        "lot_number": stock_lot_name,
+        "source": "ironing",
+        "source_ironing_receipt_id": receipt_id,
+        "ironing_order_id": ironing_order['id'],
+        "cutting_order_ids": order_cutting_ids(ironing_order) or ([cutting_order['id']] if cutting_order else []),
+        "category": ironing_order.get('category', '') or (cutting_order.get('category', 'Mens') if cutting_order else 'Mens'),
+        "style_type": ironing_order.get('style_type', '') or (cutting_order.get('style_type', '') if cutting_order else ''),
+        "color": ironing_order.get('stock_color', '') or ironing_order.get('color', '') or (cutting_order.get('color', '') if cutting_order else ''),
+        "size_distribution": received_distribution,
+        "total_quantity": total_received,
+        "available_quantity": total_received,
+        "master_pack_ratio": master_pack_ratio,
+        "complete_packs": complete_packs,
+        "loose_pieces": loose_pieces,
+        "loose_distribution": loose_dist,
+        "notes": f"Auto-created from ironing - DC: {ironing_order['dc_number']}",
+        "is_active": True,
+        "created_at": now_iso
+    }
+    state.insert("stock", with_search_keys("stock", stock_entry))
+    receipt_dict['stock_id'] = stock_entry['id']
+    stock_lineage_writes(state, ironing_order, stock_entry, guarded=not state.inserted("ironing_orders", ironing_order['id']))
+    ironing_order['status'] = 'Received'
+    lot_num = receipt_dict['cutting_lot_number']
+    state.events.append(("receipt", "ironing_received",
+                         {"cutting_lot_number": lot_num, "dc_number": ironing_order['dc_number'],
+                          "received": total_received, "shortage": totals['total_shortage']},
+                         {"lot": lot_num, "unit": ironing_order['unit_name']}))
+    state.events.append(("stock", "stock_created",
+                         {"stock_code": stock_code, "lot_number": stock_lot_name, "available_quantity": total_received},
+                         {"lot": lot_num, "stock_code": stock_code}))
+    return {
+        "message": "Ironing receipt recorded & Stock created!",
+        "received": total_received,
+        "shortage": totals['total_shortage'],
+        "stock_code": stock_code,
+        "complete_packs": complete_packs,
+        "loose_pieces": loose_pieces
+    }
+
+SCAN_HANDLERS = {
+    "send_outsourcing": apply_scan_send_outsourcing,
+    "receive_outsourcing": apply_scan_receive_outsourcing,
+    "create_ironing": apply_scan_create_ironing,
+    "receive_ironing": apply_scan_receive_ironing,
+}
+
+async def flush_scan_batch(state: ScanBatchState):
+    # The whole batch is one transition: every lot in it moves, or none does
+    await run_transition(state)
+
+async def run_scan_operations(operations: List[ScanOperation]) -> list:
+    """Validate and apply scan operations in order; one result per operation"""
+    state = await load_scan_batch_state(operations)
+    results = []
+    for index, op in enumerate(operations):
+        result = {"index": index, "op": op.op, "lot_number": op.lot_number}
+        handler = SCAN_HANDLERS.get(op.op)
+        if not handler:
+            results.append({**result, "status": "error", "status_code": 400, "detail": f"Unknown scan operation '{op.op}'"})
+            continue
+        checkpoint = state.checkpoint()
+        try:
+            results.append({**result, "status": "ok", **handler(state, op)})
+        except HTTPException as e:
+            state.rollback(checkpoint)
+            results.append({**result, "status": "error", "status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            state.rollback(checkpoint)
+            # One bad operation is that item's error, not a failed batch (a synced queue would fail on every replay)
+            logging.exception(f"Scan operation {index} ({op.op}) failed")
+            results.append({**result, "status": "error", "status_code": 500, "detail": f"Scan could not be applied: {e}"})
+    await flush_scan_batch(state)
+    return results
+
+@api_router.post("/scan/batch")
+async def scan_batch(batch: ScanBatch):
+    """Apply a list of scan operations (send/receive outsourcing, create/receive ironing) in one request"""
+    if not batch.operations:
+        raise HTTPException(status_code=400, detail="No scan operations provided")
+    if len(batch.operations) > MAX_SCAN_BATCH:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {MAX_SCAN_BATCH} operations")
+
+    results = await run_scan_operations(batch.operations)
+    succeeded = sum(1 for r in results if r['status'] == 'ok')
+    return {
+        "message": f"{succeeded} of {len(results)} scans applied",
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
+
+# ==================== OFFLINE SCAN SYNC ====================
+# Phones queue scans while offline and push the queue here, possibly more than once.
+# Each operation carries a device-generated idempotency key; the key is claimed in
+# sync_operations (unique index) before the operation runs and its outcome is stored
+# there, so a replayed queue returns the original outcomes instead of writing twice.
+MAX_SYNC_BODY_BYTES = 10 * 1024 * 1024
+
+async def read_sync_batch(request: Request) -> SyncBatch:
+    """Parse a sync body, which devices may send gzip-compressed"""
+    body = await request.body()
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        try:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            body = decompressor.decompress(body, MAX_SYNC_BODY_BYTES)
+            if decompressor.unconsumed_tail:
+                raise HTTPException(status_code=413, detail="Sync payload too large")
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="Invalid gzip body")
+    try:
+        return SyncBatch.model_validate_json(body)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def claim_sync_operations(batch: SyncBatch):
+    """Claim every key; returns (claimed operations in order, stored records of keys already seen)"""
+    now = datetime.now(timezone.utc)
+    claims = [{
+        "idempotency_key": op.idempotency_key,
+        "device_id": batch.device_id,
+        "op": op.op,
+        "lot_number": op.lot_number,
+        "client_timestamp": op.client_timestamp,
+        "status": "pending",
+        # BSON date (not an ISO string) so the TTL index can expire it
+        "applied_at": now,
+        "created_at": now.isoformat()
+    } for op in batch.operations]
+
+    duplicate_indexes = set()
+    try:
+        await db.sync_operations.insert_many(claims, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            if error.get('code') != 11000:
+                raise
+            duplicate_indexes.add(error['index'])
+
+    # A key repeated inside the same batch is claimed by its first occurrence only
+    first_seen = {}
+    for index, op in enumerate(batch.operations):
+        if op.idempotency_key in first_seen and index not in duplicate_indexes:
+            duplicate_indexes.add(index)
+        first_seen.setdefault(op.idempotency_key, index)
+
+    seen_keys = list({batch.operations[i].idempotency_key for i in duplicate_indexes})
+    stored = {}
+    if seen_keys:
+        async for record in db.sync_operations.find({"idempotency_key": {"$in": seen_keys}}, {"_id": 0}):
+            stored[record['idempotency_key']] = record
+    claimed = [(i, op) for i, op in enumerate(batch.operations) if i not in duplicate_indexes]
+    return claimed, duplicate_indexes, stored
+
+@api_router.post("/sync")
+async def sync_scan_queue(request: Request):
+    """Apply a device's queued scan operations in order, exactly once per idempotency key"""
+    batch = await read_sync_batch(request)
+    if not batch.operations:
+        return {"applied": 0, "replayed": 0, "failed": 0, "results": []}
+    if len(batch.operations) > MAX_SCAN_BATCH:
+        raise HTTPException(status_code=400, detail=f"A sync batch can hold at most {MAX_SCAN_BATCH} operations")
+
+    claimed, duplicate_indexes, stored = await claim_sync_operations(batch)
+    try:
+        applied = await run_scan_operations([op for _, op in claimed]) if claimed else []
+    except Exception:
+        if await transactions_supported():
+            # The batch transaction rolled back: nothing was written, so the device may retry
+            await db.sync_operations.delete_many(
+                {"idempotency_key": {"$in": [op.idempotency_key for _, op in claimed]}, "status": "pending"}
+            )
+        else:
+            # Without a transaction some writes may have landed; a replay must not apply them twice
+            await db.sync_operations.bulk_write([UpdateOne(
+                {"idempotency_key": op.idempotency_key, "status": "pending"},
+                {"$set": {"status": "in_doubt", "result": {
+                    "op": op.op, "lot_number": op.lot_number, "status": "error", "status_code": 500,
+                    "detail": "Sync failed part-way; check the lot's stage before scanning it again"
+                }}}
+            ) for _, op in claimed], ordered=False)
+        raise
+
+    outcomes = {}
+    writes = []
+    for (index, op), result in zip(claimed, applied):
+        outcome = {k: v for k, v in result.items() if k != 'index'}
+        outcomes[index] = outcome
+        writes.append(UpdateOne(
+            {"idempotency_key": op.idempotency_key},
+            {"$set": {"status": outcome['status'], "result": outcome}}
+        ))
+    if writes:
+        await db.sync_operations.bulk_write(writes, ordered=False)
+
+    results = []
+    for index, op in enumerate(batch.operations):
+        if index in duplicate_indexes:
+            record = stored.get(op.idempotency_key, {})
+            result = record.get('result') or {"op": op.op, "lot_number": op.lot_number, "status": "in_progress"}
+            results.append({"idempotency_key": op.idempotency_key, "replayed": True, **result})
+        else:
+            results.append({"idempotency_key": op.idempotency_key, "replayed": False, **outcomes[index]})
+
+    return {
+        "applied": sum(1 for r in results if not r['replayed'] and r['status'] == 'ok'),
+        "replayed": sum(1 for r in results if r['replayed']),
+        "failed": sum(1 for r in results if not r['replayed'] and r['status'] == 'error'),
+        "results": results
+    }
+
+
 # ==================== OUTSOURCING UNIT ROUTES ====================
 
 @api_router.get("/outsourcing-units", response_model=List[OutsourcingUnit])
@@ -2050,14 +3709,22 @@ async def create_outsourcing_order(order: OutsourcingOrderCreate, current_user:
     doc['dc_date'] = doc['dc_date'].isoformat()
     doc['created_at'] = doc['created_at'].isoformat()
     
-    await db.outsourcing_orders.insert_one(doc)
-    
-    # Mark this operation as completed on ALL selected cutting orders
-    for cutting_order_id in cutting_order_ids:
-        await db.cutting_orders.update_one(
-            {"id": cutting_order_id},
-            {"$addToSet": {"completed_operations": operation_type}}
-        )
+    # Mark this operation as completed on ALL selected cutting orders in one update, link them to the DC
+    # and move them on; the guard fails the whole DC if another send claimed any of the lots meanwhile
+    transition = Transition("create_outsourcing_order")
+    transition.guard("cutting_orders", {"id": {"$in": cutting_order_ids}, "completed_operations": {"$ne": operation_type}},
+                     {"$addToSet": {"completed_operations": operation_type, "outsourcing_order_ids": doc['id']}},
+                     f"One of the selected lots has already been sent for '{operation_type}'",
+                     expected=len(cutting_orders), status_code=400)
+    transition.insert("outsourcing_orders", doc)
+    transition.rollup("outsourcing", doc)
+    transition.insert("dc_snapshots", dc_snapshot("outsourcing", doc, issued_by=order_dict['created_by']))
+    transition.cutting_order_writes(lot_stage_writes(cutting_order_ids, "outsourcing", doc['unit_name']))
+    transition.events.append(("lot", "sent_to_outsourcing",
+                              {"cutting_lot_number": doc['cutting_lot_number'], "dc_number": doc['dc_number'],
+                               "operation_type": operation_type, "unit_name": doc['unit_name']},
+                              {"lot": doc['cutting_lot_number'], "unit": doc['unit_name']}))
+    await run_transition(transition)
     
     return order_obj
 
@@ -2091,43 +3758,34 @@ async def get_overdue_outsourcing_orders():
     """
     Get outsourcing orders that have been sent but not received for more than 7 days
     """
-    # Calculate cutoff date (7 days ago)
-    cutoff_date = datetime.now(timezone.utc) - timedelta(days=7)
+    now = datetime.now(timezone.utc)
+    cutoff_date = (now - timedelta(days=OVERDUE_DAYS)).isoformat()
     
-    # Find orders with status 'Sent' and dc_date older than 7 days
+    # Oldest first straight off the (status, dc_date) index
     orders = await db.outsourcing_orders.find(
-        {"status": "Sent"},
+        {"status": "Sent", "dc_date": {"$lt": cutoff_date}},
         {"_id": 0}
-    ).to_list(1000)
+    ).sort("dc_date", 1).to_list(1000)
     
     overdue_orders = []
     
     for order in orders:
-        # Parse dc_date
-        dc_date = order.get('dc_date')
-        if isinstance(dc_date, str):
-            dc_date = datetime.fromisoformat(dc_date.replace('Z', '+00:00'))
-        
-        # Make sure dc_date is timezone-aware
-        if dc_date and dc_date.tzinfo is None:
+        dc_date = datetime.fromisoformat(order['dc_date'].replace('Z', '+00:00'))
+        if dc_date.tzinfo is None:
             dc_date = dc_date.replace(tzinfo=timezone.utc)
         
-        # Check if overdue (more than 7 days)
-        if dc_date and dc_date < cutoff_date:
-            days_pending = (datetime.now(timezone.utc) - dc_date).days
-            
-            overdue_orders.append({
-                "id": order['id'],
-                "dc_number": order['dc_number'],
-                "cutting_lot_number": order.get('cutting_lot_number', 'N/A'),
-                "operation_type": order['operation_type'],
-                "unit_name": order['unit_name'],
-                "dc_date": dc_date.isoformat(),
-                "days_pending": days_pending,
-                "total_quantity": order.get('total_quantity', 0),
-                "category": order.get('category', ''),
-                "style_type": order.get('style_type', '')
-            })
+        overdue_orders.append({
+            "id": order['id'],
+            "dc_number": order['dc_number'],
+            "cutting_lot_number": order.get('cutting_lot_number', 'N/A'),
+            "operation_type": order['operation_type'],
+            "unit_name": order['unit_name'],
+            "dc_date": dc_date.isoformat(),
+            "days_pending": (now - dc_date).days,
+            "total_quantity": order.get('total_quantity', 0),
+            "category": order.get('category', ''),
+            "style_type": order.get('style_type', '')
+        })
     
     # Sort by days_pending (most overdue first)
     overdue_orders.sort(key=lambda x: x['days_pending'], reverse=True)
@@ -2183,87 +3841,100 @@ async def update_outsourcing_order(order_id: str, order_update: OutsourcingOrder
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Outsourcing order not found")
     
+    await apply_rollup("outsourcing", existing_order, {**existing_order, **update_data})
+    await reindex_for_search("outsourcing_orders", order_id)
     return await get_outsourcing_order(order_id)
 
 @api_router.delete("/outsourcing-orders/{order_id}")
 async def delete_outsourcing_order(order_id: str):
-    result = await db.outsourcing_orders.delete_one({"id": order_id})
+    order = await db.outsourcing_orders.find_one_and_delete({"id": order_id}, projection={"_id": 0})
     
-    if result.deleted_count == 0:
+    if not order:
         raise HTTPException(status_code=404, detail="Outsourcing order not found")
     
+    await db.cutting_orders.update_many(
+        {"id": {"$in": order_cutting_ids(order)}}, {"$pull": {"outsourcing_order_ids": order_id}}
+    )
+    await refresh_lot_stages(order_cutting_ids(order))
+    await db.dc_snapshots.delete_many({"kind": "outsourcing", "order_id": order_id})
+    await apply_rollup("outsourcing", old=order)
+    
+    await unindex_for_search("outsourcing_orders", [order_id])
     return {"message": "Outsourcing order deleted successfully"}
 
 
 # Outsourcing Receipt Routes
+MAX_BULK_RECEIPTS = 200
+
+async def record_outsourcing_receipts(receipts: List[OutsourcingReceiptCreate], name: str) -> List[OutsourcingReceipt]:
+    """Receipts against their DCs: totals from one kernel pass, all written as one transition"""
+    order_ids = [receipt.outsourcing_order_id for receipt in receipts]
+    if len(set(order_ids)) != len(order_ids):
+        raise HTTPException(status_code=400, detail="Each outsourcing order can be received only once per request")
+    orders = {
+        order['id']: order
+        async for order in db.outsourcing_orders.find({"id": {"$in": order_ids}}, {"_id": 0})
+    }
+    missing = [order_id for order_id in order_ids if order_id not in orders]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Outsourcing order not found: {', '.join(missing)}")
+    
+    # Shortage, mistakes and debits for every receipt at once
+    totals = batch_receipt_totals([
+        (orders[receipt.outsourcing_order_id]['size_distribution'], receipt.received_distribution,
+         receipt.mistake_distribution, orders[receipt.outsourcing_order_id]['rate_per_pcs'])
+        for receipt in receipts
+    ])
+    
+    transition = Transition(name)
+    created = []
+    for receipt, amounts in zip(receipts, totals):
+        outsourcing_order = orders[receipt.outsourcing_order_id]
+        receipt_obj = OutsourcingReceipt(**{
+            **receipt.model_dump(),
+            "mistake_distribution": receipt.mistake_distribution or {},
+            "dc_number": outsourcing_order['dc_number'],
+            "cutting_order_ids": order_cutting_ids(outsourcing_order),
+            "unit_name": outsourcing_order['unit_name'],
+            "operation_type": outsourcing_order['operation_type'],
+            "sent_distribution": outsourcing_order['size_distribution'],
+            "rate_per_pcs": outsourcing_order['rate_per_pcs'],
+            **amounts
+        })
+        
+        doc = receipt_obj.model_dump()
+        doc['receipt_date'] = doc['receipt_date'].isoformat()
+        doc['created_at'] = doc['created_at'].isoformat()
+        
+        # Update outsourcing order status
+        new_status = 'Received' if doc['total_shortage'] == 0 else 'Partial'
+        transition.insert("outsourcing_receipts", doc)
+        transition.rollup("outsourcing_receipt", doc, outsourcing_order)
+        transition.update("outsourcing_orders", {"id": outsourcing_order['id']},
+                          {"$set": {"status": new_status}, "$push": {"receipt_ids": doc['id']}})
+        transition.cutting_order_writes(receipt_stage_writes(outsourcing_order, new_status))
+        transition.events.append(("receipt", "outsourcing_received",
+                                  {"cutting_lot_number": doc.get('cutting_lot_number'), "dc_number": doc.get('dc_number'),
+                                   "operation_type": doc.get('operation_type'), "status": new_status,
+                                   "received": doc['total_received'], "shortage": doc['total_shortage']},
+                                  {"lot": doc.get('cutting_lot_number'), "unit": doc.get('unit_name')}))
+        created.append(receipt_obj)
+    
+    await run_transition(transition)
+    return created
+
 @api_router.post("/outsourcing-receipts", response_model=OutsourcingReceipt)
 async def create_outsourcing_receipt(receipt: OutsourcingReceiptCreate):
-    receipt_dict = receipt.model_dump()
-    
-    # Get the outsourcing order
-    outsourcing_order = await db.outsourcing_orders.find_one({"id": receipt_dict['outsourcing_order_id']}, {"_id": 0})
-    if not outsourcing_order:
-        raise HTTPException(status_code=404, detail="Outsourcing order not found")
-    
-    # Convert datetime fields if they're strings
-    if isinstance(outsourcing_order['dc_date'], str):
-        outsourcing_order['dc_date'] = datetime.fromisoformat(outsourcing_order['dc_date'])
-    
-    receipt_dict['dc_number'] = outsourcing_order['dc_number']
-    receipt_dict['unit_name'] = outsourcing_order['unit_name']
-    receipt_dict['operation_type'] = outsourcing_order['operation_type']
-    receipt_dict['sent_distribution'] = outsourcing_order['size_distribution']
-    receipt_dict['rate_per_pcs'] = outsourcing_order['rate_per_pcs']
-    
-    # Calculate shortage
-    shortage_distribution = {}
-    for size, sent_qty in outsourcing_order['size_distribution'].items():
-        received_qty = receipt_dict['received_distribution'].get(size, 0)
-        shortage = sent_qty - received_qty
-        if shortage > 0:
-            shortage_distribution[size] = shortage
-    
-    receipt_dict['shortage_distribution'] = shortage_distribution
-    
-    # Handle mistakes (if provided)
-    mistake_distribution = receipt_dict.get('mistake_distribution', {})
-    total_mistakes = sum(mistake_distribution.values()) if mistake_distribution else 0
-    receipt_dict['mistake_distribution'] = mistake_distribution
-    receipt_dict['total_mistakes'] = total_mistakes
-    
-    # Calculate totals
-    total_sent = sum(outsourcing_order['size_distribution'].values())
-    total_received = sum(receipt_dict['received_distribution'].values())
-    total_shortage = sum(shortage_distribution.values())
-    
-    receipt_dict['total_sent'] = total_sent
-    receipt_dict['total_received'] = total_received
-    receipt_dict['total_shortage'] = total_shortage
-    
-    # Calculate shortage debit amount
-    shortage_debit_amount = total_shortage * receipt_dict['rate_per_pcs']
-    receipt_dict['shortage_debit_amount'] = round(shortage_debit_amount, 2)
-    
-    # Calculate mistake debit amount
-    mistake_debit_amount = total_mistakes * receipt_dict['rate_per_pcs']
-    receipt_dict['mistake_debit_amount'] = round(mistake_debit_amount, 2)
-    
-    receipt_obj = OutsourcingReceipt(**receipt_dict)
-    
-    doc = receipt_obj.model_dump()
-    doc['receipt_date'] = doc['receipt_date'].isoformat()
-    doc['created_at'] = doc['created_at'].isoformat()
-    
-    await db.outsourcing_receipts.insert_one(doc)
-    
-    # Update outsourcing order status
-    new_status = 'Received' if total_shortage == 0 else 'Partial'
-    await db.outsourcing_orders.update_one(
-        {"id": receipt_dict['outsourcing_order_id']},
-        {"$set": {"status": new_status}}
-    )
-    
-    return receipt_obj
+    return (await record_outsourcing_receipts([receipt], "create_outsourcing_receipt"))[0]
+
+@api_router.post("/outsourcing-receipts/bulk", response_model=List[OutsourcingReceipt])
+async def create_outsourcing_receipts_bulk(bulk: OutsourcingReceiptBulkCreate):
+    """Record a unit's whole return (dozens of DCs) at once; either every receipt is recorded or none"""
+    if not bulk.receipts:
+        raise HTTPException(status_code=400, detail="No receipts to record")
+    if len(bulk.receipts) > MAX_BULK_RECEIPTS:
+        raise HTTPException(status_code=400, detail=f"A bulk receipt can hold at most {MAX_BULK_RECEIPTS} receipts")
+    return await record_outsourcing_receipts(bulk.receipts, "bulk_outsourcing_receipts")
 
 @api_router.get("/outsourcing-receipts", response_model=List[OutsourcingReceipt])
 async def get_outsourcing_receipts():
@@ -2293,45 +3964,31 @@ async def update_outsourcing_receipt(receipt_id: str, receipt_update: Outsourcin
     if not outsourcing_order:
         raise HTTPException(status_code=404, detail="Outsourcing order not found")
     
-    # Calculate new shortage
-    shortage_distribution = {}
-    for size, sent_qty in outsourcing_order['size_distribution'].items():
-        received_qty = receipt_update.received_distribution.get(size, 0)
-        shortage = sent_qty - received_qty
-        if shortage > 0:
-            shortage_distribution[size] = shortage
-    
-    # Handle mistakes
+    # Recalculate shortage and debits at the rate the receipt was recorded with
     mistake_distribution = receipt_update.mistake_distribution or {}
-    total_mistakes = sum(mistake_distribution.values()) if mistake_distribution else 0
-    
-    # Calculate totals
-    total_sent = sum(outsourcing_order['size_distribution'].values())
-    total_received = sum(receipt_update.received_distribution.values())
-    total_shortage = sum(shortage_distribution.values())
-    
-    # Calculate debit amounts
-    rate_per_pcs = existing_receipt.get('rate_per_pcs', 0)
-    shortage_debit_amount = round(total_shortage * rate_per_pcs, 2)
-    mistake_debit_amount = round(total_mistakes * rate_per_pcs, 2)
+    totals = receipt_totals(outsourcing_order['size_distribution'], receipt_update.received_distribution,
+                            mistake_distribution, existing_receipt.get('rate_per_pcs', 0))
+    total_received = totals['total_received']
+    total_shortage = totals['total_shortage']
     
     # Update the receipt
     update_data = {
         "receipt_date": receipt_update.receipt_date.isoformat(),
         "received_distribution": receipt_update.received_distribution,
         "mistake_distribution": mistake_distribution,
-        "shortage_distribution": shortage_distribution,
+        "shortage_distribution": totals['shortage_distribution'],
         "total_received": total_received,
         "total_shortage": total_shortage,
-        "total_mistakes": total_mistakes,
-        "shortage_debit_amount": shortage_debit_amount,
-        "mistake_debit_amount": mistake_debit_amount
+        "total_mistakes": totals['total_mistakes'],
+        "shortage_debit_amount": totals['shortage_debit_amount'],
+        "mistake_debit_amount": totals['mistake_debit_amount']
     }
     
     await db.outsourcing_receipts.update_one(
         {"id": receipt_id},
         {"$set": update_data}
     )
+    await apply_rollup("outsourcing_receipt", existing_receipt, {**existing_receipt, **update_data}, outsourcing_order)
     
     # Update outsourcing order status
     new_status = 'Received' if total_shortage == 0 else 'Partial'
@@ -2339,17 +3996,19 @@ async def update_outsourcing_receipt(receipt_id: str, receipt_update: Outsourcin
         {"id": existing_receipt['outsourcing_order_id']},
         {"$set": {"status": new_status}}
     )
+    await write_lot_stage(receipt_stage_writes(outsourcing_order, new_status))
+    await emit_event("receipt", "outsourcing_receipt_updated",
+                     {"receipt_id": receipt_id, "cutting_lot_number": existing_receipt.get('cutting_lot_number'),
+                      "status": new_status, "received": total_received, "shortage": total_shortage},
+                     lot=existing_receipt.get('cutting_lot_number'), unit=existing_receipt.get('unit_name'))
     
     return {"message": "Receipt updated successfully", "total_received": total_received, "total_shortage": total_shortage}
 
 
 # Delivery Challan Print
-@api_router.get("/outsourcing-orders/{order_id}/dc", response_class=HTMLResponse)
-async def get_delivery_challan(order_id: str):
-    order = await db.outsourcing_orders.find_one({"id": order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Outsourcing order not found")
-    
+def render_outsourcing_dc(order: dict) -> str:
+    """Delivery challan HTML for an outsourcing order, as issued (see DC SNAPSHOTS)"""
+    order = dict(order)
     if isinstance(order['dc_date'], str):
         order['dc_date'] = datetime.fromisoformat(order['dc_date'])
     
@@ -2633,7 +4292,7 @@ async def get_delivery_challan(order_id: str):
     </html>
     """
     
-    return HTMLResponse(content=html_content)
+    return html_content
 
 
 # WhatsApp Message Simulation
@@ -2676,21 +4335,7 @@ async def get_lot_barcode(lot_id: str):
         raise HTTPException(status_code=404, detail="Fabric lot not found")
     
     # Generate barcode using Code128
-    code128 = barcode.get_barcode_class('code128')
-    barcode_instance = code128(lot['lot_number'], writer=ImageWriter())
-    
-    # Generate barcode image in memory
-    buffer = io.BytesIO()
-    barcode_instance.write(buffer, options={
-        'module_width': 0.3,
-        'module_height': 10,
-        'font_size': 10,
-        'text_distance': 5,
-        'quiet_zone': 3
-    })
-    buffer.seek(0)
-    
-    return StreamingResponse(buffer, media_type="image/png")
+    return Response(content=code128_png(lot['lot_number']), media_type="image/png")
 
 
 # Payment Routes for Cutting Orders
@@ -2722,6 +4367,9 @@ async def add_cutting_payment(order_id: str, payment: PaymentRecord):
             "payment_status": payment_status
         }}
     )
+    await emit_event("payment", "cutting_payment",
+                     {"order_id": order_id, "amount": payment.amount, "balance": round(new_balance, 2), "payment_status": payment_status},
+                     lot=order.get('cutting_lot_number'), unit=order.get('unit_name'))
     
     return {"message": "Payment recorded successfully", "balance": round(new_balance, 2)}
 
@@ -2747,21 +4395,18 @@ async def create_ironing_order(order: IroningOrderCreate, current_user: dict = D
     outsourcing_order = await db.outsourcing_orders.find_one({"id": receipt['outsourcing_order_id']}, {"_id": 0})
     
     lot_num = outsourcing_order.get('cutting_lot_number', '')
+    lot_nums = order_lot_numbers(outsourcing_order)
     
     # BUSINESS RULE: Check if stitching outsourcing is completed before allowing ironing
-    stitching_order = await db.outsourcing_orders.find_one({
-        "cutting_lot_number": lot_num,
-        "operation_type": "Stitching",
-        "status": "Received"
-    }, {"_id": 0})
-    
-    if not stitching_order:
+    if await unstitched_lots(lot_nums):
         raise HTTPException(
             status_code=400, 
             detail="Ironing requires completed stitching. Please complete stitching outsourcing first and receive the goods back."
         )
     
     order_dict['cutting_lot_number'] = lot_num
+    order_dict['outsourcing_order_id'] = outsourcing_order['id']
+    order_dict['cutting_order_ids'] = order_cutting_ids(outsourcing_order)
     order_dict['color'] = outsourcing_order.get('color', '')
     order_dict['category'] = outsourcing_order.get('category', '')
     order_dict['style_type'] = outsourcing_order.get('style_type', '')
@@ -2804,19 +4449,20 @@ async def create_ironing_order(order: IroningOrderCreate, current_user: dict = D
     doc['dc_date'] = doc['dc_date'].isoformat()
     doc['created_at'] = doc['created_at'].isoformat()
     
-    await db.ironing_orders.insert_one(doc)
-    
-    # Mark receipt as sent to ironing
-    await db.outsourcing_receipts.update_one(
-        {"id": order_dict['receipt_id']},
-        {"$set": {"sent_to_ironing": True}}
-    )
-    
-    # Mark the cutting order as sent to ironing
-    await db.cutting_orders.update_one(
-        {"cutting_lot_number": order_dict['cutting_lot_number']},
-        {"$set": {"sent_to_ironing": True}}
-    )
+    # DC, its issued snapshot, the receipt flag and the lots' stage land together
+    cutting_ids = doc['cutting_order_ids'] or await db.cutting_orders.distinct("id", {"cutting_lot_number": {"$in": lot_nums}})
+    transition = Transition("create_ironing_order")
+    transition.insert("ironing_orders", doc)
+    transition.rollup("ironing", doc)
+    transition.insert("dc_snapshots", dc_snapshot("ironing", doc, issued_by=order_dict['created_by']))
+    transition.update("outsourcing_receipts", {"id": order_dict['receipt_id']}, {"$set": {"sent_to_ironing": True}})
+    transition.cutting_order_writes(lot_stage_writes(cutting_ids, "ironing", doc['unit_name'], {
+        "$set": {"sent_to_ironing": True, "ironing_order_id": doc['id']}
+    }))
+    transition.events.append(("lot", "sent_to_ironing",
+                              {"cutting_lot_number": doc['cutting_lot_number'], "dc_number": doc['dc_number'], "unit_name": doc['unit_name']},
+                              {"lot": doc['cutting_lot_number'], "unit": doc['unit_name']}))
+    await run_transition(transition)
     
     return order_obj
 
@@ -2867,6 +4513,8 @@ async def update_ironing_order(order_id: str, update_data: dict, current_user: d
     update_dict['updated_by'] = current_user.get('username', 'system')
     
     await db.ironing_orders.update_one({"id": order_id}, {"$set": update_dict})
+    await apply_rollup("ironing", order, {**order, **update_dict})
+    await reindex_for_search("ironing_orders", order_id)
     
     updated_order = await db.ironing_orders.find_one({"id": order_id}, {"_id": 0})
     return updated_order
@@ -2879,11 +4527,20 @@ async def delete_ironing_order(order_id: str):
     
     # Unmark receipt
     await db.outsourcing_receipts.update_one(
-        {"id": order['receipt_id']},
+        {"id": order.get('receipt_id')},
         {"$set": {"sent_to_ironing": False}}
     )
+    cutting_ids = await db.cutting_orders.distinct("id", {"ironing_order_id": order_id})
+    await db.cutting_orders.update_many(
+        {"ironing_order_id": order_id}, {"$set": {"ironing_order_id": None, "sent_to_ironing": False}}
+    )
     
     result = await db.ironing_orders.delete_one({"id": order_id})
+    if result.deleted_count:
+        await apply_rollup("ironing", old=order)
+    await refresh_lot_stages(cutting_ids)
+    await db.dc_snapshots.delete_many({"kind": "ironing", "order_id": order_id})
+    await unindex_for_search("ironing_orders", [order_id])
     return {"message": "Ironing order deleted successfully"}
 
 # Ironing Receipt Routes
@@ -2904,38 +4561,12 @@ async def create_ironing_receipt(receipt: IroningReceiptCreate):
     receipt_dict['sent_distribution'] = ironing_order['size_distribution']
     receipt_dict['rate_per_pcs'] = ironing_order['rate_per_pcs']
     
-    # Calculate shortage
-    shortage_distribution = {}
-    for size, sent_qty in ironing_order['size_distribution'].items():
-        received_qty = receipt_dict['received_distribution'].get(size, 0)
-        shortage = sent_qty - received_qty
-        if shortage > 0:
-            shortage_distribution[size] = shortage
-    
-    receipt_dict['shortage_distribution'] = shortage_distribution
-    
-    # Handle mistakes (if provided)
-    mistake_distribution = receipt_dict.get('mistake_distribution', {})
-    total_mistakes = sum(mistake_distribution.values()) if mistake_distribution else 0
-    receipt_dict['mistake_distribution'] = mistake_distribution
-    receipt_dict['total_mistakes'] = total_mistakes
-    
-    # Calculate totals
-    total_sent = sum(ironing_order['size_distribution'].values())
-    total_received = sum(receipt_dict['received_distribution'].values())
-    total_shortage = sum(shortage_distribution.values())
-    
-    receipt_dict['total_sent'] = total_sent
-    receipt_dict['total_received'] = total_received
-    receipt_dict['total_shortage'] = total_shortage
-    
-    # Calculate shortage debit amount
-    shortage_debit_amount = total_shortage * receipt_dict['rate_per_pcs']
-    receipt_dict['shortage_debit_amount'] = round(shortage_debit_amount, 2)
-    
-    # Calculate mistake debit amount
-    mistake_debit_amount = total_mistakes * receipt_dict['rate_per_pcs']
-    receipt_dict['mistake_debit_amount'] = round(mistake_debit_amount, 2)
+    # Calculate shortage, totals and debits
+    receipt_dict['mistake_distribution'] = receipt_dict.get('mistake_distribution') or {}
+    receipt_dict.update(receipt_totals(ironing_order['size_distribution'], receipt_dict['received_distribution'],
+                                       receipt_dict['mistake_distribution'], receipt_dict['rate_per_pcs']))
+    total_received = receipt_dict['total_received']
+    total_shortage = receipt_dict['total_shortage']
     
     # Calculate master packs from ironing order's ratio
     master_pack_ratio = ironing_order.get('master_pack_ratio', {})
@@ -2960,24 +4591,10 @@ async def create_ironing_receipt(receipt: IroningReceiptCreate):
     doc['receipt_date'] = doc['receipt_date'].isoformat()
     doc['created_at'] = doc['created_at'].isoformat()
     
-    await db.ironing_receipts.insert_one(doc)
-    
-    # Update ironing order status
-    new_status = 'Received'
-    await db.ironing_orders.update_one(
-        {"id": receipt_dict['ironing_order_id']},
-        {"$set": {"status": new_status}}
-    )
-    
     # AUTO-CREATE STOCK ENTRY after ironing receipt
     # Get cutting order details for stock entry
     cutting_lot_number = ironing_order.get('cutting_lot_number', '')
-    cutting_order = await db.cutting_orders.find_one({
-        "$or": [
-            {"cutting_lot_number": cutting_lot_number},
-            {"lot_number": cutting_lot_number}
-        ]
-    }, {"_id": 0})
+    cutting_order = await find_ironing_cutting_order(ironing_order)
     
     # Generate stock code
     stock_count = await db.stock.count_documents({})
@@ -2994,6 +4611,8 @@ async def create_ironing_receipt(receipt: IroningReceiptCreate):
         "lot_number": stock_lot_name,  # Use custom lot name if provided
         "source": "ironing",
         "source_ironing_receipt_id": receipt_obj.id,  # Use receipt_obj.id instead of receipt_dict['id']
+        "ironing_order_id": ironing_order['id'],
+        "cutting_order_ids": order_cutting_ids(ironing_order) or ([cutting_order['id']] if cutting_order else []),
         "category": ironing_order.get('category', '') or (cutting_order.get('category', 'Mens') if cutting_order else 'Mens'),
         "style_type": ironing_order.get('style_type', '') or (cutting_order.get('style_type', '') if cutting_order else ''),
         "color": stock_color,  # Use custom color if provided
@@ -3003,17 +4622,27 @@ async def create_ironing_receipt(receipt: IroningReceiptCreate):
         "master_pack_ratio": master_pack_ratio,
         "complete_packs": receipt_dict.get('complete_packs', 0),
         "loose_pieces": receipt_dict.get('loose_pieces', 0),
+        "loose_distribution": receipt_dict.get('loose_pieces_distribution', {}),
         "notes": f"Auto-created from ironing receipt - DC: {ironing_order['dc_number']}",
         "is_active": True,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.stock.insert_one(stock_entry)
-    
-    # Add stock_id to the receipt response
-    receipt_obj_dict = receipt_obj.model_dump()
-    receipt_obj_dict['stock_id'] = stock_entry['id']
-    receipt_obj_dict['stock_code'] = stock_code
+    # Receipt, DC status, stock entry and lineage land together
+    doc['stock_id'] = receipt_obj.stock_id = stock_entry['id']
+    transition = Transition("create_ironing_receipt")
+    stock_lineage_writes(transition, ironing_order, stock_entry)
+    transition.insert("ironing_receipts", doc)
+    transition.rollup("ironing_receipt", doc, ironing_order)
+    transition.insert("stock", with_search_keys("stock", stock_entry))
+    transition.events.append(("receipt", "ironing_received",
+                              {"cutting_lot_number": cutting_lot_number, "dc_number": ironing_order['dc_number'],
+                               "received": total_received, "shortage": total_shortage},
+                              {"lot": cutting_lot_number, "unit": ironing_order.get('unit_name')}))
+    transition.events.append(("stock", "stock_created",
+                              {"stock_code": stock_code, "lot_number": stock_lot_name, "available_quantity": total_received},
+                              {"lot": cutting_lot_number, "stock_code": stock_code}))
+    await run_transition(transition)
     
     return receipt_obj
 
@@ -3045,27 +4674,12 @@ async def update_ironing_receipt(receipt_id: str, receipt_update: IroningReceipt
     if not ironing_order:
         raise HTTPException(status_code=404, detail="Ironing order not found")
     
-    # Calculate new shortage
-    shortage_distribution = {}
-    for size, sent_qty in ironing_order['size_distribution'].items():
-        received_qty = receipt_update.received_distribution.get(size, 0)
-        shortage = sent_qty - received_qty
-        if shortage > 0:
-            shortage_distribution[size] = shortage
-    
-    # Handle mistakes
+    # Recalculate shortage and debits at the rate the receipt was recorded with
     mistake_distribution = receipt_update.mistake_distribution or {}
-    total_mistakes = sum(mistake_distribution.values()) if mistake_distribution else 0
-    
-    # Calculate totals
-    total_sent = sum(ironing_order['size_distribution'].values())
-    total_received = sum(receipt_update.received_distribution.values())
-    total_shortage = sum(shortage_distribution.values())
-    
-    # Calculate debit amounts
-    rate_per_pcs = existing_receipt.get('rate_per_pcs', 0)
-    shortage_debit_amount = round(total_shortage * rate_per_pcs, 2)
-    mistake_debit_amount = round(total_mistakes * rate_per_pcs, 2)
+    totals = receipt_totals(ironing_order['size_distribution'], receipt_update.received_distribution,
+                            mistake_distribution, existing_receipt.get('rate_per_pcs', 0))
+    total_received = totals['total_received']
+    total_shortage = totals['total_shortage']
     
     # Calculate master packs if ratio exists
     master_pack_ratio = ironing_order.get('master_pack_ratio', {})
@@ -3084,12 +4698,12 @@ async def update_ironing_receipt(receipt_id: str, receipt_update: IroningReceipt
         "receipt_date": receipt_update.receipt_date.isoformat(),
         "received_distribution": receipt_update.received_distribution,
         "mistake_distribution": mistake_distribution,
-        "shortage_distribution": shortage_distribution,
+        "shortage_distribution": totals['shortage_distribution'],
         "total_received": total_received,
         "total_shortage": total_shortage,
-        "total_mistakes": total_mistakes,
-        "shortage_debit_amount": shortage_debit_amount,
-        "mistake_debit_amount": mistake_debit_amount,
+        "total_mistakes": totals['total_mistakes'],
+        "shortage_debit_amount": totals['shortage_debit_amount'],
+        "mistake_debit_amount": totals['mistake_debit_amount'],
         "complete_packs": complete_packs,
         "loose_pieces": loose_pieces,
         "loose_pieces_distribution": loose_pieces_dist
@@ -3099,6 +4713,11 @@ async def update_ironing_receipt(receipt_id: str, receipt_update: IroningReceipt
         {"id": receipt_id},
         {"$set": update_data}
     )
+    await apply_rollup("ironing_receipt", existing_receipt, {**existing_receipt, **update_data}, ironing_order)
+    await emit_event("receipt", "ironing_receipt_updated",
+                     {"receipt_id": receipt_id, "cutting_lot_number": existing_receipt.get('cutting_lot_number'),
+                      "received": total_received, "shortage": total_shortage},
+                     lot=existing_receipt.get('cutting_lot_number'), unit=existing_receipt.get('unit_name'))
     
     return {"message": "Receipt updated successfully", "total_received": total_received, "total_shortage": total_shortage}
 
@@ -3132,16 +4751,18 @@ async def add_ironing_payment(order_id: str, payment: PaymentRecord):
             "payment_status": payment_status
         }}
     )
+    await emit_event("payment", "ironing_payment",
+                     {"order_id": order_id, "amount": payment.amount, "balance": round(new_balance, 2), "payment_status": payment_status},
+                     lot=order.get('cutting_lot_number'), unit=order.get('unit_name'))
     
     return {"message": "Payment recorded successfully", "balance": round(new_balance, 2)}
 
 # Ironing DC Generation
-@api_router.get("/ironing-orders/{order_id}/dc", response_class=HTMLResponse)
-async def get_ironing_dc(order_id: str):
-    order = await db.ironing_orders.find_one({"id": order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Ironing order not found")
-    
+def render_ironing_dc(order: dict) -> str:
+    """Delivery challan HTML for an ironing order, as issued (see DC SNAPSHOTS)"""
+    # Scan-created ironing DCs carry sent_date and no category or style
+    order = {"category": "", "style_type": "", **order}
+    order['dc_date'] = order.get('dc_date') or order.get('sent_date') or order['created_at']
     if isinstance(order['dc_date'], str):
         order['dc_date'] = datetime.fromisoformat(order['dc_date'])
     
@@ -3305,7 +4926,185 @@ async def get_ironing_dc(order_id: str):
     </html>
     """
     
-    return HTMLResponse(content=html_content)
+    return html_content
+
+# ==================== DC SNAPSHOTS ====================
+# A delivery challan is a legal document: it is rendered once, when the DC is issued, and
+# stored zlib-compressed under its DC number and a version. Reprints serve the stored bytes
+# with a strong ETag, so an unchanged DC revalidates as a 304. Editing the order afterwards
+# does not change what was issued; an explicit re-issue writes the next version. With
+# DC_PDF=1 (and WeasyPrint installed) a PDF is rendered in a worker process after issue.
+
+DC_RENDERERS = {"outsourcing": render_outsourcing_dc, "ironing": render_ironing_dc}
+DC_ORDER_COLLECTIONS = {"outsourcing": "outsourcing_orders", "ironing": "ironing_orders"}
+DC_ORDER_NOT_FOUND = {"outsourcing": "Outsourcing order not found", "ironing": "Ironing order not found"}
+DC_PDF_ENABLED = os.environ.get('DC_PDF', '0') == '1'
+DC_PDF_WORKERS = int(os.environ.get('DC_PDF_WORKERS', '1'))
+
+def content_etag(content: bytes) -> str:
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def dc_snapshot(kind: str, order: dict, version: int = 1, reason: str = "issued", issued_by: str = None) -> dict:
+    """The issued DC: rendered HTML, compressed, with its ETag"""
+    html = DC_RENDERERS[kind](order).encode("utf-8")
+    return {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "dc_number": order['dc_number'],
+        "order_id": order['id'],
+        "version": version,
+        "reason": reason,
+        "html": zlib.compress(html, 6),
+        "html_size": len(html),
+        "etag": content_etag(html),
+        "pdf": None,
+        "pdf_etag": None,
+        "issued_by": issued_by,
+        "issued_at": datetime.now(timezone.utc).isoformat()
+    }
+
+_dc_pdf_pool = None
+_dc_pdf_tasks = set()
+
+async def attach_dc_pdf(snapshot_id: str, html: bytes):
+    global _dc_pdf_pool
+    if _dc_pdf_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _dc_pdf_pool = ProcessPoolExecutor(max_workers=DC_PDF_WORKERS)
+    try:
+        pdf = await asyncio.get_running_loop().run_in_executor(_dc_pdf_pool, html_to_pdf, html.decode("utf-8"))
+    except Exception as e:
+        logging.error(f"DC PDF rendering failed for snapshot {snapshot_id}: {e}")
+        return
+    if pdf:
+        await db.dc_snapshots.update_one(
+            {"id": snapshot_id}, {"$set": {"pdf": zlib.compress(pdf, 6), "pdf_etag": content_etag(pdf)}}
+        )
+
+def schedule_dc_pdfs(snapshots: List[dict]):
+    """PDFs for newly issued snapshots, off the request path"""
+    if not DC_PDF_ENABLED:
+        return
+    for snapshot in snapshots:
+        task = asyncio.create_task(attach_dc_pdf(snapshot['id'], zlib.decompress(snapshot['html'])))
+        _dc_pdf_tasks.add(task)
+        task.add_done_callback(_dc_pdf_tasks.discard)
+
+async def latest_dc_snapshot(kind: str, order_id: str) -> dict:
+    """The current version of an order's DC; DCs issued before snapshots existed get one on first print"""
+    snapshot = await db.dc_snapshots.find_one(
+        {"order_id": order_id, "kind": kind}, {"_id": 0, "pdf": 0}, sort=[("version", DESCENDING)]
+    )
+    record_cache_lookup("dc_snapshot", snapshot is not None)
+    if snapshot:
+        return snapshot
+    order = await db[DC_ORDER_COLLECTIONS[kind]].find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail=DC_ORDER_NOT_FOUND[kind])
+    snapshot = dc_snapshot(kind, order, reason="first print")
+    try:
+        await db.dc_snapshots.insert_one({**snapshot})
+    except DuplicateKeyError:
+        # A concurrent first print stored it first
+        snapshot = await db.dc_snapshots.find_one(
+            {"order_id": order_id, "kind": kind}, {"_id": 0, "pdf": 0}, sort=[("version", DESCENDING)]
+        )
+        if not snapshot:
+            raise HTTPException(status_code=409, detail="The DC is being issued by another request; retry")
+        return snapshot
+    schedule_dc_pdfs([snapshot])
+    return snapshot
+
+def dc_snapshot_response(snapshot: dict, request: Request) -> Response:
+    headers = {"ETag": snapshot['etag'], "Cache-Control": "no-cache", "X-DC-Version": str(snapshot['version'])}
+    if etag_matches(request.headers.get("if-none-match"), snapshot['etag']):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=zlib.decompress(snapshot['html']), headers=headers)
+
+@api_router.get("/outsourcing-orders/{order_id}/dc", response_class=HTMLResponse)
+async def get_delivery_challan(order_id: str, request: Request):
+    return dc_snapshot_response(await latest_dc_snapshot("outsourcing", order_id), request)
+
+@api_router.get("/ironing-orders/{order_id}/dc", response_class=HTMLResponse)
+async def get_ironing_dc(order_id: str, request: Request):
+    return dc_snapshot_response(await latest_dc_snapshot("ironing", order_id), request)
+
+class DCReissue(BaseModel):
+    reason: str
+
+async def reissue_dc(kind: str, order_id: str, reissue: DCReissue, current_user: dict) -> dict:
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    order = await db[DC_ORDER_COLLECTIONS[kind]].find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail=DC_ORDER_NOT_FOUND[kind])
+    latest = await db.dc_snapshots.find_one(
+        {"order_id": order_id, "kind": kind}, {"_id": 0, "version": 1}, sort=[("version", DESCENDING)]
+    )
+    snapshot = dc_snapshot(kind, order, (latest['version'] + 1) if latest else 1, reissue.reason,
+                           current_user.get('username'))
+    try:
+        await db.dc_snapshots.insert_one({**snapshot})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="The DC was re-issued by someone else at the same time; reload and retry")
+    schedule_dc_pdfs([snapshot])
+    return {"dc_number": snapshot['dc_number'], "version": snapshot['version'], "etag": snapshot['etag']}
+
+@api_router.post("/outsourcing-orders/{order_id}/dc/reissue")
+async def reissue_outsourcing_dc(order_id: str, reissue: DCReissue, current_user: dict = Depends(get_current_user)):
+    """Issue a new version of the DC from the order as it stands now; earlier versions are kept"""
+    return await reissue_dc("outsourcing", order_id, reissue, current_user)
+
+@api_router.post("/ironing-orders/{order_id}/dc/reissue")
+async def reissue_ironing_dc(order_id: str, reissue: DCReissue, current_user: dict = Depends(get_current_user)):
+    """Issue a new version of the ironing DC from the order as it stands now; earlier versions are kept"""
+    return await reissue_dc("ironing", order_id, reissue, current_user)
+
+@api_router.get("/dc-snapshots/{dc_number}")
+async def get_dc_snapshot_versions(dc_number: str):
+    """Every issued version of DCs with this number, newest first (each names its kind and order_id)"""
+    versions = await db.dc_snapshots.find(
+        {"dc_number": dc_number},
+        {"_id": 0, "html": 0, "pdf": 0}
+    ).sort("version", DESCENDING).to_list(None)
+    if not versions:
+        raise HTTPException(status_code=404, detail="DC not found")
+    for version in versions:
+        version['has_pdf'] = version.pop('pdf_etag') is not None
+    return versions
+
+@api_router.get("/dc-snapshots/{kind}/{order_id}/versions/{version}", response_class=HTMLResponse)
+async def get_dc_snapshot_version(kind: str, order_id: str, version: int, request: Request):
+    """A specific issued version, e.g. to reprint what the unit was originally given"""
+    snapshot = await db.dc_snapshots.find_one({"kind": kind, "order_id": order_id, "version": version},
+                                              {"_id": 0, "pdf": 0})
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="DC version not found")
+    return dc_snapshot_response(snapshot, request)
+
+@api_router.get("/dc-snapshots/{kind}/{order_id}/pdf")
+async def get_dc_snapshot_pdf(kind: str, order_id: str, request: Request):
+    """PDF of the latest version of an order's DC, when one has been rendered"""
+    snapshot = await db.dc_snapshots.find_one(
+        {"kind": kind, "order_id": order_id}, {"_id": 0, "dc_number": 1, "pdf": 1, "pdf_etag": 1, "version": 1},
+        sort=[("version", DESCENDING)]
+    )
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="DC not found")
+    if not snapshot.get('pdf'):
+        raise HTTPException(status_code=404, detail="PDF not available for this DC")
+    headers = {"ETag": snapshot['pdf_etag'], "Cache-Control": "no-cache", "X-DC-Version": str(snapshot['version'])}
+    if etag_matches(request.headers.get("if-none-match"), snapshot['pdf_etag']):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'inline; filename="{snapshot["dc_number"]}-v{snapshot["version"]}.pdf"'
+    return Response(content=zlib.decompress(snapshot['pdf']), media_type="application/pdf", headers=headers)
+
 
 # Payment Routes for Outsourcing Orders
 @api_router.post("/outsourcing-orders/{order_id}/payment")
@@ -3336,6 +5135,9 @@ async def add_outsourcing_payment(order_id: str, payment: PaymentRecord):
             "payment_status": payment_status
         }}
     )
+    await emit_event("payment", "outsourcing_payment",
+                     {"order_id": order_id, "amount": payment.amount, "balance": round(new_balance, 2), "payment_status": payment_status},
+                     lot=order.get('cutting_lot_number'), unit=order.get('unit_name'))
     
     return {"message": "Payment recorded successfully", "balance": round(new_balance, 2)}
 
@@ -3964,7 +5766,7 @@ async def get_lot_wise_report(order_id: str):
     
     # Get all outsourcing orders for this cutting lot
     outsourcing_orders = await db.outsourcing_orders.find(
-        {"cutting_lot_number": cutting_order['cutting_lot_number']}, 
+        lot_numbers_query(cutting_order['cutting_lot_number']),
         {"_id": 0}
     ).to_list(1000)
     
@@ -4430,36 +6232,168 @@ async def upload_catalog_image(file: UploadFile = File(...)):
     return {"image_url": image_url, "filename": unique_filename}
 
 
+# ==================== SEARCH ====================
+TYPEAHEAD_LIMIT = 10
+GLOBAL_SEARCH_LIMIT = 20
+
+async def index_for_search(collection: str, docs: List[dict]):
+    """Upsert global search entries; the index is derived data, so a failure is logged rather than failing the write"""
+    indexed_at = datetime.now(timezone.utc).isoformat()
+    writes = [
+        ReplaceOne(
+            {"collection": collection, "entity_id": doc['id']},
+            {**search_index_entry(collection, doc), "indexed_at": indexed_at},
+            upsert=True
+        )
+        for doc in docs
+    ]
+    if not writes:
+        return
+    try:
+        await db.search_index.bulk_write(writes, ordered=False)
+    except PyMongoError as e:
+        logging.warning(f"Search index update for {collection} failed: {e}")
+
+async def reindex_for_search(collection: str, entity_id: str):
+    doc = await db[collection].find_one({"id": entity_id}, {"_id": 0})
+    if doc:
+        await index_for_search(collection, [doc])
+
+async def unindex_for_search(collection: str, entity_ids: List[str]):
+    try:
+        await db.search_index.delete_many({"collection": collection, "entity_id": {"$in": entity_ids}})
+    except PyMongoError as e:
+        logging.warning(f"Search index removal for {collection} failed: {e}")
+
+@api_router.get("/search")
+async def global_search(q: str, types: Optional[str] = None, limit: int = GLOBAL_SEARCH_LIMIT):
+    """Find lots, DCs, stock codes, dispatches/boras and catalogs from one search box"""
+    search_query = search_filter(q)
+    if not search_query:
+        return {"query": q, "hits": []}
+    query = {"keys": search_query["search_keys"]}
+    if types:
+        wanted = [t.strip() for t in types.split(",") if t.strip()]
+        unknown = [t for t in wanted if t not in SEARCH_INDEX_TYPES]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown search types {unknown}. Valid: {sorted(SEARCH_INDEX_TYPES)}")
+        query["type"] = {"$in": wanted}
+    limit = max(1, min(limit, 100))
+    candidates = await db.search_index.find(
+        query, {"_id": 0, "keys": 0}
+    ).sort("created_at", -1).limit(SEARCH_CANDIDATE_LIMIT).to_list(SEARCH_CANDIDATE_LIMIT)
+    hits = [
+        {"type": hit['type'], "id": hit['entity_id'], "code": hit.get('code'), "detail": hit.get('detail'),
+         "created_at": hit.get('created_at')}
+        for hit in rank_search_hits(candidates, q)[:limit]
+    ]
+    return {"query": q, "hits": hits}
+
+@api_router.get("/search/typeahead")
+async def search_typeahead(q: str, limit: int = TYPEAHEAD_LIMIT):
+    """Lightweight suggestions for the search boxes: lot numbers and stock codes matching a prefix"""
+    search_query = search_filter(q)
+    if not search_query:
+        return []
+    limit = max(1, min(limit, 25))
+    lots, stocks = await asyncio.gather(
+        db.cutting_orders.find(
+            search_query,
+            {"_id": 0, "id": 1, "cutting_lot_number": 1, "lot_number": 1, "cutting_master_name": 1, "style_type": 1, "color": 1}
+        ).sort("created_at", -1).limit(limit).to_list(limit),
+        db.stock.find(
+            {**search_query, "is_active": True},
+            {"_id": 0, "id": 1, "stock_code": 1, "lot_number": 1, "category": 1, "style_type": 1, "color": 1}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+    )
+    terms = query_terms(q)
+    ranked = [
+        (rank("cutting_orders", lot, terms), {
+            "type": "cutting_order", "id": lot['id'], "value": lot.get('cutting_lot_number'),
+            "label": " · ".join(filter(None, [lot.get('cutting_lot_number'), lot.get('style_type'), lot.get('color')]))
+        })
+        for lot in lots
+    ] + [
+        (rank("stock", stock, terms), {
+            "type": "stock", "id": stock['id'], "value": stock.get('stock_code'),
+            "label": " · ".join(filter(None, [stock.get('stock_code'), stock.get('lot_number'), stock.get('color')]))
+        })
+        for stock in stocks
+    ]
+    ranked.sort(key=lambda item: -item[0])
+    return [suggestion for _, suggestion in ranked[:limit]]
+
+
+async def backfill_search_keys() -> dict:
+    """Recompute search_keys for every searchable document"""
+    updated = {}
+    for collection, fields in SEARCH_FIELDS.items():
+        count = 0
+        batch = []
+        async for doc in db[collection].find({}, {"_id": 1, **{field: 1 for field in fields}}):
+            keys = with_search_keys(collection, doc)['search_keys']
+            batch.append(UpdateOne({"_id": doc['_id']}, {"$set": {"search_keys": keys}}))
+            if len(batch) >= MIGRATION_BATCH_SIZE:
+                await db[collection].bulk_write(batch, ordered=False)
+                count += len(batch)
+                batch = []
+        if batch:
+            await db[collection].bulk_write(batch, ordered=False)
+            count += len(batch)
+        updated[collection] = count
+    return updated
+
+async def ensure_search_keys():
+    """List search matches only on search_keys, so documents written before it are backfilled at startup
+    until a run of the migration is on record"""
+    if await db.system_meta.find_one({"type": "migration:search-keys"}, {"_id": 1}):
+        return
+    started = time.perf_counter()
+    result = await backfill_search_keys()
+    await record_migration_run("search-keys", result, started, "startup")
+    logger.info(f"Backfilled search_keys at startup: {result}")
+
+
+async def rebuild_search_index() -> dict:
+    """Re-derive the global search index from every source collection"""
+    indexed = {}
+    started = datetime.now(timezone.utc).isoformat()
+    for collection in SEARCH_INDEX_SOURCES:
+        count = 0
+        batch = []
+        query = {"is_active": True} if collection == "stock" else {}
+        async for doc in db[collection].find(query, {"_id": 0}):
+            batch.append(doc)
+            if len(batch) >= MIGRATION_BATCH_SIZE:
+                await index_for_search(collection, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            await index_for_search(collection, batch)
+            count += len(batch)
+        # Entries not refreshed by this run have no source document any more
+        await db.search_index.delete_many({"collection": collection, "indexed_at": {"$lt": started}})
+        indexed[collection] = count
+    return indexed
+
+
 # Stock Routes
 @api_router.get("/stock", response_model=List[Stock])
 async def get_all_stock(limit: int = 100, skip: int = 0, search: str = None):
     """Get all stock entries with calculated master packs"""
     query = {"is_active": True}
     
-    # Add search filter if provided
     if search:
-        query["$or"] = [
-            {"stock_code": {"$regex": search, "$options": "i"}},
-            {"lot_number": {"$regex": search, "$options": "i"}},
-            {"category": {"$regex": search, "$options": "i"}},
-            {"style_type": {"$regex": search, "$options": "i"}},
-            {"color": {"$regex": search, "$options": "i"}}
-        ]
-    
-    stocks = await db.stock.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    # Calculate master packs for each stock
-    for stock in stocks:
-        if stock.get('master_pack_ratio') and stock.get('size_distribution'):
-            packs, loose, loose_dist = calculate_master_packs(
-                stock['size_distribution'], 
-                stock['master_pack_ratio']
-            )
-            stock['complete_packs'] = packs
-            stock['loose_pieces'] = loose
-            stock['loose_distribution'] = loose_dist
+        # Indexed prefix match on search_keys
+        search_query = search_filter(search)
+        if not search_query:
+            return []
+        query.update(search_query)
+        stocks = await search_page("stock", query, search, skip, limit)
+    else:
+        stocks = await db.stock.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
-    return stocks
+    return [with_master_packs(stock) for stock in stocks]
 
 
 @api_router.post("/stock", response_model=Stock)
@@ -4490,7 +6424,13 @@ async def create_stock(stock: StockCreate, current_user: dict = Depends(get_curr
         "updated_at": None
     }
     
+    stock_dict.update(pack_breakdown(stock_dict['size_distribution'], stock_dict['master_pack_ratio']))
+    with_search_keys("stock", stock_dict)
     await db.stock.insert_one(stock_dict)
+    await index_for_search("stock", [stock_dict])
+    await emit_event("stock", "stock_created",
+                     {"stock_code": stock_code, "lot_number": stock_dict['lot_number'], "available_quantity": total_qty},
+                     lot=stock_dict['lot_number'], stock_code=stock_code)
     return stock_dict
 
 
@@ -4501,17 +6441,7 @@ async def get_stock(stock_id: str):
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
     
-    # Calculate master packs
-    if stock.get('master_pack_ratio') and stock.get('size_distribution'):
-        packs, loose, loose_dist = calculate_master_packs(
-            stock['size_distribution'], 
-            stock['master_pack_ratio']
-        )
-        stock['complete_packs'] = packs
-        stock['loose_pieces'] = loose
-        stock['loose_distribution'] = loose_dist
-    
-    return stock
+    return with_master_packs(stock)
 
 
 @api_router.put("/stock/{stock_id}")
@@ -4532,26 +6462,76 @@ async def update_stock(stock_id: str, stock_update: StockCreate):
         "total_quantity": total_qty,
         "available_quantity": total_qty,
         "master_pack_ratio": stock_update.master_pack_ratio or {},
+        **pack_breakdown(stock_update.size_distribution, stock_update.master_pack_ratio),
         "notes": stock_update.notes,
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
+    update_data['search_keys'] = with_search_keys("stock", {**existing, **update_data})['search_keys']
     
     await db.stock.update_one({"id": stock_id}, {"$set": update_data})
+    await reindex_for_search("stock", stock_id)
+    await emit_event("stock", "stock_updated",
+                     {"stock_code": existing.get('stock_code'), "available_quantity": total_qty},
+                     lot=stock_update.lot_number, stock_code=existing.get('stock_code'))
     return {"message": "Stock updated successfully"}
 
 
 @api_router.delete("/stock/{stock_id}")
 async def delete_stock(stock_id: str):
     """Delete (deactivate) stock entry"""
-    result = await db.stock.update_one(
-        {"id": stock_id},
-        {"$set": {"is_active": False}}
+    stock = await db.stock.find_one_and_update(
+        {"id": stock_id, "is_active": {"$ne": False}},
+        {"$set": {"is_active": False}},
+        projection={"_id": 0, "stock_code": 1, "lot_number": 1}
     )
-    if result.modified_count == 0:
+    if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
+    await unindex_for_search("stock", [stock_id])
+    await emit_event("stock", "stock_deleted", {"stock_id": stock_id, "stock_code": stock.get('stock_code')},
+                     lot=stock.get('lot_number'), stock_code=stock.get('stock_code'))
     return {"message": "Stock deleted successfully"}
 
 
+STOCK_CONFLICT_DETAIL = "Stock changed while this dispatch was being recorded; please retry"
+STOCK_WRITE_ATTEMPTS = 5
+
+async def write_stock_quantities(stock: dict, size_distribution: Dict[str, int], available_quantity: int) -> bool:
+    """Set new quantities together with their pack breakdown, only if the stock still holds what was read.
+    A concurrent dispatch makes the filter miss, so nothing is oversold and the breakdown never goes stale."""
+    expected = {"id": stock['id']}
+    if 'available_quantity' in stock:
+        expected['available_quantity'] = stock['available_quantity']
+    for size, qty in (stock.get('size_distribution') or {}).items():
+        expected[f"size_distribution.{size}"] = qty
+    result = await db.stock.update_one(expected, {"$set": {
+        "size_distribution": size_distribution,
+        "available_quantity": available_quantity,
+        **pack_breakdown(size_distribution, stock.get('master_pack_ratio')),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }})
+    return result.matched_count == 1
+
+async def restore_dispatched_stock(items: List[dict]):
+    """Put dispatched items back in stock; a conditional write that loses to a concurrent dispatch is re-read and retried"""
+    for item in items:
+        for _ in range(STOCK_WRITE_ATTEMPTS):
+            stock = await db.stock.find_one({"id": item['stock_id']}, {"_id": 0})
+            if not stock:
+                break
+            # Restore available quantity
+            new_available = stock.get('available_quantity', 0) + item['total_quantity']
+            
+            # Restore size distribution
+            new_size_distribution = {}
+            for size, qty in stock.get('size_distribution', {}).items():
+                restored = item.get('size_distribution', {}).get(size, 0)
+                new_size_distribution[size] = qty + restored
+            
+            if await write_stock_quantities(stock, new_size_distribution, new_available):
+                break
+        else:
+            raise HTTPException(status_code=409, detail=f"{item.get('stock_code')}: {STOCK_CONFLICT_DETAIL}")
+
 @api_router.post("/stock/{stock_id}/dispatch")
 async def dispatch_from_stock(stock_id: str, dispatch: StockDispatch):
     """Dispatch from stock using master packs and loose pieces"""
@@ -4593,14 +6573,8 @@ async def dispatch_from_stock(stock_id: str, dispatch: StockDispatch):
     
     new_available = stock.get('available_quantity', 0) - total_dispatch
     
-    await db.stock.update_one(
-        {"id": stock_id},
-        {"$set": {
-            "size_distribution": new_size_dist,
-            "available_quantity": new_available,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    if not await write_stock_quantities(stock, new_size_dist, new_available):
+        raise HTTPException(status_code=409, detail=STOCK_CONFLICT_DETAIL)
     
     # Record dispatch
     dispatch_record = {
@@ -4619,6 +6593,10 @@ async def dispatch_from_stock(stock_id: str, dispatch: StockDispatch):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.stock_dispatches.insert_one(dispatch_record)
+    await emit_event("dispatch", "stock_dispatched",
+                     {"stock_code": stock.get('stock_code'), "dispatched": total_dispatch, "available_quantity": new_available,
+                      "customer_name": dispatch.customer_name},
+                     lot=stock.get('lot_number'), stock_code=stock.get('stock_code'))
     
     return {"message": "Dispatch recorded successfully", "dispatched": total_dispatch, "remaining": new_available}
 
@@ -4647,6 +6625,7 @@ async def create_catalog_from_stock(stock_id: str, catalog_name: str, catalog_co
     }
     
     await db.catalogs.insert_one(catalog_dict)
+    await index_for_search("catalogs", [catalog_dict])
     
     # Mark stock as used in catalog
     await db.stock.update_one(
@@ -4660,7 +6639,11 @@ async def create_catalog_from_stock(stock_id: str, catalog_name: str, catalog_co
 @api_router.get("/stock/report/summary")
 async def get_stock_summary():
     """Get stock summary report"""
-    stocks = await db.stock.find({"is_active": True}, {"_id": 0}).to_list(1000)
+    stocks = await db.stock.find(
+        {"is_active": True},
+        {"_id": 0, "available_quantity": 1, "size_distribution": 1, "master_pack_ratio": 1, "category": 1, "style_type": 1,
+         "complete_packs": 1, "loose_pieces": 1, "loose_distribution": 1}
+    ).to_list(None)
     
     total_stock = 0
     total_packs = 0
@@ -4672,16 +6655,9 @@ async def get_stock_summary():
         qty = stock.get('available_quantity', 0)
         total_stock += qty
         
-        # Calculate packs
-        if stock.get('master_pack_ratio'):
-            packs, loose, _ = calculate_master_packs(
-                stock.get('size_distribution', {}),
-                stock.get('master_pack_ratio', {})
-            )
-            total_packs += packs
-            total_loose += loose
-        else:
-            total_loose += qty
+        with_master_packs(stock)
+        total_packs += stock['complete_packs']
+        total_loose += stock['loose_pieces']
         
         # Group by category
         cat = stock.get('category', 'Unknown')
@@ -4720,19 +6696,7 @@ async def get_stock_qrcode(stock_id: str):
         "ratio": stock.get('master_pack_ratio', {})
     })
     
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to bytes
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    
-    return Response(content=buffer.getvalue(), media_type="image/png")
+    return Response(content=qr_png(qr_data), media_type="image/png")
 
 
 @api_router.post("/stock/{stock_id}/quick-dispatch")
@@ -4773,14 +6737,8 @@ async def quick_dispatch_one_pack(stock_id: str, customer_name: str = "Walk-in",
     if not bora_number:
         bora_number = f"QD-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
-    await db.stock.update_one(
-        {"id": stock_id},
-        {"$set": {
-            "size_distribution": new_size_dist,
-            "available_quantity": new_available,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    if not await write_stock_quantities(stock, new_size_dist, new_available):
+        raise HTTPException(status_code=409, detail=STOCK_CONFLICT_DETAIL)
     
     # Record dispatch
     dispatch_record = {
@@ -4799,6 +6757,10 @@ async def quick_dispatch_one_pack(stock_id: str, customer_name: str = "Walk-in",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.stock_dispatches.insert_one(dispatch_record)
+    await emit_event("dispatch", "stock_dispatched",
+                     {"stock_code": stock.get('stock_code'), "dispatched": total_dispatch, "available_quantity": new_available,
+                      "customer_name": customer_name},
+                     lot=stock.get('lot_number'), stock_code=stock.get('stock_code'))
     
     return {
         "message": "Quick dispatch successful",
@@ -4815,17 +6777,34 @@ async def get_stock_by_code(stock_code: str):
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
     
-    # Calculate master packs
-    if stock.get('master_pack_ratio') and stock.get('size_distribution'):
-        packs, loose, loose_dist = calculate_master_packs(
-            stock['size_distribution'], 
-            stock['master_pack_ratio']
-        )
-        stock['complete_packs'] = packs
-        stock['loose_pieces'] = loose
-        stock['loose_distribution'] = loose_dist
-    
-    return stock
+    return with_master_packs(stock)
+
+
+@api_router.post("/stock/by-codes")
+async def get_stock_by_codes(request: StockCodesLookup):
+    """Resolve a cart of scanned stock QR codes in one query; unknown or inactive codes are reported in place"""
+    codes = validate_bulk_lookup(request.codes)
+    stocks = {
+        stock['stock_code']: stock
+        for stock in await db.stock.find({"stock_code": {"$in": codes}}, {"_id": 0}).to_list(None)
+    }
+
+    results = []
+    seen = set()
+    for code in request.codes:
+        entry = {"stock_code": code, "duplicate": code in seen}
+        seen.add(code)
+        stock = stocks.get(code)
+        if not stock:
+            results.append({**entry, "status": "not_found", "detail": "Stock not found"})
+        elif not stock.get('is_active', True):
+            results.append({**entry, "status": "inactive", "detail": "Stock has been deleted"})
+        else:
+            # Packs are computed once per distinct code even if the cart repeats it
+            if 'loose_distribution' not in stock:
+                with_master_packs(stock)
+            results.append({**entry, "status": "ok", "stock": stock})
+    return bulk_lookup_response(results)
 
 
 @api_router.post("/stock/copy-from/{source_stock_id}")
@@ -4859,10 +6838,66 @@ async def create_stock_from_existing(source_stock_id: str, stock: StockCreate):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
+    stock_dict.update(pack_breakdown(stock_dict['size_distribution'], stock_dict['master_pack_ratio']))
+    with_search_keys("stock", stock_dict)
     await db.stock.insert_one(stock_dict)
+    await index_for_search("stock", [stock_dict])
+    await emit_event("stock", "stock_created",
+                     {"stock_code": stock_code, "lot_number": stock_dict['lot_number'], "available_quantity": total_qty},
+                     lot=stock_dict['lot_number'], stock_code=stock_code)
     return stock_dict
 
 
+async def recompute_stock_packs(query: dict = None, master_pack_ratio: Dict[str, int] = None) -> dict:
+    """Recompute stored pack breakdowns in vectorised batches, optionally applying a new ratio first.
+    Each write is conditional on updated_at, so an entry dispatched mid-run keeps the dispatch's breakdown."""
+    projection = {"_id": 0, "id": 1, "size_distribution": 1, "master_pack_ratio": 1, "updated_at": 1}
+    matched = updated = 0
+    cursor = db.stock.find(query or {}, projection).batch_size(MIGRATION_BATCH_SIZE)
+    batch = []
+
+    async def flush(stocks):
+        breakdowns = batch_pack_breakdown([
+            (stock.get('size_distribution'), master_pack_ratio if master_pack_ratio is not None else stock.get('master_pack_ratio'))
+            for stock in stocks
+        ])
+        now = datetime.now(timezone.utc).isoformat()
+        writes = []
+        for stock, breakdown in zip(stocks, breakdowns):
+            fields = dict(breakdown)
+            if master_pack_ratio is not None:
+                fields['master_pack_ratio'] = master_pack_ratio
+                fields['updated_at'] = now
+            writes.append(UpdateOne({"id": stock['id'], "updated_at": stock.get('updated_at')}, {"$set": fields}))
+        result = await db.stock.bulk_write(writes, ordered=False)
+        return result.modified_count
+
+    async for stock in cursor:
+        batch.append(stock)
+        matched += 1
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            updated += await flush(batch)
+            batch = []
+    if batch:
+        updated += await flush(batch)
+    return {"matched": matched, "updated": updated}
+
+@api_router.put("/admin/stock/master-pack-ratio")
+async def update_master_pack_ratio(request: MasterPackRatioUpdate, current_user: dict = Depends(get_current_user)):
+    """Apply a new master pack ratio to every active stock entry matching the filters and recompute their packs"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    query = {field: value for field, value in (
+        ("category", request.category), ("style_type", request.style_type), ("lot_number", request.lot_number)
+    ) if value}
+    if not query:
+        raise HTTPException(status_code=400, detail="Provide at least one of category, style_type or lot_number")
+    if not any(qty > 0 for qty in request.master_pack_ratio.values()) or any(qty < 0 for qty in request.master_pack_ratio.values()):
+        raise HTTPException(status_code=400, detail="Master pack ratio needs at least one positive size and no negatives")
+    query['is_active'] = True
+    return await recompute_stock_packs(query, request.master_pack_ratio)
+
+
 # ==================== BULK DISPATCH ROUTES ====================
 
 def generate_dispatch_number():
@@ -4887,91 +6922,99 @@ async def create_bulk_dispatch(dispatch: BulkDispatchCreate, current_user: dict
     processed_items = []
     grand_total = 0
     
-    for item in dispatch_dict['items']:
-        stock_id = item['stock_id']
-        master_packs = item.get('master_packs', 0)
-        loose_pcs = item.get('loose_pcs', {})
-        
-        # Get stock details
-        stock = await db.stock.find_one({"id": stock_id}, {"_id": 0})
-        if not stock:
-            raise HTTPException(status_code=404, detail=f"Stock {stock_id} not found")
-        
-        # Calculate dispatch quantities
-        master_pack_ratio = stock.get('master_pack_ratio', {})
-        dispatch_distribution = {}
-        total_from_packs = 0
-        
-        # Calculate from master packs
-        if master_packs > 0 and master_pack_ratio:
-            for size, ratio in master_pack_ratio.items():
-                qty = master_packs * ratio
-                dispatch_distribution[size] = dispatch_distribution.get(size, 0) + qty
-                total_from_packs += qty
-        
-        # Add loose pieces
-        total_loose = 0
-        for size, qty in loose_pcs.items():
-            if qty > 0:
-                dispatch_distribution[size] = dispatch_distribution.get(size, 0) + qty
-                total_loose += qty
-        
-        total_quantity = total_from_packs + total_loose
-        
-        if total_quantity == 0:
-            continue  # Skip items with 0 quantity
+    # Items already taken from stock are put back if a later item or the dispatch insert fails,
+    # so a dispatch that is not recorded leaves stock as it was
+    try:
+        for item in dispatch_dict['items']:
+            stock_id = item['stock_id']
+            master_packs = item.get('master_packs', 0)
+            loose_pcs = item.get('loose_pcs', {})
+        
+            # Get stock details
+            stock = await db.stock.find_one({"id": stock_id}, {"_id": 0})
+            if not stock:
+                raise HTTPException(status_code=404, detail=f"Stock {stock_id} not found")
+        
+            # Calculate dispatch quantities
+            master_pack_ratio = stock.get('master_pack_ratio', {})
+            dispatch_distribution = {}
+            total_from_packs = 0
+        
+            # Calculate from master packs
+            if master_packs > 0 and master_pack_ratio:
+                for size, ratio in master_pack_ratio.items():
+                    qty = master_packs * ratio
+                    dispatch_distribution[size] = dispatch_distribution.get(size, 0) + qty
+                    total_from_packs += qty
+        
+            # Add loose pieces
+            total_loose = 0
+            for size, qty in loose_pcs.items():
+                if qty > 0:
+                    dispatch_distribution[size] = dispatch_distribution.get(size, 0) + qty
+                    total_loose += qty
         
-        # Verify stock availability
-        available = stock.get('available_quantity', 0)
-        if total_quantity > available:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient stock for {stock['stock_code']}. Available: {available}, Requested: {total_quantity}"
-            )
+            total_quantity = total_from_packs + total_loose
         
-        # Update stock quantities
-        new_available = available - total_quantity
-        new_size_distribution = {}
-        for size, qty in stock.get('size_distribution', {}).items():
-            dispatched = dispatch_distribution.get(size, 0)
-            new_size_distribution[size] = max(0, qty - dispatched)
+            if total_quantity == 0:
+                continue  # Skip items with 0 quantity
         
-        await db.stock.update_one(
-            {"id": stock_id},
-            {"$set": {
-                "available_quantity": new_available,
-                "size_distribution": new_size_distribution,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+            # Verify stock availability
+            available = stock.get('available_quantity', 0)
+            if total_quantity > available:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Insufficient stock for {stock['stock_code']}. Available: {available}, Requested: {total_quantity}"
+                )
         
-        # Create processed item
-        processed_item = {
-            "stock_id": stock_id,
-            "stock_code": stock.get('stock_code', ''),
-            "lot_number": stock.get('lot_number', ''),
-            "category": stock.get('category', ''),
-            "style_type": stock.get('style_type', ''),
-            "color": stock.get('color', ''),
-            "master_packs": master_packs,
-            "loose_pcs": loose_pcs,
-            "master_pack_ratio": master_pack_ratio,
-            "size_distribution": dispatch_distribution,
-            "total_quantity": total_quantity
-        }
-        processed_items.append(processed_item)
-        grand_total += total_quantity
-    
-    if not processed_items:
-        raise HTTPException(status_code=400, detail="No valid items to dispatch")
-    
-    # Save bulk dispatch
-    dispatch_dict['items'] = processed_items
-    dispatch_dict['total_items'] = len(processed_items)
-    dispatch_dict['grand_total_quantity'] = grand_total
-    dispatch_dict['created_at'] = datetime.now(timezone.utc).isoformat()
-    
-    await db.bulk_dispatches.insert_one(dispatch_dict)
+            # Update stock quantities
+            new_available = available - total_quantity
+            new_size_distribution = {}
+            for size, qty in stock.get('size_distribution', {}).items():
+                dispatched = dispatch_distribution.get(size, 0)
+                new_size_distribution[size] = max(0, qty - dispatched)
+        
+            if not await write_stock_quantities(stock, new_size_distribution, new_available):
+                raise HTTPException(status_code=409, detail=f"{stock['stock_code']}: {STOCK_CONFLICT_DETAIL}")
+        
+            # Create processed item
+            processed_item = {
+                "stock_id": stock_id,
+                "stock_code": stock.get('stock_code', ''),
+                "lot_number": stock.get('lot_number', ''),
+                "category": stock.get('category', ''),
+                "style_type": stock.get('style_type', ''),
+                "color": stock.get('color', ''),
+                "master_packs": master_packs,
+                "loose_pcs": loose_pcs,
+                "master_pack_ratio": master_pack_ratio,
+                "size_distribution": dispatch_distribution,
+                "total_quantity": total_quantity
+            }
+            processed_items.append(processed_item)
+            grand_total += total_quantity
+    
+        
+        if not processed_items:
+            raise HTTPException(status_code=400, detail="No valid items to dispatch")
+        
+        # Save bulk dispatch
+        dispatch_dict['items'] = processed_items
+        dispatch_dict['total_items'] = len(processed_items)
+        dispatch_dict['grand_total_quantity'] = grand_total
+        dispatch_dict['created_at'] = datetime.now(timezone.utc).isoformat()
+        
+        await db.bulk_dispatches.insert_one(dispatch_dict)
+    except Exception:
+        await restore_dispatched_stock(processed_items)
+        raise
+    await apply_rollup("dispatch", new=dispatch_dict)
+    await index_for_search("bulk_dispatches", [dispatch_dict])
+    await emit_event("dispatch", "bulk_dispatch_created",
+                     {"dispatch_number": dispatch_dict['dispatch_number'], "customer_name": dispatch_dict.get('customer_name'),
+                      "items": [{"stock_code": i['stock_code'], "total_quantity": i['total_quantity']} for i in processed_items],
+                      "grand_total_quantity": grand_total},
+                     lot=[i['lot_number'] for i in processed_items], stock_code=[i['stock_code'] for i in processed_items])
     
     return {
         "message": "Bulk dispatch created successfully",
@@ -4981,6 +7024,54 @@ async def create_bulk_dispatch(dispatch: BulkDispatchCreate, current_user: dict
         "id": dispatch_dict['id']
     }
 
+MAX_PLAN_CANDIDATES = 5000
+
+@api_router.post("/bulk-dispatches/plan")
+async def plan_bulk_dispatch(request: DispatchPlanRequest):
+    """Suggest which stock entries to dispatch from: complete packs first, fewest entries, oldest stock first.
+    Nothing is reserved; the returned payload is submitted to POST /bulk-dispatches as usual."""
+    if (request.master_packs is None) == (request.size_mix is None):
+        raise HTTPException(status_code=400, detail="Provide either master_packs or size_mix")
+    if request.master_packs is not None and request.master_packs <= 0:
+        raise HTTPException(status_code=400, detail="master_packs must be positive")
+    if request.size_mix is not None and not any(qty > 0 for qty in request.size_mix.values()):
+        raise HTTPException(status_code=400, detail="size_mix needs at least one positive quantity")
+    
+    query = {field: value for field, value in (
+        ("category", request.category), ("style_type", request.style_type), ("color", request.color)
+    ) if value}
+    query.update({"is_active": True, "available_quantity": {"$gt": 0}})
+    candidates = await db.stock.find(query, {
+        "_id": 0, "id": 1, "stock_code": 1, "lot_number": 1, "color": 1, "created_at": 1, "size_distribution": 1,
+        "master_pack_ratio": 1, "complete_packs": 1, "loose_pieces": 1, "loose_distribution": 1
+    }).sort("created_at", 1).limit(MAX_PLAN_CANDIDATES).to_list(MAX_PLAN_CANDIDATES)
+    candidates = [with_master_packs(stock) for stock in candidates]
+    
+    if request.master_packs is not None:
+        lines, short_packs = plan_pack_count(candidates, request.master_packs)
+        shortfall = {"master_packs": short_packs} if short_packs else {}
+    else:
+        lines, short_sizes = plan_size_mix(candidates, request.size_mix)
+        shortfall = {"size_distribution": short_sizes} if short_sizes else {}
+    
+    payload = BulkDispatchCreate(
+        dispatch_date=request.dispatch_date or datetime.now(timezone.utc),
+        customer_name=request.customer_name or "",
+        bora_number=request.bora_number or "",
+        items=[{"stock_id": line['stock_id'], "master_packs": line['master_packs'], "loose_pcs": line['loose_pcs']}
+               for line in lines],
+        notes=request.notes
+    )
+    return {
+        "fulfilled": not shortfall,
+        "shortfall": shortfall,
+        "stock_entries_used": len(lines),
+        "candidates_considered": len(candidates),
+        "total_quantity": sum(line['total_quantity'] for line in lines),
+        "lines": lines,
+        "dispatch": payload.model_dump(mode="json")
+    }
+
 @api_router.get("/bulk-dispatches")
 async def get_bulk_dispatches():
     """Get all bulk dispatches"""
@@ -5002,29 +7093,17 @@ async def delete_bulk_dispatch(dispatch_id: str):
     if not dispatch:
         raise HTTPException(status_code=404, detail="Dispatch not found")
     
-    # Restore stock quantities
-    for item in dispatch.get('items', []):
-        stock = await db.stock.find_one({"id": item['stock_id']}, {"_id": 0})
-        if stock:
-            # Restore available quantity
-            new_available = stock.get('available_quantity', 0) + item['total_quantity']
-            
-            # Restore size distribution
-            new_size_distribution = {}
-            for size, qty in stock.get('size_distribution', {}).items():
-                restored = item.get('size_distribution', {}).get(size, 0)
-                new_size_distribution[size] = qty + restored
-            
-            await db.stock.update_one(
-                {"id": item['stock_id']},
-                {"$set": {
-                    "available_quantity": new_available,
-                    "size_distribution": new_size_distribution,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-    
-    await db.bulk_dispatches.delete_one({"id": dispatch_id})
+    await restore_dispatched_stock(dispatch.get('items', []))
+    
+    result = await db.bulk_dispatches.delete_one({"id": dispatch_id})
+    if result.deleted_count:
+        await apply_rollup("dispatch", old=dispatch)
+    await unindex_for_search("bulk_dispatches", [dispatch_id])
+    items = dispatch.get('items', [])
+    await emit_event("dispatch", "bulk_dispatch_deleted",
+                     {"dispatch_number": dispatch.get('dispatch_number'),
+                      "items": [{"stock_code": i.get('stock_code'), "total_quantity": i.get('total_quantity')} for i in items]},
+                     lot=[i.get('lot_number') for i in items], stock_code=[i.get('stock_code') for i in items])
     return {"message": "Dispatch deleted and stock restored"}
 
 @api_router.get("/bulk-dispatches/{dispatch_id}/print")
@@ -5325,6 +7404,7 @@ async def create_catalog(catalog: CatalogCreate):
     catalog_obj = Catalog(**catalog_dict)
     doc = catalog_obj.model_dump()
     await db.catalogs.insert_one(doc)
+    await index_for_search("catalogs", [doc])
     
     # Mark cutting orders as used in this catalog
     for lot_number in catalog.lot_numbers:
@@ -5415,6 +7495,7 @@ async def update_catalog(catalog_id: str, catalog_update: CatalogCreate):
         {"id": catalog_id},
         {"$set": update_dict}
     )
+    await reindex_for_search("catalogs", catalog_id)
     
     # Unmark old lots that are no longer in this catalog
     removed_lots = [lot for lot in old_lot_numbers if lot not in catalog_update.lot_numbers]
@@ -5539,6 +7620,7 @@ async def delete_catalog(catalog_id: str):
     result = await db.catalogs.delete_one({"id": catalog_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Catalog not found")
+    await unindex_for_search("catalogs", [catalog_id])
     return {"message": "Catalog deleted successfully"}
 
 
@@ -5552,7 +7634,7 @@ async def get_catalog_dispatches(catalog_id: str):
 
 
 # Reports Endpoints
-def generate_cutting_rows(orders, lot_status):
+def generate_cutting_rows(orders, lot_status=None):
     rows = []
     for o in orders:
         lot_num = o.get('cutting_lot_number', 'N/A')
@@ -5565,15 +7647,23 @@ def generate_cutting_rows(orders, lot_status):
         status_html = '<span class="status-badge status-cutting">✂️ Cut</span>'
         
         # Add outsourcing statuses
-        lot_info = lot_status.get(lot_num, {})
-        for os_item in lot_info.get('outsourcing', []):
-            badge_class = 'status-received' if os_item['status'] == 'Received' else 'status-outsourcing'
-            status_html += f'<span class="status-badge {badge_class}">{os_item["operation"]} ({os_item["status"]})</span>'
+        stage = o.get('stage')
+        if stage:
+            received_operations = o.get('received_operations') or []
+            outsourcing = [(operation, 'Received' if operation in received_operations else 'Sent')
+                           for operation in o.get('completed_operations') or []]
+            ironing_status = ('Sent' if stage == 'ironing' else 'Received') if stage in ('ironing', 'ironing-received', 'stock') else None
+        else:
+            # Lots from before stages were stored: status from their DCs
+            lot_info = (lot_status or {}).get(lot_num, {})
+            outsourcing = [(item['operation'], item['status']) for item in lot_info.get('outsourcing', [])]
+            ironing_status = lot_info['ironing'].get('status', 'N/A') if lot_info.get('ironing') else None
+        for operation, status in outsourcing:
+            badge_class = 'status-received' if status == 'Received' else 'status-outsourcing'
+            status_html += f'<span class="status-badge {badge_class}">{operation} ({status})</span>'
         
         # Add ironing status
-        ironing_info = lot_info.get('ironing')
-        if ironing_info:
-            ironing_status = ironing_info.get('status', 'N/A')
+        if ironing_status:
             badge_class = 'status-complete' if ironing_status == 'Received' else 'status-ironing'
             status_html += f'<span class="status-badge {badge_class}">🔥 Ironing ({ironing_status})</span>'
         
@@ -5752,60 +7842,153 @@ async def get_fabric_inventory_report(
     return HTMLResponse(content=html)
 
 
+# ==================== DAILY ROLLUPS ====================
+# Period reports read daily_rollups (see rollups.py) instead of rescanning every order,
+# receipt and dispatch there is. Transitions count their inserts in with the rest of their
+# writes; the other write paths apply the before/after difference of the document they
+# changed. The daily-rollups migration rebuilds the collection from the source data.
+
+ROLLUP_GROUPS = ["day", "month", "category", "style_type", "unit"]
+
+async def apply_rollup(kind: str, old: dict = None, new: dict = None, dc: dict = None):
+    writes = rollup_updates(rollup_delta(kind, old, new, dc))
+    if writes:
+        await db.daily_rollups.bulk_write(writes, ordered=False)
+
+async def rebuild_daily_rollups() -> dict:
+    """Fold all cutting orders, DCs, receipts and dispatches into daily rollups and swap them in.
+    Writes made while it runs are not in the rebuilt copy, so run it when the floor is quiet."""
+    dc_fields = {"_id": 0, "id": 1, "category": 1, "style_type": 1}
+    outsourcing_dcs = {dc['id']: dc async for dc in db.outsourcing_orders.find({}, dc_fields)}
+    ironing_dcs = {dc['id']: dc async for dc in db.ironing_orders.find({}, dc_fields)}
+
+    async def documents():
+        async for order in db.cutting_orders.find({}, {"_id": 0, "cutting_date": 1, "category": 1, "style_type": 1,
+                                                       "cutting_master_name": 1, "total_quantity": 1,
+                                                       "total_fabric_cost": 1, "total_cutting_amount": 1}):
+            yield "cutting", order, None
+        dc_projection = {"_id": 0, "dc_date": 1, "sent_date": 1, "created_at": 1, "category": 1, "style_type": 1,
+                         "unit_name": 1, "total_quantity": 1, "total_amount": 1}
+        receipt_projection = {"_id": 0, "receipt_date": 1, "unit_name": 1, "total_received": 1, "total_shortage": 1,
+                              "shortage_debit_amount": 1, "total_mistakes": 1, "mistake_debit_amount": 1}
+        for kind, collection, receipts, order_field, dcs in (
+            ("outsourcing", db.outsourcing_orders, db.outsourcing_receipts, "outsourcing_order_id", outsourcing_dcs),
+            ("ironing", db.ironing_orders, db.ironing_receipts, "ironing_order_id", ironing_dcs),
+        ):
+            async for order in collection.find({}, dc_projection):
+                yield kind, order, None
+            async for receipt in receipts.find({}, {**receipt_projection, order_field: 1}):
+                yield f"{kind}_receipt", receipt, dcs.get(receipt.get(order_field))
+        async for dispatch in db.bulk_dispatches.find({}, {"_id": 0, "dispatch_date": 1, "customer_name": 1,
+                                                          "items.category": 1, "items.style_type": 1,
+                                                          "items.total_quantity": 1}):
+            yield "dispatch", dispatch, None
+
+    buckets = {}
+    async for kind, doc, dc in documents():
+        rollup_delta(kind, None, doc, dc, buckets)
+    rows = rollup_documents(buckets)
+
+    # Built aside and renamed over the live collection, so reports never see a half-built history
+    staging = db.daily_rollups_rebuild
+    await staging.drop()
+    await staging.create_indexes(INDEX_MANIFEST["daily_rollups"])
+    for start in range(0, len(rows), MIGRATION_BATCH_SIZE):
+        await staging.insert_many(rows[start:start + MIGRATION_BATCH_SIZE], ordered=False)
+    if rows:
+        await staging.rename("daily_rollups", dropTarget=True)
+    else:
+        await db.daily_rollups.delete_many({})
+    return {"rollups": len(rows)}
+
+async def ensure_daily_rollups():
+    """A database with history but no rollups (first start after upgrading) gets them built before serving,
+    so period reports never read an empty collection"""
+    if await db.daily_rollups.find_one({}, {"_id": 1}):
+        return
+    for collection in (db.cutting_orders, db.outsourcing_orders, db.ironing_orders, db.bulk_dispatches):
+        if await collection.find_one({}, {"_id": 1}):
+            started = time.perf_counter()
+            result = await rebuild_daily_rollups()
+            await record_migration_run("daily-rollups", result, started, "startup")
+            logger.info(f"Built daily rollups at startup: {result}")
+            return
+
+def day_range_filter(field: str, start_date: str = None, end_date: str = None) -> dict:
+    """Whole days from start_date to end_date on a stored ISO date field (ISO strings sort by date)"""
+    bounds = {}
+    if start_date:
+        bounds["$gte"] = start_date[:10]
+    if end_date:
+        bounds["$lt"] = (date.fromisoformat(end_date[:10]) + timedelta(days=1)).isoformat()
+    return {field: bounds} if bounds else {}
+
+async def rollup_summary(start_date: str = None, end_date: str = None, group_by: str = None, **filters) -> List[dict]:
+    """ROLLUP_FIELDS summed over the matching days, one row per group (or a single row)"""
+    match = day_range_filter("day", start_date, end_date)
+    match.update({field: value for field, value in filters.items() if value})
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": f"${group_by}" if group_by else None, **{field: {"$sum": f"${field}"} for field in ROLLUP_FIELDS}}},
+        {"$sort": {"_id": 1}},
+    ]
+    rows = await db.daily_rollups.aggregate(pipeline).to_list(None)
+    for row in rows:
+        if group_by:
+            row[group_by] = row['_id']
+        del row['_id']
+        for field in ROLLUP_FIELDS:
+            if isinstance(row[field], float):
+                row[field] = round(row[field], 2)
+    return rows
+
+@api_router.get("/reports/period-summary")
+async def get_period_summary(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    group_by: str = "day",
+    category: Optional[str] = None,
+    style_type: Optional[str] = None,
+    unit: Optional[str] = None
+):
+    """Production totals for a period from the daily rollups, grouped by day, month, category, style or unit"""
+    if group_by not in ROLLUP_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {ROLLUP_GROUPS}")
+    filters = {"category": category, "style_type": style_type, "unit": unit}
+    rows = await rollup_summary(start_date, end_date, group_by, **filters)
+    totals = await rollup_summary(start_date, end_date, **filters)
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "group_by": group_by,
+        "rows": rows,
+        "totals": totals[0] if totals else {field: 0 for field in ROLLUP_FIELDS}
+    }
+
+
 @api_router.get("/reports/cutting", response_class=HTMLResponse)
 async def get_cutting_report(
     start_date: str = None,
     end_date: str = None,
     cutting_master: str = None
 ):
-    query = {}
-    
-    # Get all cutting orders first (dates are stored as strings)
-    orders = await db.cutting_orders.find({}, {"_id": 0}).to_list(1000)
-    
-    # Get outsourcing and ironing data for status tracking
-    outsourcing_orders = await db.outsourcing_orders.find({}, {"_id": 0}).to_list(1000)
-    ironing_orders = await db.ironing_orders.find({}, {"_id": 0}).to_list(1000)
+    # Filter in the query: only the period's orders are read; each carries its own stage fields
+    query = day_range_filter("cutting_date", start_date, end_date) if start_date and end_date else {}
+    if cutting_master:
+        query["cutting_master_name"] = cutting_master
+    orders = await db.cutting_orders.find(query, {"_id": 0}).to_list(1000)
     
-    # Build status lookup for each cutting lot
+    # Lots without a stored stage take their status from their DCs
+    legacy_lots = [o['cutting_lot_number'] for o in orders if not o.get('stage') and o.get('cutting_lot_number')]
     lot_status = {}
-    for o in outsourcing_orders:
-        lot_nums = o.get('lot_details', [])
-        for lot in lot_nums:
-            lot_num = lot.get('cutting_lot_number') or o.get('cutting_lot_number')
-            if lot_num:
-                current = lot_status.get(lot_num, {'outsourcing': [], 'ironing': None})
-                current['outsourcing'].append({
-                    'operation': o.get('operation_type'),
-                    'status': o.get('status'),
-                    'unit': o.get('unit_name')
-                })
-                lot_status[lot_num] = current
-    
-    for i in ironing_orders:
-        lot_num = i.get('cutting_lot_number')
-        if lot_num:
-            if lot_num not in lot_status:
-                lot_status[lot_num] = {'outsourcing': [], 'ironing': None}
-            lot_status[lot_num]['ironing'] = {
-                'status': i.get('status'),
-                'unit': i.get('unit_name')
-            }
-    
-    # Apply filters in Python since dates are strings
-    if start_date and end_date:
-        start = datetime.fromisoformat(start_date).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
-        end = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59, microsecond=999999, tzinfo=timezone.utc)
-        filtered_orders = []
-        for order in orders:
-            order_date = datetime.fromisoformat(order['cutting_date']) if isinstance(order['cutting_date'], str) else order['cutting_date']
-            if start <= order_date <= end:
-                filtered_orders.append(order)
-        orders = filtered_orders
-    
-    # Apply cutting master filter
-    if cutting_master:
-        orders = [o for o in orders if o.get('cutting_master_name') == cutting_master]
+    if legacy_lots:
+        async for o in db.outsourcing_orders.find(lot_numbers_query(legacy_lots), {"_id": 0, "cutting_lot_numbers": 1,
+                                                  "cutting_lot_number": 1, "lot_details": 1, "operation_type": 1, "status": 1}):
+            for lot_num in order_lot_numbers(o):
+                lot_status.setdefault(lot_num, {'outsourcing': [], 'ironing': None})['outsourcing'].append(
+                    {'operation': o.get('operation_type'), 'status': o.get('status')})
+        async for i in db.ironing_orders.find({"cutting_lot_number": {"$in": legacy_lots}}, {"_id": 0, "cutting_lot_number": 1, "status": 1}):
+            lot_status.setdefault(i['cutting_lot_number'], {'outsourcing': [], 'ironing': None})['ironing'] = {'status': i.get('status')}
     
     # Convert dates
     for order in orders:
@@ -5925,27 +8108,13 @@ async def get_outsourcing_report(
     unit_name: str = None,
     operation_type: str = None
 ):
-    # Get all outsourcing orders first (dates are stored as strings)
-    orders = await db.outsourcing_orders.find({}, {"_id": 0}).to_list(1000)
-    
-    # Apply filters in Python since dates are strings
-    if start_date and end_date:
-        start = datetime.fromisoformat(start_date).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
-        end = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59, microsecond=999999, tzinfo=timezone.utc)
-        filtered_orders = []
-        for order in orders:
-            order_date = datetime.fromisoformat(order['dc_date']) if isinstance(order['dc_date'], str) else order['dc_date']
-            if start <= order_date <= end:
-                filtered_orders.append(order)
-        orders = filtered_orders
-    
-    # Apply unit filter
+    # Filter in the query: only the period's DCs are read
+    query = day_range_filter("dc_date", start_date, end_date) if start_date and end_date else {}
     if unit_name:
-        orders = [o for o in orders if o.get('unit_name') == unit_name]
-    
-    # Apply operation type filter
+        query["unit_name"] = unit_name
     if operation_type:
-        orders = [o for o in orders if o.get('operation_type') == operation_type]
+        query["operation_type"] = operation_type
+    orders = await db.outsourcing_orders.find(query, {"_id": 0}).to_list(1000)
     
     # Convert dates
     for order in orders:
@@ -6083,26 +8252,18 @@ async def get_ironing_report(
     end_date: str = None,
     unit_name: str = None
 ):
-    # Get all ironing orders first (dates are stored as strings)
-    orders = await db.ironing_orders.find({}, {"_id": 0}).to_list(1000)
-    
-    # Apply filters in Python since dates are strings
+    # Filter in the query: only the period's DCs are read (older scan DCs carry only sent_date)
+    query = {}
     if start_date and end_date:
-        start = datetime.fromisoformat(start_date).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
-        end = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59, microsecond=999999, tzinfo=timezone.utc)
-        filtered_orders = []
-        for order in orders:
-            order_date = datetime.fromisoformat(order['dc_date']) if isinstance(order['dc_date'], str) else order['dc_date']
-            if start <= order_date <= end:
-                filtered_orders.append(order)
-        orders = filtered_orders
-    
-    # Apply unit filter
+        query["$or"] = [day_range_filter("dc_date", start_date, end_date),
+                        {"dc_date": None, **day_range_filter("sent_date", start_date, end_date)}]
     if unit_name:
-        orders = [o for o in orders if o.get('unit_name') == unit_name]
+        query["unit_name"] = unit_name
+    orders = await db.ironing_orders.find(query, {"_id": 0}).to_list(1000)
     
     # Convert dates
     for order in orders:
+        order['dc_date'] = order.get('dc_date') or order.get('sent_date') or order.get('created_at')
         if isinstance(order.get('dc_date'), str):
             order['dc_date'] = datetime.fromisoformat(order['dc_date'])
     
@@ -6808,88 +8969,220 @@ async def get_dashboard_analytics():
     }
 
 
-@api_router.get("/dashboard/notifications")
-async def get_notifications():
-    """Get system notifications and alerts"""
-    notifications = []
-    
-    # Low stock alerts
-    stocks = await db.stock.find({}, {"_id": 0}).to_list(1000)
-    for stock in stocks:
-        if 0 < stock.get('available_quantity', 0) < 50:
-            notifications.append({
+# ==================== LIVE EVENTS ====================
+# Write handlers publish what changed; SSE clients subscribe by topic and entity
+# (lot, stock_code, unit). With EVENT_SOURCE=change_stream, events go through the
+# live_events collection and every worker tails it, so a client sees changes made
+# on any worker (needs a replica set; a single-node one is enough locally).
+EVENT_SOURCE = os.environ.get('EVENT_SOURCE', 'local')
+
+async def emit_event(topic: str, event_type: str, data: dict, lot=None, stock_code=None, unit=None):
+    """Publish a change to live subscribers; never fails the write that triggered it"""
+    event = build_event(topic, data, event_type, event_keys(lot=lot, stock_code=stock_code, unit=unit))
+    if EVENT_SOURCE != 'change_stream':
+        bus.dispatch(event)
+        return
+    try:
+        await db.live_events.insert_one({**event, "created_at": datetime.now(timezone.utc)})
+    except Exception as e:
+        logging.warning(f"Live event {topic}/{event_type} not recorded: {e}")
+
+async def tail_live_events():
+    """Relay live_events inserts made by any worker to this worker's subscribers"""
+    resume_token = None
+    while True:
+        try:
+            pipeline = [{"$match": {"operationType": "insert"}}]
+            async with db.live_events.watch(pipeline, resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    event = change['fullDocument']
+                    event.pop('_id', None)
+                    event.pop('created_at', None)
+                    bus.dispatch(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Live event change stream interrupted: {e}")
+            await asyncio.sleep(5)
+
+@api_router.get("/events/stream")
+async def stream_events(request: Request, topics: str = None, lot: str = None, stock_code: str = None, unit: str = None):
+    """Server-Sent Events feed of production changes, e.g. ?topics=stock,dispatch&stock_code=STK-0001"""
+    topic_set = {t.strip() for t in topics.split(',') if t.strip()} if topics else None
+    subscription = bus.subscribe(topic_set, {"lot": lot, "stock_code": stock_code, "unit": unit})
+    return StreamingResponse(
+        sse_stream(subscription, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== NOTIFICATION ENGINE ====================
+# A background task evaluates the alert rules with indexed range queries and keeps
+# the notifications collection in sync (one document per dedup_key). Only the worker
+# holding the engine lease evaluates; every worker relays newly raised notifications
+# to its SSE subscribers.
+NOTIFICATION_INTERVAL_SECONDS = int(os.environ.get('NOTIFICATION_INTERVAL_SECONDS', '60'))
+OVERDUE_DAYS = 7
+LOW_STOCK_THRESHOLD = 50
+UNPAID_BALANCE_THRESHOLD = 1000
+NOTIFICATION_FIELDS = {"_id": 0, "id": 1, "dedup_key": 1, "rule": 1, "type": 1, "title": 1, "message": 1,
+                       "category": 1, "entity_id": 1, "raised_at": 1}
+
+async def evaluate_notification_rules() -> list:
+    """Everything that should currently be alerted on"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=OVERDUE_DAYS)).isoformat()
+    candidates = []
+
+    stock_fields = {"_id": 0, "id": 1, "stock_code": 1, "lot_number": 1, "available_quantity": 1}
+    async for stock in db.stock.find(
+        {"available_quantity": {"$gt": 0, "$lt": LOW_STOCK_THRESHOLD}}, stock_fields
+    ):
+        candidates.append({
+            "dedup_key": f"low_stock:{stock['id']}",
+            "rule": "low_stock",
+            "type": "warning",
+            "title": "Low Stock Alert",
+            "message": f"{stock.get('stock_code')}: {stock.get('lot_number')} has only {stock.get('available_quantity')} pcs left",
+            "category": "stock",
+            "entity_id": stock['id']
+        })
+    async for stock in db.stock.find({"available_quantity": 0}, stock_fields):
+        candidates.append({
+            "dedup_key": f"out_of_stock:{stock['id']}",
+            "rule": "out_of_stock",
+            "type": "error",
+            "title": "Out of Stock",
+            "message": f"{stock.get('stock_code')}: {stock.get('lot_number')} is out of stock",
+            "category": "stock",
+            "entity_id": stock['id']
+        })
+
+    order_fields = {"_id": 0, "id": 1, "dc_number": 1, "unit_name": 1}
+    for collection, rule, title, category in [
+        (db.outsourcing_orders, "overdue_outsourcing", "Overdue Outsourcing", "outsourcing"),
+        (db.ironing_orders, "overdue_ironing", "Overdue Ironing", "ironing"),
+    ]:
+        async for order in collection.find({"status": "Sent", "dc_date": {"$lt": cutoff}}, order_fields):
+            candidates.append({
+                "dedup_key": f"{rule}:{order['id']}",
+                "rule": rule,
                 "type": "warning",
-                "title": "Low Stock Alert",
-                "message": f"{stock.get('stock_code')}: {stock.get('lot_number')} has only {stock.get('available_quantity')} pcs left",
-                "category": "stock"
+                "title": title,
+                "message": f"DC {order.get('dc_number')} to {order.get('unit_name')} is pending for over {OVERDUE_DAYS} days",
+                "category": category,
+                "entity_id": order['id']
             })
-        elif stock.get('available_quantity', 0) == 0:
-            notifications.append({
-                "type": "error",
-                "title": "Out of Stock",
-                "message": f"{stock.get('stock_code')}: {stock.get('lot_number')} is out of stock",
-                "category": "stock"
-            })
-    
-    # Pending outsourcing (overdue > 7 days)
-    from datetime import timedelta
-    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    pending_outsourcing = await db.outsourcing_orders.find(
-        {"status": "Sent"},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    for order in pending_outsourcing:
-        dc_date = order.get('dc_date')
-        if dc_date:
-            if isinstance(dc_date, str):
-                try:
-                    dc_date = datetime.fromisoformat(dc_date.replace('Z', '+00:00'))
-                except:
-                    continue
-            if dc_date < seven_days_ago:
-                notifications.append({
-                    "type": "warning",
-                    "title": "Overdue Outsourcing",
-                    "message": f"DC {order.get('dc_number')} to {order.get('unit_name')} is pending for over 7 days",
-                    "category": "outsourcing"
-                })
-    
-    # Pending ironing
-    pending_ironing = await db.ironing_orders.find(
-        {"status": "Sent"},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    for order in pending_ironing:
-        dc_date = order.get('dc_date')
-        if dc_date:
-            if isinstance(dc_date, str):
-                try:
-                    dc_date = datetime.fromisoformat(dc_date.replace('Z', '+00:00'))
-                except:
-                    continue
-            if dc_date < seven_days_ago:
-                notifications.append({
-                    "type": "warning",
-                    "title": "Overdue Ironing",
-                    "message": f"DC {order.get('dc_number')} to {order.get('unit_name')} is pending for over 7 days",
-                    "category": "ironing"
-                })
-    
-    # Unpaid bills alerts
-    unpaid_outsourcing = await db.outsourcing_orders.find(
-        {"payment_status": "Unpaid", "balance": {"$gt": 1000}},
-        {"_id": 0}
-    ).to_list(100)
-    
-    for order in unpaid_outsourcing[:5]:  # Limit to 5
-        notifications.append({
+
+    async for order in db.outsourcing_orders.find(
+        {"payment_status": "Unpaid", "balance": {"$gt": UNPAID_BALANCE_THRESHOLD}},
+        {**order_fields, "balance": 1}
+    ):
+        candidates.append({
+            "dedup_key": f"unpaid:{order['id']}",
+            "rule": "unpaid",
             "type": "info",
             "title": "Pending Payment",
             "message": f"₹{order.get('balance', 0)} pending for {order.get('unit_name')} ({order.get('dc_number')})",
-            "category": "payment"
+            "category": "payment",
+            "entity_id": order['id']
         })
+    return candidates
+
+async def refresh_notifications() -> dict:
+    """Raise new alerts, update changed ones and resolve those whose condition cleared"""
+    now = datetime.now(timezone.utc).isoformat()
+    candidates = await evaluate_notification_rules()
+    active = {
+        n['dedup_key']: n
+        for n in await db.notifications.find({"active": True}, {"_id": 0, "dedup_key": 1, "message": 1}).to_list(None)
+    }
+
+    writes = []
+    raised = 0
+    for candidate in candidates:
+        existing = active.get(candidate['dedup_key'])
+        if existing is None:
+            raised += 1
+            writes.append(UpdateOne(
+                {"dedup_key": candidate['dedup_key']},
+                {"$set": {**candidate, "active": True, "raised_at": now, "resolved_at": None},
+                 "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now}},
+                upsert=True
+            ))
+        elif existing.get('message') != candidate['message']:
+            writes.append(UpdateOne({"dedup_key": candidate['dedup_key']}, {"$set": {"message": candidate['message']}}))
+    if writes:
+        try:
+            await db.notifications.bulk_write(writes, ordered=False)
+        except BulkWriteError as e:
+            # A concurrent refresh raised the same alert first
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+
+    resolved = list(set(active) - {c['dedup_key'] for c in candidates})
+    if resolved:
+        await db.notifications.update_many(
+            {"dedup_key": {"$in": resolved}},
+            {"$set": {"active": False, "resolved_at": now}}
+        )
+    await db.system_meta.update_one({"type": "notification_engine"}, {"$set": {"last_run_at": now}}, upsert=True)
+    return {"active": len(candidates), "raised": raised, "resolved": len(resolved)}
+
+async def acquire_notification_lease(worker_id: str) -> bool:
+    """One worker evaluates rules at a time; the lease expires if it dies"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.system_meta.find_one_and_update(
+            {"type": "notification_engine", "$or": [
+                {"lease_until": {"$exists": False}},
+                {"lease_until": {"$lt": now.isoformat()}},
+                {"worker_id": worker_id}
+            ]},
+            {"$set": {"worker_id": worker_id,
+                      "lease_until": (now + timedelta(seconds=NOTIFICATION_INTERVAL_SECONDS * 2)).isoformat()}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def relay_raised_notifications(since: str) -> str:
+    """Push notifications raised after `since` to this worker's subscribers"""
+    latest = since
+    async for notification in db.notifications.find(
+        {"active": True, "raised_at": {"$gt": since}}, NOTIFICATION_FIELDS
+    ).sort("raised_at", 1):
+        bus.publish("notifications", notification, "notification")
+        latest = notification['raised_at']
+    return latest
+
+async def run_notification_engine():
+    worker_id = str(uuid.uuid4())
+    relayed_until = datetime.now(timezone.utc).isoformat()
+    while True:
+        try:
+            if await acquire_notification_lease(worker_id):
+                await refresh_notifications()
+            relayed_until = await relay_raised_notifications(relayed_until)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Notification engine run failed: {e}")
+        await asyncio.sleep(NOTIFICATION_INTERVAL_SECONDS)
+
+@api_router.get("/dashboard/notifications")
+async def get_notifications():
+    """Get system notifications and alerts"""
+    engine = await db.system_meta.find_one({"type": "notification_engine", "last_run_at": {"$exists": True}}, {"_id": 0})
+    if not engine:
+        # First request on a fresh database: evaluate once instead of waiting for the engine
+        await refresh_notifications()
+
+    active = await db.notifications.find({"active": True}, NOTIFICATION_FIELDS).sort("raised_at", -1).to_list(1000)
+    payments = [n for n in active if n['category'] == 'payment'][:5]  # Limit to 5
+    notifications = [n for n in active if n['category'] != 'payment'] + payments
     
     return {
         "notifications": notifications,
@@ -6901,44 +9194,48 @@ async def get_notifications():
         }
     }
 
+@api_router.get("/notifications/stream")
+async def stream_notifications(request: Request):
+    """Server-Sent Events feed of newly raised notifications"""
+    subscription = bus.subscribe({"notifications"})
+    return StreamingResponse(
+        sse_stream(subscription, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 @api_router.get("/reports/profit-loss")
-async def get_profit_loss_report(format: str = "html"):
+async def get_profit_loss_report(format: str = "html", start_date: Optional[str] = None, end_date: Optional[str] = None):
     """Generate profit/loss report based on costs and dispatches"""
     
-    # Get all costs
-    cutting_orders = await db.cutting_orders.find({}, {"_id": 0}).to_list(1000)
-    outsourcing_orders = await db.outsourcing_orders.find({}, {"_id": 0}).to_list(1000)
-    ironing_orders = await db.ironing_orders.find({}, {"_id": 0}).to_list(1000)
-    receipts = await db.outsourcing_receipts.find({}, {"_id": 0}).to_list(1000)
-    ironing_receipts = await db.ironing_receipts.find({}, {"_id": 0}).to_list(1000)
-    
-    # Calculate total costs
-    fabric_cost = sum(o.get('total_fabric_cost', 0) for o in cutting_orders)
-    cutting_cost = sum(o.get('total_cutting_amount', 0) for o in cutting_orders)
-    outsourcing_cost = sum(o.get('total_amount', 0) for o in outsourcing_orders)
-    ironing_cost = sum(o.get('total_amount', 0) for o in ironing_orders)
+    # Costs, production and dispatches for the period, summed from the daily rollups
+    summary = await rollup_summary(start_date, end_date)
+    totals = summary[0] if summary else {field: 0 for field in ROLLUP_FIELDS}
+    fabric_cost = totals['fabric_cost']
+    cutting_cost = totals['cutting_cost']
+    outsourcing_cost = totals['outsourcing_cost']
+    ironing_cost = totals['ironing_cost']
     
     # Shortage deductions
-    outsourcing_shortage = sum(r.get('shortage_debit_amount', 0) for r in receipts)
-    ironing_shortage = sum(r.get('shortage_debit_amount', 0) for r in ironing_receipts)
-    total_shortage_deduction = outsourcing_shortage + ironing_shortage
+    total_shortage_deduction = round(totals['outsourcing_shortage_debit'] + totals['ironing_shortage_debit'], 2)
     
     total_cost = fabric_cost + cutting_cost + outsourcing_cost + ironing_cost - total_shortage_deduction
     
     # Get total production
-    total_pieces_produced = sum(o.get('total_quantity', 0) for o in cutting_orders)
+    total_pieces_produced = totals['pieces_cut']
     
     # Calculate cost per piece
     cost_per_piece = total_cost / total_pieces_produced if total_pieces_produced > 0 else 0
     
-    # Get dispatches (potential revenue indicator)
-    dispatches = await db.bulk_dispatches.find({}, {"_id": 0}).to_list(1000)
-    total_dispatched = sum(d.get('grand_total_quantity', 0) for d in dispatches)
+    # Dispatches (potential revenue indicator)
+    total_dispatched = totals['pieces_dispatched']
     
-    # Stock value
-    stocks = await db.stock.find({}, {"_id": 0}).to_list(1000)
-    total_stock_quantity = sum(s.get('available_quantity', 0) for s in stocks)
+    # Stock value: what is on hand now, whatever the period
+    stock_totals = await db.stock.aggregate([
+        {"$group": {"_id": None, "available": {"$sum": "$available_quantity"}}}
+    ]).to_list(1)
+    total_stock_quantity = stock_totals[0]['available'] if stock_totals else 0
     estimated_stock_value = total_stock_quantity * cost_per_piece
     
     if format == "csv":
@@ -6989,6 +9286,7 @@ async def get_profit_loss_report(format: str = "html"):
     <body>
         <div class="header">
             <h1>💰 Profit & Loss Report</h1>
+            <p>Period: {start_date or 'All'} to {end_date or 'All'}</p>
             <p>Generated on {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}</p>
         </div>
         
@@ -7080,7 +9378,7 @@ async def track_lot_journey(lot_number: str):
     
     # 2. Find in Outsourcing Orders
     outsourcing = await db.outsourcing_orders.find(
-        {"cutting_lot_number": lot_number},
+        lot_numbers_query(lot_number),
         {"_id": 0}
     ).to_list(100)
     
@@ -7104,7 +9402,7 @@ async def track_lot_journey(lot_number: str):
     
     # 3. Find in Outsourcing Receipts
     receipts = await db.outsourcing_receipts.find(
-        {"cutting_lot_number": lot_number},
+        {"outsourcing_order_id": {"$in": [order['id'] for order in outsourcing]}},
         {"_id": 0}
     ).to_list(100)
     
@@ -7211,15 +9509,9 @@ async def create_return(return_data: ReturnCreate, current_user: dict = Depends(
     await db.returns.insert_one(return_dict)
     
     # Log activity
-    await db.activity_logs.insert_one({
-        "id": str(uuid.uuid4()),
-        "action": "Return Recorded",
-        "entity_type": "return",
-        "entity_id": return_dict['id'],
-        "details": f"Return from {return_data.source_type}: {return_data.quantity} pcs - {return_data.reason}",
-        "user": current_user.get('username', 'system'),
-        "timestamp": datetime.now(timezone.utc)
-    })
+    activity_logger.log("Return Recorded", "return", return_dict['id'],
+                        f"Return from {return_data.source_type}: {return_data.quantity} pcs - {return_data.reason}",
+                        current_user.get('username', 'system'))
     
     return {"message": "Return recorded", "id": return_dict['id']}
 
@@ -7278,15 +9570,9 @@ async def process_return(return_id: str, action: str = "accept", current_user: d
     )
     
     # Log activity
-    await db.activity_logs.insert_one({
-        "id": str(uuid.uuid4()),
-        "action": f"Return {new_status}",
-        "entity_type": "return",
-        "entity_id": return_id,
-        "details": f"Return {new_status.lower()} by {current_user.get('username', 'system')}" + (" - Stock restored" if stock_restored else ""),
-        "user": current_user.get('username', 'system'),
-        "timestamp": datetime.now(timezone.utc)
-    })
+    activity_logger.log(f"Return {new_status}", "return", return_id,
+                        f"Return {new_status.lower()} by {current_user.get('username', 'system')}" + (" - Stock restored" if stock_restored else ""),
+                        current_user.get('username', 'system'))
     
     return {"message": f"Return {new_status.lower()}", "stock_restored": stock_restored}
 
@@ -7305,15 +9591,7 @@ async def delete_return(return_id: str, current_user: dict = Depends(get_current
         raise HTTPException(status_code=404, detail="Return not found")
     
     # Log activity
-    await db.activity_logs.insert_one({
-        "id": str(uuid.uuid4()),
-        "action": "Return Deleted",
-        "entity_type": "return",
-        "entity_id": return_id,
-        "details": "Return record deleted",
-        "user": current_user.get('username', 'system'),
-        "timestamp": datetime.now(timezone.utc)
-    })
+    activity_logger.log("Return Deleted", "return", return_id, "Return record deleted", current_user.get('username', 'system'))
     
     return {"message": "Return deleted"}
 
@@ -7424,24 +9702,21 @@ async def export_collection_csv(collection: str):
 
 
 # Activity Log
+# Entries are buffered by activity_logger and written in batches (see activity.py), so
+# logging never adds a round trip to the request that logs.
+activity_logger = ActivityLogger(db.activity_logs)
+
 @api_router.post("/activity-log")
 async def log_activity(action: str, entity_type: str, entity_id: str, details: str = "", user: str = "system"):
     """Log an activity"""
-    log_entry = {
-        "id": str(uuid.uuid4()),
-        "action": action,
-        "entity_type": entity_type,
-        "entity_id": entity_id,
-        "details": details,
-        "user": user,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    await db.activity_logs.insert_one(log_entry)
+    activity_logger.log(action, entity_type, entity_id, details, user)
     return {"message": "Activity logged"}
 
 @api_router.get("/activity-logs")
 async def get_activity_logs(limit: int = 100, entity_type: Optional[str] = None):
     """Get recent activity logs"""
+    # Read-your-writes: whatever is still buffered goes out first
+    await activity_logger.flush()
     query = {}
     if entity_type:
         query["entity_type"] = entity_type
@@ -7449,6 +9724,14 @@ async def get_activity_logs(limit: int = 100, entity_type: Optional[str] = None)
     logs = await db.activity_logs.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
     return logs
 
+async def backfill_activity_log_timestamps() -> dict:
+    """ISO-string timestamps to BSON dates, so the TTL index and the sort cover every entry"""
+    result = await db.activity_logs.update_many(
+        {"timestamp": {"$type": "string"}},
+        [{"$set": {"timestamp": {"$dateFromString": {"dateString": "$timestamp", "onError": "$timestamp"}}}}]
+    )
+    return {"updated": result.modified_count}
+
 
 # Settings
 @api_router.get("/settings")
@@ -7747,6 +10030,9 @@ async def record_unit_payment(payment: UnitPayment):
         
         remaining_payment -= allocation
     
+    await emit_event("payment", "unit_payment",
+                     {"unit_name": unit_name, "amount": amount, "allocations": allocations}, unit=unit_name)
+    
     return {
         "message": "Payment recorded successfully",
         "unit_name": unit_name,
@@ -7758,6 +10044,129 @@ async def record_unit_payment(payment: UnitPayment):
     }
 
 
+# ==================== ADMIN: REQUEST PROFILES ====================
+
+@api_router.get("/admin/profiles")
+async def get_request_profiles(limit: int = 50, path: str = None, current_user: dict = Depends(get_current_user)):
+    """List stored request profiles, newest first"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    query = {}
+    if path:
+        query["path"] = {"$regex": f"^{sanitize_search(path)}"}
+    summary = {"_id": 0, "folded": 0, "db_trace": 0, "top_functions": 0}
+    return await db.request_profiles.find(query, summary).sort("$natural", -1).limit(limit).to_list(limit)
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_request_profile(profile_id: str, current_user: dict = Depends(get_current_user)):
+    """Full profile: top functions, folded stacks and the Mongo command trace"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    profile = await db.request_profiles.find_one({"id": profile_id}, {"_id": 0})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@api_router.get("/admin/profiles/{profile_id}/folded")
+async def get_request_profile_folded(profile_id: str, current_user: dict = Depends(get_current_user)):
+    """Folded stacks for flamegraph.pl or speedscope"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    profile = await db.request_profiles.find_one({"id": profile_id}, {"_id": 0, "folded": 1})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    folded = "\n".join(f"{entry['stack']} {entry['count']}" for entry in profile.get('folded', []))
+    return Response(
+        content=folded,
+        media_type="text/plain",
+        headers={"Content-Disposition": f"attachment; filename=profile-{profile_id}.folded"}
+    )
+
+
+# ==================== ADMIN: INDEXES ====================
+
+@api_router.get("/admin/indexes")
+async def get_index_status(current_user: dict = Depends(get_current_user)):
+    """Last manifest run plus any manifest index currently missing from the database"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    applied = await db.system_meta.find_one({"type": "index_manifest"}, {"_id": 0})
+    existing = await asyncio.gather(*[db[collection].index_information() for collection in INDEX_MANIFEST])
+    missing = [
+        {"collection": collection, "name": model.document["name"]}
+        for (collection, models), present in zip(INDEX_MANIFEST.items(), existing)
+        for model in models
+        if model.document["name"] not in present
+    ]
+    return {
+        "manifest_fingerprint": index_manifest_fingerprint(),
+        "applied": applied,
+        "up_to_date": bool(applied) and applied.get('fingerprint') == index_manifest_fingerprint() and not missing,
+        "missing": missing
+    }
+
+@api_router.post("/admin/indexes/apply")
+async def apply_indexes(force: bool = True, current_user: dict = Depends(get_current_user)):
+    """Re-apply the index manifest"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await create_indexes(force=force)
+
+
+# ==================== DATA MIGRATIONS ====================
+# Backfills for fields the API now maintains on write. Each is idempotent and safe to
+# re-run; the last run of each is recorded in system_meta.
+MIGRATION_BATCH_SIZE = 1000
+
+async def record_migration_run(name: str, result: dict, started: float, run_by: str) -> dict:
+    run = {
+        "type": f"migration:{name}",
+        "name": name,
+        "result": result,
+        "duration_ms": elapsed_ms(started),
+        "run_by": run_by,
+        "run_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.system_meta.replace_one({"type": run['type']}, run, upsert=True)
+    run.pop('_id', None)
+    return run
+
+MIGRATIONS = {
+    "search-keys": backfill_search_keys,
+    "search-index": rebuild_search_index,
+    "fabric-rolls": backfill_fabric_rolls,
+    "lot-stages": backfill_lot_stages,
+    "lot-lineage": backfill_lot_lineage,
+    "cutting-lot-numbers": backfill_cutting_lot_numbers,
+    "stock-packs": recompute_stock_packs,
+    "activity-log-timestamps": backfill_activity_log_timestamps,
+    "daily-rollups": rebuild_daily_rollups,
+}
+
+@api_router.get("/admin/migrations")
+async def list_migrations(current_user: dict = Depends(get_current_user)):
+    """Available migrations and when each last ran"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    runs = await db.system_meta.find(
+        {"type": {"$in": [f"migration:{name}" for name in MIGRATIONS]}}, {"_id": 0}
+    ).to_list(len(MIGRATIONS))
+    last_runs = {run['name']: run for run in runs}
+    return [{"name": name, "last_run": last_runs.get(name)} for name in MIGRATIONS]
+
+@api_router.post("/admin/migrations/{name}")
+async def run_migration(name: str, current_user: dict = Depends(get_current_user)):
+    """Run one backfill migration"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    migration = MIGRATIONS.get(name)
+    if not migration:
+        raise HTTPException(status_code=404, detail=f"Unknown migration. Valid: {list(MIGRATIONS)}")
+    started = time.perf_counter()
+    result = await migration()
+    return await record_migration_run(name, result, started, current_user.get('username'))
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -7785,4 +10194,16 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task_name in ("loop_lag_task", "notification_task", "live_events_task", "activity_log_task"):
+        task = getattr(app.state, task_name, None)
+        if task:
+            task.cancel()
+    activity_log_task = getattr(app.state, "activity_log_task", None)
+    if activity_log_task:
+        # Let a flush cancelled mid-write put its batch back before the final flush
+        await asyncio.gather(activity_log_task, return_exceptions=True)
+    # Entries still buffered are written before the connection goes away
+    await activity_logger.flush()
+    if _dc_pdf_pool is not None:
+        _dc_pdf_pool.shutdown(wait=False, cancel_futures=True)
     client.close()
\ No newline at end of file
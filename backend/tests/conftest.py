@@ -0,0 +1,88 @@
+"""
+Shared pytest fixtures for the backend.
+
+The in-process fixtures talk to a real MongoDB (MONGO_URL, default localhost) in a
+throwaway database and are skipped when no server is reachable. The Motor client is
+bound to the event loop it first runs on, so every coroutine that touches the database
+runs on the app's loop through run_async, never through a fresh asyncio.run.
+"""
+
+import functools
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'garment_pytest')
+
+from db_monitor import parse_server_timing  # noqa: E402
+
+
+def _mongo_available() -> bool:
+    from pymongo import MongoClient
+    try:
+        MongoClient(os.environ['MONGO_URL'], serverSelectionTimeoutMS=1000).admin.command('ping')
+        return True
+    except Exception:
+        return False
+
+
+@pytest.fixture(scope="session")
+def seeded_db():
+    """A small, consistent dataset from the scale generator in a scratch database"""
+    if not _mongo_available():
+        pytest.skip("MongoDB is not reachable")
+    from pymongo import MongoClient
+    from generate_scale_data import ScaleDataGenerator, GENERATED_COLLECTIONS
+
+    mongo = MongoClient(os.environ['MONGO_URL'])
+    db = mongo[os.environ['DB_NAME']]
+    for name in GENERATED_COLLECTIONS:
+        db[name].drop()
+    generator = ScaleDataGenerator(db, seed=7, batch_size=500, history_days=120)
+    generator.generate_master_data()
+    stock_entries = generator.generate_pipeline(cutting_lots=40, outsourcing_orders=120, stock_target=20)
+    generator.generate_dispatches(stock_entries, 30)
+    for stock in stock_entries:
+        generator.add("stock", stock)
+    generator.flush()
+    generator.add_rollups()
+    yield db
+    mongo.drop_database(os.environ['DB_NAME'])
+    mongo.close()
+
+
+@pytest.fixture(scope="session")
+def api_client(seeded_db):
+    from fastapi.testclient import TestClient
+    import server
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def run_async(api_client):
+    """Run a coroutine function on the app's event loop and return its result"""
+    def run(coroutine_function, *args, **kwargs):
+        return api_client.portal.call(functools.partial(coroutine_function, *args, **kwargs))
+    return run
+
+
+@pytest.fixture
+def query_budget():
+    """Assert that a response stayed within a database command budget"""
+    def check(response, max_commands: int):
+        stats = parse_server_timing(response.headers.get("Server-Timing", ""))
+        path = response.request.url.path
+        assert stats["commands"] <= max_commands, (
+            f"{response.request.method} {path} issued {stats['commands']} database commands "
+            f"(budget {max_commands}, {stats['db_time_ms']}ms)"
+        )
+        return stats
+    return check
@@ -0,0 +1,82 @@
+"""Activity entries are buffered and written in batches."""
+
+import asyncio
+from datetime import datetime
+
+from pymongo.errors import AutoReconnect
+
+import server
+from activity import ActivityLogger
+
+
+class UnreachableCollection:
+    async def insert_many(self, entries, ordered=False):
+        raise AutoReconnect("no primary")
+
+
+def test_failed_flush_keeps_the_newest_entries_up_to_the_cap():
+    activity = ActivityLogger(UnreachableCollection(), max_buffer=3)
+    for i in range(5):
+        activity.log("Scan", "lot", f"cut {i}")
+    assert asyncio.run(activity.flush()) == 0
+    assert activity.pending == 3 and activity.dropped == 2
+
+
+def test_buffered_entries_are_written_with_date_timestamps(seeded_db, run_async):
+    entry = server.activity_logger.log("Return Recorded", "return", "ret-activity")
+    assert seeded_db.activity_logs.find_one({"id": entry["id"]}) is None
+
+    logs = run_async(server.get_activity_logs, limit=5, entity_type="return")
+    assert logs[0]["id"] == entry["id"]
+    assert isinstance(seeded_db.activity_logs.find_one({"id": entry["id"]})["timestamp"], datetime)
+
+
+def test_the_cap_holds_while_the_writer_is_stalled():
+    activity = ActivityLogger(UnreachableCollection(), max_buffer=3)
+    for i in range(5):
+        activity.log("Scan", "lot", f"cut {i}")
+    assert activity.pending == 3 and activity.dropped == 2
+
+
+class BrokenCollection:
+    def __init__(self):
+        self.calls = 0
+
+    async def insert_many(self, entries, ordered=False):
+        self.calls += 1
+        raise ValueError("cannot encode object")
+
+
+def test_an_unexpected_flush_error_does_not_stop_the_writer():
+    collection = BrokenCollection()
+    activity = ActivityLogger(collection, flush_interval=0.01)
+
+    async def run_briefly():
+        task = asyncio.create_task(activity.run())
+        for _ in range(3):
+            activity.log("Scan", "lot", "cut 1")
+            await asyncio.sleep(0.03)
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(run_briefly())
+    assert collection.calls >= 2
+
+
+class SlowCollection:
+    async def insert_many(self, entries, ordered=False):
+        await asyncio.sleep(10)
+
+
+def test_a_flush_cancelled_mid_write_keeps_its_entries():
+    activity = ActivityLogger(SlowCollection())
+    activity.log("Scan", "lot", "cut 1")
+
+    async def cancel_mid_write():
+        task = asyncio.create_task(activity.flush())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel_mid_write())
+    assert activity.pending == 1
@@ -0,0 +1,38 @@
+"""Bulk QR lookups report every scanned code in scan order, unknown and repeated ones in place."""
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_lookup_size_is_limited_and_duplicates_collapse():
+    assert server.validate_bulk_lookup(["a", "b", "a"]) == ["a", "b"]
+    for values in ([], ["x"] * (server.MAX_BULK_LOOKUP + 1)):
+        with pytest.raises(HTTPException) as refused:
+            server.validate_bulk_lookup(values)
+        assert refused.value.status_code == 400
+
+
+def test_stock_by_codes(seeded_db, api_client):
+    first, second = seeded_db.stock.find({"is_active": True}, {"_id": 0, "stock_code": 1}).limit(2)
+    codes = [second["stock_code"], "STK-MISSING", first["stock_code"], second["stock_code"]]
+    body = api_client.post("/api/stock/by-codes", json={"codes": codes}).json()
+    assert (body["total"], body["found"], body["missing"]) == (4, 3, 1)
+    assert [r["stock_code"] for r in body["results"]] == codes
+    assert [r["status"] for r in body["results"]] == ["ok", "not_found", "ok", "ok"]
+    assert [r["duplicate"] for r in body["results"]] == [False, False, False, True]
+    assert "loose_distribution" in body["results"][0]["stock"]
+
+
+def test_lot_by_numbers_matches_the_single_lookup(seeded_db, api_client):
+    first, second = seeded_db.cutting_orders.find({}, {"_id": 0, "cutting_lot_number": 1}).limit(2)
+    lots = [second["cutting_lot_number"], "cut missing", first["cutting_lot_number"], second["cutting_lot_number"]]
+    body = api_client.post("/api/lot/by-numbers", json={"lot_numbers": lots}).json()
+    assert (body["total"], body["found"], body["missing"]) == (4, 3, 1)
+    assert [r["lot_number"] for r in body["results"]] == lots
+    assert [r["status"] for r in body["results"]] == ["ok", "not_found", "ok", "ok"]
+    assert [r["duplicate"] for r in body["results"]] == [False, False, False, True]
+    single = api_client.get(f"/api/lot/by-number/{first['cutting_lot_number']}").json()
+    assert body["results"][2]["stage"] == single["stage"]
+    assert body["results"][2]["order"]["id"] == single["order"]["id"]
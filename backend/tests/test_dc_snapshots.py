@@ -0,0 +1,56 @@
+"""Issued DCs are stored snapshots; reprints revalidate and edits need a re-issue."""
+
+import zlib
+
+import server
+
+
+def test_snapshot_is_the_compressed_render_with_a_content_etag():
+    order = {"id": "o1", "dc_number": "DC-0001", "unit_name": "Unit A", "operation_type": "Printing",
+             "dc_date": "2026-01-05T00:00:00+00:00", "cutting_lot_number": "cut 001", "category": "Kids",
+             "style_type": "T-Shirt", "lot_number": "FL-001", "size_distribution": {"M": 10}, "rate_per_pcs": 2.0,
+             "total_quantity": 10, "total_amount": 20.0, "lot_details": []}
+    snapshot = server.dc_snapshot("outsourcing", order, issued_by="admin")
+    html = zlib.decompress(snapshot["html"])
+    assert html == server.render_outsourcing_dc(order).encode("utf-8")
+    assert snapshot["etag"] == server.content_etag(html)
+    assert (snapshot["dc_number"], snapshot["version"], snapshot["html_size"]) == ("DC-0001", 1, len(html))
+
+
+def test_if_none_match_parsing():
+    assert server.etag_matches('"a", "b"', '"b"')
+    assert server.etag_matches("*", '"b"')
+    assert not server.etag_matches(None, '"b"')
+    assert not server.etag_matches('"a"', '"b"')
+
+
+def test_reprint_revalidates_and_reissue_adds_a_version(seeded_db, api_client, run_async):
+    order = seeded_db.outsourcing_orders.find_one({}, {"_id": 0})
+    first = api_client.get(f"/api/outsourcing-orders/{order['id']}/dc")
+    assert first.status_code == 200 and order["dc_number"] in first.text
+    etag = first.headers["ETag"]
+    assert api_client.get(f"/api/outsourcing-orders/{order['id']}/dc",
+                          headers={"If-None-Match": etag}).status_code == 304
+
+    # Editing the order does not touch what was issued
+    seeded_db.outsourcing_orders.update_one({"id": order["id"]}, {"$set": {"unit_name": "Renamed Unit"}})
+    assert api_client.get(f"/api/outsourcing-orders/{order['id']}/dc").headers["ETag"] == etag
+
+    reissued = run_async(server.reissue_dc, "outsourcing", order["id"], server.DCReissue(reason="unit renamed"),
+                         {"role": "admin", "username": "admin"})
+    assert reissued["version"] == 2 and reissued["etag"] != etag
+    latest = api_client.get(f"/api/outsourcing-orders/{order['id']}/dc")
+    assert "Renamed Unit" in latest.text and latest.headers["X-DC-Version"] == "2"
+    versions = api_client.get(f"/api/dc-snapshots/{order['dc_number']}").json()
+    assert [v["version"] for v in versions] == [2, 1]
+
+
+def test_dcs_sharing_a_number_each_keep_their_own_snapshot(seeded_db, api_client):
+    first, second = seeded_db.outsourcing_orders.find({}, {"_id": 0}).skip(1).limit(2)
+    # Scan DCs are numbered to the second, so two DCs can share a number
+    seeded_db.outsourcing_orders.update_one({"id": second["id"]}, {"$set": {"dc_number": first["dc_number"]}})
+    for order in (first, second):
+        assert api_client.get(f"/api/outsourcing-orders/{order['id']}/dc").status_code == 200
+    versions = api_client.get(f"/api/dc-snapshots/{first['dc_number']}").json()
+    assert sorted(v["order_id"] for v in versions) == sorted([first["id"], second["id"]])
+    assert api_client.get(f"/api/dc-snapshots/outsourcing/{second['id']}/versions/1").status_code == 200
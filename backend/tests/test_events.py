@@ -0,0 +1,84 @@
+"""In-process event bus and SSE framing."""
+
+import json
+
+import server
+from events import EventBus, SUBSCRIBER_QUEUE_SIZE, event_keys, format_sse
+
+
+def test_publish_reaches_only_matching_topics():
+    bus = EventBus()
+    notifications = bus.subscribe({"notifications"})
+    everything = bus.subscribe()
+
+    bus.publish("notifications", {"title": "Low Stock Alert"}, "notification")
+    bus.publish("stock", {"stock_code": "STK-0001"})
+
+    assert notifications.queue.qsize() == 1
+    assert everything.queue.qsize() == 2
+
+
+def test_slow_subscriber_drops_oldest_events():
+    bus = EventBus()
+    subscription = bus.subscribe()
+    for i in range(SUBSCRIBER_QUEUE_SIZE + 3):
+        bus.publish("stock", {"n": i})
+
+    assert subscription.dropped == 3
+    assert subscription.queue.get_nowait()["data"]["n"] == 3
+
+
+def test_closed_subscription_stops_receiving():
+    bus = EventBus()
+    with bus.subscribe() as subscription:
+        assert bus.subscriber_count == 1
+    assert bus.subscriber_count == 0
+    bus.publish("stock", {})
+    assert subscription.queue.empty()
+
+
+def test_sse_frame():
+    event = EventBus().publish("notifications", {"title": "Out of Stock"}, "notification")
+    frame = format_sse(event)
+
+    assert frame.startswith(f"id: {event['id']}\nevent: notification\ndata: ")
+    assert frame.endswith("\n\n")
+    payload = json.loads(frame.split("data: ", 1)[1])
+    assert payload["title"] == "Out of Stock"
+    assert payload["_topic"] == "notifications"
+
+
+def test_key_filters_follow_one_entity():
+    bus = EventBus()
+    one_lot = bus.subscribe({"lot"}, {"lot": "cut 002"})
+    one_unit = bus.subscribe(None, {"unit": "Stitching Unit 1"})
+
+    bus.publish("lot", {}, "sent_to_outsourcing", event_keys(lot="cut 001, cut 002", unit="Stitching Unit 1"))
+    bus.publish("lot", {}, "cut", event_keys(lot="cut 003"))
+    bus.publish("stock", {}, "stock_created", event_keys(lot="cut 002", stock_code="STK-0001"))
+
+    assert one_lot.queue.qsize() == 1
+    assert one_unit.queue.qsize() == 1
+
+
+def test_event_keys_split_joined_lot_numbers():
+    assert event_keys(lot="cut 001, cut 002", stock_code=["STK-0002", "STK-0001", None]) == {
+        "lot": ["cut 001", "cut 002"],
+        "stock_code": ["STK-0001", "STK-0002"]
+    }
+
+
+def test_inactive_stock_is_still_alerted_on(seeded_db, api_client):
+    stock = seeded_db.stock.find_one({}, {"_id": 0, "id": 1})
+    seeded_db.stock.update_one({"id": stock["id"]}, {"$set": {"is_active": False, "available_quantity": 0}})
+    seeded_db.system_meta.delete_many({"type": "notification_engine"})
+    notifications = api_client.get("/api/dashboard/notifications").json()["notifications"]
+    assert any(n["dedup_key"] == f"out_of_stock:{stock['id']}" for n in notifications)
+
+
+def test_deleted_stock_reaches_subscribers_of_its_stock_code(seeded_db, api_client):
+    stock = seeded_db.stock.find_one({"is_active": True}, {"_id": 0, "id": 1, "stock_code": 1})
+    with server.bus.subscribe({"stock"}, {"stock_code": stock["stock_code"]}) as subscription:
+        assert api_client.delete(f"/api/stock/{stock['id']}").status_code == 200
+        assert subscription.queue.get_nowait()["data"]["stock_code"] == stock["stock_code"]
+    assert api_client.delete(f"/api/stock/{stock['id']}").status_code == 404
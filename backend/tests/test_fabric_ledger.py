@@ -0,0 +1,66 @@
+"""Fabric draws are guarded and ledgered (needs MongoDB)."""
+
+import asyncio
+import uuid
+
+import server
+
+
+def test_concurrent_draws_cannot_oversell_a_lot(seeded_db, run_async):
+    lot_id = str(uuid.uuid4())
+    seeded_db.fabric_lots.insert_one({
+        "id": lot_id, "lot_number": "LOT-TEST", "remaining_quantity": 100.0, "remaining_rib_quantity": 10.0
+    })
+
+    async def draw(n):
+        return await server.adjust_fabric_lot(
+            lot_id, 60, 0, "draw", {"id": f"co-{n}", "cutting_lot_number": f"cut {n}"})
+
+    async def draw_twice():
+        return await asyncio.gather(draw(1), draw(2))
+
+    results = run_async(draw_twice)
+    assert sum(1 for lot in results if lot) == 1
+    lot = seeded_db.fabric_lots.find_one({"id": lot_id})
+    assert lot["remaining_quantity"] == 40.0
+    ledger = list(seeded_db.fabric_consumption.find({"fabric_lot_id": lot_id}))
+    assert len(ledger) == 1 and ledger[0]["fabric_kg"] == 60
+
+
+def make_cut_lot(seeded_db):
+    lot_id, order_id = str(uuid.uuid4()), str(uuid.uuid4())
+    seeded_db.fabric_lots.insert_one({"id": lot_id, "lot_number": "LOT-EDIT", "remaining_quantity": 50.0,
+                                      "remaining_rib_quantity": 5.0, "rate_per_kg": 100})
+    seeded_db.cutting_orders.insert_one({
+        "id": order_id, "cutting_lot_number": f"cut edit {order_id[:8]}", "fabric_lot_id": lot_id,
+        "fabric_taken": 50.0, "fabric_returned": 0.0, "fabric_used": 50.0,
+        "rib_taken": 5.0, "rib_returned": 0.0, "rib_used": 5.0, "total_quantity": 100, "cutting_rate_per_pcs": 1
+    })
+    return lot_id, order_id
+
+
+def test_concurrent_edits_cannot_both_adjust_the_lot(seeded_db, run_async):
+    lot_id, order_id = make_cut_lot(seeded_db)
+
+    async def edit_twice():
+        return await asyncio.gather(
+            server.update_cutting_order(order_id, server.CuttingOrderUpdate(fabric_returned=10.0)),
+            server.update_cutting_order(order_id, server.CuttingOrderUpdate(fabric_returned=20.0)),
+            return_exceptions=True)
+
+    results = run_async(edit_twice)
+    assert sum(1 for r in results if isinstance(r, server.HTTPException) and r.status_code == 409) <= 1
+    order = seeded_db.cutting_orders.find_one({"id": order_id})
+    assert seeded_db.fabric_lots.find_one({"id": lot_id})["remaining_quantity"] == 100.0 - order["fabric_used"]
+
+
+def test_concurrent_deletes_release_the_fabric_once(seeded_db, run_async):
+    lot_id, order_id = make_cut_lot(seeded_db)
+
+    async def delete_twice():
+        return await asyncio.gather(server.delete_cutting_order(order_id), server.delete_cutting_order(order_id),
+                                    return_exceptions=True)
+
+    results = run_async(delete_twice)
+    assert sum(1 for r in results if isinstance(r, server.HTTPException) and r.status_code == 404) == 1
+    assert seeded_db.fabric_lots.find_one({"id": lot_id})["remaining_quantity"] == 100.0
@@ -0,0 +1,32 @@
+"""Fabric rolls are tracked one record per roll (needs MongoDB)."""
+
+import server
+
+
+def test_scanned_roll_resolves_to_its_lot(seeded_db, run_async):
+    lot = seeded_db.fabric_lots.find_one({}, {"_id": 0})
+    roll = run_async(server.get_fabric_roll, lot["roll_numbers"][0])
+    assert roll["fabric_lot_id"] == lot["id"]
+    assert roll["status"] == "in_stock"
+    assert roll["weight"] == lot["roll_weights"][0]
+
+
+def test_roll_cannot_be_claimed_twice(seeded_db, run_async):
+    lot = seeded_db.fabric_lots.find_one({"roll_numbers.1": {"$exists": True}}, {"_id": 0})
+    roll_number = lot["roll_numbers"][1]
+
+    async def claim_twice():
+        await server.claim_fabric_rolls(lot, [roll_number], {"status": "consumed", "consumed_by": "co-1"})
+        try:
+            await server.claim_fabric_rolls(lot, [roll_number], {"status": "returned", "return_id": "ret-1"})
+        except server.HTTPException as exc:
+            return exc
+
+    error = run_async(claim_twice)
+    assert error is not None and error.status_code == 400
+    roll = seeded_db.fabric_rolls.find_one({"roll_number": roll_number, "fabric_lot_id": lot["id"]})
+    assert roll["status"] == "consumed" and roll["consumed_by"] == "co-1"
+
+    run_async(server.release_fabric_rolls, {"consumed_by": "co-1"})
+    roll = seeded_db.fabric_rolls.find_one({"roll_number": roll_number, "fabric_lot_id": lot["id"]})
+    assert roll["status"] == "in_stock" and roll["consumed_by"] is None
@@ -0,0 +1,29 @@
+"""Lot lineage IDs link each stage to the next (needs MongoDB for the lookups)."""
+
+import server
+
+
+def test_dc_cutting_ids_fall_back_to_the_single_id():
+    assert server.order_cutting_ids({"cutting_order_ids": ["a", "b"], "cutting_order_id": "a"}) == ["a", "b"]
+    assert server.order_cutting_ids({"cutting_order_id": "a"}) == ["a"]
+    assert server.order_cutting_ids({}) == []
+
+
+def test_stitching_receipt_is_found_through_lineage(seeded_db, run_async):
+    cutting_order = seeded_db.cutting_orders.find_one({"ironing_order_id": {"$ne": None}}, {"_id": 0})
+    ironing = seeded_db.ironing_orders.find_one({"id": cutting_order["ironing_order_id"]}, {"_id": 0})
+    stitching, receipt = run_async(server.find_stitching_receipt, cutting_order)
+    assert stitching["id"] == ironing["outsourcing_order_id"]
+    assert receipt["id"] == ironing["receipt_id"]
+
+
+def test_backfill_restores_ironing_and_stock_lineage(seeded_db, run_async):
+    stock = seeded_db.stock.find_one({"source_ironing_receipt_id": {"$exists": True}, "ironing_order_id": {"$ne": None}},
+                                     {"_id": 0})
+    ironing = seeded_db.ironing_orders.find_one({"id": stock["ironing_order_id"]}, {"_id": 0})
+    seeded_db.stock.update_one({"id": stock["id"]}, {"$set": {"ironing_order_id": None}, "$unset": {"cutting_order_ids": ""}})
+    seeded_db.ironing_orders.update_one({"id": ironing["id"]}, {"$unset": {"cutting_order_ids": ""}})
+    run_async(server.backfill_lot_lineage)
+    assert seeded_db.ironing_orders.find_one({"id": ironing["id"]})["cutting_order_ids"] == ironing["cutting_order_ids"]
+    restored = seeded_db.stock.find_one({"id": stock["id"]})
+    assert (restored["ironing_order_id"], restored["cutting_order_ids"]) == (ironing["id"], ironing["cutting_order_ids"])
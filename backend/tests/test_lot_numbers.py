@@ -0,0 +1,34 @@
+"""Lot keys of outsourcing orders, and the backfill that gives older orders their lot array."""
+
+import server
+from server import lot_numbers_query, order_lot_numbers
+
+
+def test_multi_lot_orders_list_every_lot():
+    assert order_lot_numbers({"cutting_lot_numbers": ["cut 001", "cut 002"],
+                              "cutting_lot_number": "cut 001, cut 002"}) == ["cut 001", "cut 002"]
+
+
+def test_legacy_orders_fall_back_to_lot_details_then_the_joined_string():
+    legacy = {"cutting_lot_number": "cut 001, cut 002",
+              "lot_details": [{"cutting_lot_number": "cut 001"}, {"cutting_lot_number": "cut 002"}]}
+    assert order_lot_numbers(legacy) == ["cut 001", "cut 002"]
+    assert order_lot_numbers({"cutting_lot_number": "cut 001, cut 002", "cutting_lot_numbers": []}) == ["cut 001", "cut 002"]
+    assert order_lot_numbers({"cutting_lot_number": "cut 007"}) == ["cut 007"]
+    assert order_lot_numbers({}) == []
+
+
+def test_queries_match_inside_the_lot_array():
+    assert lot_numbers_query("cut 001") == {"cutting_lot_numbers": "cut 001"}
+    assert lot_numbers_query(["cut 001", "cut 002"]) == {"cutting_lot_numbers": {"$in": ["cut 001", "cut 002"]}}
+
+
+def test_orders_without_the_lot_array_are_backfilled_at_startup(seeded_db, api_client, run_async):
+    order = seeded_db.outsourcing_orders.find_one({"cutting_lot_numbers.0": {"$exists": True}}, {"_id": 0})
+    lot = order["cutting_lot_numbers"][0]
+    seeded_db.outsourcing_orders.update_one({"id": order["id"]}, {"$unset": {"cutting_lot_numbers": ""}})
+    seeded_db.system_meta.delete_many({"type": "migration:cutting-lot-numbers"})
+    run_async(server.ensure_cutting_lot_numbers)
+    assert seeded_db.outsourcing_orders.find_one({"id": order["id"]})["cutting_lot_numbers"] == order["cutting_lot_numbers"]
+    assert seeded_db.system_meta.find_one({"type": "migration:cutting-lot-numbers"})["run_by"] == "startup"
+    assert api_client.get(f"/api/lot/by-number/{lot}").status_code == 200
@@ -0,0 +1,50 @@
+"""Lot stage is persisted on the cutting order (WIP board needs MongoDB)."""
+
+import server
+
+
+def test_stage_fields_follow_the_latest_dc():
+    dcs = [{"operation_type": "Printing", "status": "Received", "unit_name": "P1"},
+           {"operation_type": "Stitching", "status": "Partial", "unit_name": "S1"}]
+    fields = server.lot_stage_fields(dcs, None, None)
+    assert fields["stage"] == "outsourcing" and fields["current_unit"] == "S1"
+    assert fields["received_operations"] == ["Printing"] and not fields["stitching_completed"]
+
+    ironing = {"status": "Sent", "unit_name": "I1"}
+    dcs[1]["status"] = "Received"
+    fields = server.lot_stage_fields(dcs, ironing, None)
+    assert fields["stage"] == "ironing" and fields["current_unit"] == "I1"
+    assert fields["stitching_completed"] and fields["sent_to_ironing"]
+
+
+def test_stage_never_moves_back_past_a_later_stage():
+    writes = server.lot_stage_writes(["co-1"], "received", None, {"$addToSet": {"received_operations": "Stitching"}})
+    assert writes[0][0] == {"id": {"$in": ["co-1"]}}
+    assert writes[1][0]["stage"] == {"$in": ["cutting", "outsourcing", "received", None]}
+    assert server.lot_stage_writes([], "stock") == []
+
+
+def test_wip_board_matches_the_cutting_orders(seeded_db, run_async):
+    board = run_async(server.get_wip_board)
+    in_progress = list(seeded_db.cutting_orders.find({"stage": {"$ne": "stock"}}, {"total_quantity": 1}))
+    assert board["total_lots"] == len(in_progress)
+    assert board["total_pieces"] == sum(order["total_quantity"] for order in in_progress)
+
+
+def test_cutting_report_badges_for_lots_without_a_stage():
+    staged = {"cutting_lot_number": "cut 001", "stage": "ironing", "completed_operations": ["Stitching"],
+              "received_operations": ["Stitching"]}
+    legacy = {"cutting_lot_number": "cut 002"}
+    lot_status = {"cut 002": {"outsourcing": [{"operation": "Printing", "status": "Sent"}], "ironing": {"status": "Received"}}}
+    html = server.generate_cutting_rows([staged, legacy], lot_status)
+    assert "Stitching (Received)" in html and "Ironing (Sent)" in html
+    assert "Printing (Sent)" in html and "Ironing (Received)" in html
+
+
+def test_lots_without_a_stage_are_backfilled_at_startup(seeded_db, run_async):
+    order = seeded_db.cutting_orders.find_one({"stage": {"$in": server.WIP_STAGES}}, {"_id": 0, "id": 1, "stage": 1})
+    seeded_db.cutting_orders.update_one({"id": order["id"]}, {"$unset": {"stage": ""}})
+    seeded_db.system_meta.delete_many({"type": "migration:lot-stages"})
+    run_async(server.ensure_lot_stages)
+    assert seeded_db.cutting_orders.find_one({"id": order["id"]})["stage"] == order["stage"]
+    assert seeded_db.system_meta.find_one({"type": "migration:lot-stages"})["run_by"] == "startup"
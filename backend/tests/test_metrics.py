@@ -0,0 +1,41 @@
+"""Metric primitives and the /metrics endpoint."""
+
+from metrics import Counter, Histogram, render_metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(5.0, route="/a")
+
+    lines = list(histogram.render())
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{route="/a"} 3' in lines
+
+
+def test_counter_escapes_label_values():
+    counter = Counter("test_events_total", "Test events", ("name",))
+    counter.inc(name='say "hi"')
+    counter.inc(2, name='say "hi"')
+    assert 'test_events_total{name="say \\"hi\\""} 3' in render_metrics()
+
+
+def test_metrics_endpoint_uses_templated_routes():
+    from fastapi.testclient import TestClient
+    import server
+
+    client = TestClient(server.app)
+    client.get("/api/no-such-route")
+    # Refused by the auth dependency before any database read, after routing
+    client.get("/api/admin/profiles/profile-1234")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'route="unmatched"' in response.text
+    assert 'route="/api/admin/profiles/{profile_id}"' in response.text
+    assert "profile-1234" not in response.text
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert "http_requests_in_flight" in response.text
@@ -0,0 +1,61 @@
+"""Vectorised pack breakdown agrees with the per-document calculation; dispatches keep stock consistent."""
+
+import random
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import AutoReconnect
+
+from packs import batch_pack_breakdown
+import server
+from server import calculate_master_packs, pack_breakdown
+
+
+def test_batch_matches_calculate_master_packs():
+    rng = random.Random(7)
+    sizes = ["S", "M", "L", "XL", "XXL"]
+    entries = []
+    for _ in range(500):
+        distribution = {size: rng.randint(0, 40) for size in rng.sample(sizes, rng.randint(0, 5))}
+        ratio = {size: rng.randint(0, 3) for size in rng.sample(sizes, rng.randint(0, 5))}
+        entries.append((distribution, ratio))
+
+    for (distribution, ratio), result in zip(entries, batch_pack_breakdown(entries)):
+        packs, loose, loose_dist = calculate_master_packs(distribution, ratio)
+        assert result == {"complete_packs": packs, "loose_pieces": loose, "loose_distribution": loose_dist}
+        assert result == pack_breakdown(distribution, ratio)
+
+
+def test_empty_batch():
+    assert batch_pack_breakdown([]) == []
+
+
+def test_a_refused_dispatch_puts_back_the_items_already_taken(seeded_db, run_async):
+    first, second = seeded_db.stock.find({"available_quantity": {"$gt": 0}}, {"_id": 0}).limit(2)
+    size = next(size for size, qty in first["size_distribution"].items() if qty > 0)
+    dispatch = server.BulkDispatchCreate(dispatch_date="2026-03-01T00:00:00+00:00", customer_name="Zudio", bora_number="B1", items=[
+        {"stock_id": first["id"], "loose_pcs": {size: 1}},
+        {"stock_id": second["id"], "loose_pcs": {size: second["available_quantity"] + 1}},
+    ])
+    with pytest.raises(HTTPException) as refused:
+        run_async(server.create_bulk_dispatch, dispatch, {"username": "admin", "role": "admin"})
+    assert refused.value.status_code == 400
+    after = seeded_db.stock.find_one({"id": first["id"]}, {"_id": 0})
+    assert after["available_quantity"] == first["available_quantity"]
+    assert after["size_distribution"] == first["size_distribution"]
+
+
+class LostInsert:
+    async def insert_one(self, doc):
+        raise AutoReconnect("connection lost")
+
+
+def test_a_dispatch_that_cannot_be_recorded_puts_its_stock_back(seeded_db, run_async, monkeypatch):
+    stock = seeded_db.stock.find_one({"available_quantity": {"$gt": 0}}, {"_id": 0})
+    size = next(size for size, qty in stock["size_distribution"].items() if qty > 0)
+    dispatch = server.BulkDispatchCreate(dispatch_date="2026-03-01T00:00:00+00:00", customer_name="Zudio", bora_number="B2",
+                                         items=[{"stock_id": stock["id"], "loose_pcs": {size: 1}}])
+    monkeypatch.setattr(server.db, "bulk_dispatches", LostInsert(), raising=False)
+    with pytest.raises(AutoReconnect):
+        run_async(server.create_bulk_dispatch, dispatch, {"username": "admin", "role": "admin"})
+    assert seeded_db.stock.find_one({"id": stock["id"]}, {"_id": 0})["available_quantity"] == stock["available_quantity"]
@@ -0,0 +1,48 @@
+"""Dispatch allocation planning (no database needed)."""
+
+from planner import plan_pack_count, plan_size_mix
+from server import with_master_packs
+
+RATIO = {"M": 1, "L": 1, "XL": 1}
+
+
+def stock(code, created_at, sizes, ratio=RATIO):
+    return with_master_packs({
+        "id": code, "stock_code": code, "lot_number": code, "created_at": created_at,
+        "size_distribution": sizes, "master_pack_ratio": ratio
+    })
+
+
+CANDIDATES = [
+    stock("STK-1", "2024-01-01", {"M": 30, "L": 30, "XL": 30}),
+    stock("STK-2", "2024-02-01", {"M": 120, "L": 120, "XL": 125}),
+    stock("STK-3", "2024-03-01", {"M": 80, "L": 80, "XL": 80}),
+]
+
+
+def test_single_entry_that_covers_the_order_is_preferred_oldest_first():
+    lines, short = plan_pack_count(CANDIDATES, 25)
+    assert short == 0
+    assert [(line["stock_code"], line["master_packs"]) for line in lines] == [("STK-1", 25)]
+
+
+def test_large_orders_touch_as_few_entries_as_possible():
+    lines, short = plan_pack_count(CANDIDATES, 150)
+    assert short == 0
+    # STK-2 is the largest; the oldest entry that can finish the remaining 30 packs is STK-1
+    assert [(line["stock_code"], line["master_packs"]) for line in lines] == [("STK-1", 30), ("STK-2", 120)]
+
+
+def test_shortfall_is_reported():
+    _, short = plan_pack_count(CANDIDATES, 1000)
+    assert short == 1000 - 230
+
+
+def test_size_mix_uses_packs_then_loose_pieces():
+    lines, short = plan_size_mix(CANDIDATES, {"M": 10, "L": 10, "XL": 14})
+    assert short == {}
+    assert len(lines) == 1
+    line = lines[0]
+    assert line["stock_code"] == "STK-1"
+    assert line["master_packs"] == 10 and line["loose_pcs"] == {"XL": 4}
+    assert line["total_quantity"] == 34
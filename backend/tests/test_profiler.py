@@ -0,0 +1,26 @@
+"""Stack sampler used by the admin request profiler."""
+
+import time
+
+from profiler import StackSampler
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampler_collects_folded_stacks_for_calling_thread():
+    sampler = StackSampler(interval=0.001).start()
+    busy_wait(0.1)
+    sampler.stop()
+
+    assert sampler.samples > 0
+    assert any("busy_wait (test_profiler.py" in stack for stack in sampler.stacks)
+    for line in sampler.folded().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+    top = sampler.top_functions()
+    assert top[0]["cumulative_samples"] >= top[-1]["cumulative_samples"]
@@ -0,0 +1,96 @@
+"""
+Database command budgets per endpoint and the accounting behind them.
+
+Budgets are checked against the Server-Timing header written by the query
+accounting middleware; raise a budget only together with the change that
+needs it.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from db_monitor import (
+    CommandAccountingListener, begin_request, end_request, parse_server_timing, REPEAT_THRESHOLD
+)
+
+ENDPOINT_QUERY_BUDGETS = {
+    "/api/fabric-lots": 3,
+    "/api/cutting-orders": 3,
+    "/api/outsourcing-orders": 3,
+    "/api/ironing-orders": 3,
+    "/api/stock": 3,
+    "/api/bulk-dispatches": 3,
+    "/api/dashboard/stats": 20,
+    "/api/dashboard/notifications": 15,
+    "/api/outsourcing-orders/overdue/reminders": 3,
+}
+
+
+@pytest.mark.parametrize("path,budget", sorted(ENDPOINT_QUERY_BUDGETS.items()))
+def test_endpoint_query_budget(api_client, query_budget, path, budget):
+    response = api_client.get(path)
+    assert response.status_code == 200
+    query_budget(response, budget)
+
+
+def _event(name, collection, request_id, reply=None, duration=1500):
+    return SimpleNamespace(
+        command_name=name,
+        command={name: collection},
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+        duration_micros=duration,
+        reply=reply or {}
+    )
+
+
+def test_listener_accounts_commands_to_current_request():
+    listener = CommandAccountingListener()
+    stats, token = begin_request(trace=True)
+    try:
+        listener.started(_event("find", "stock", 1))
+        listener.succeeded(_event("find", "stock", 1, reply={"cursor": {"firstBatch": [{}, {}, {}]}}))
+        listener.started(_event("getMore", "stock", 2))
+        listener.succeeded(_event("getMore", "stock", 2, reply={"cursor": {"nextBatch": [{}]}}))
+        listener.started(_event("insert", "activity_logs", 3))
+        listener.failed(_event("insert", "activity_logs", 3))
+    finally:
+        end_request(token)
+
+    assert stats.commands == 3
+    assert stats.docs_returned == 4
+    assert stats.failures == 1
+    assert stats.duration_ms == pytest.approx(4.5)
+    assert [entry["collection"] for entry in stats.trace] == ["stock", "stock", "activity_logs"]
+
+
+def test_listener_ignores_commands_outside_a_request():
+    listener = CommandAccountingListener()
+    stats, token = begin_request()
+    end_request(token)
+    listener.started(_event("find", "stock", 1))
+    listener.succeeded(_event("find", "stock", 1))
+    assert stats.commands == 0
+
+
+def test_repeated_commands_are_flagged():
+    listener = CommandAccountingListener()
+    stats, token = begin_request()
+    try:
+        for request_id in range(REPEAT_THRESHOLD):
+            listener.started(_event("find", "outsourcing_receipts", request_id))
+            listener.succeeded(_event("find", "outsourcing_receipts", request_id))
+    finally:
+        end_request(token)
+    assert stats.repeated_commands() == [
+        {"command": "find", "collection": "outsourcing_receipts", "count": REPEAT_THRESHOLD}
+    ]
+
+
+def test_server_timing_round_trip():
+    stats, token = begin_request()
+    end_request(token)
+    stats.finished("k", 2500, 12)
+    parsed = parse_server_timing(stats.server_timing())
+    assert parsed == {"db_time_ms": 2.5, "commands": 1, "docs": 12}
@@ -0,0 +1,43 @@
+"""Receipt kernel agrees with the per-receipt shortage and debit calculation."""
+
+import random
+
+from receipts import batch_receipt_totals, receipt_totals
+
+
+def reference(sent, received, mistakes, rate):
+    shortage = {size: qty - received.get(size, 0) for size, qty in sent.items() if qty - received.get(size, 0) > 0}
+    total_shortage = sum(shortage.values())
+    total_mistakes = sum((mistakes or {}).values())
+    return {
+        "shortage_distribution": shortage,
+        "total_sent": sum(sent.values()),
+        "total_received": sum(received.values()),
+        "total_shortage": total_shortage,
+        "total_mistakes": total_mistakes,
+        "shortage_debit_amount": round(total_shortage * rate, 2),
+        "mistake_debit_amount": round(total_mistakes * rate, 2),
+    }
+
+
+def test_batch_matches_the_per_receipt_calculation():
+    rng = random.Random(11)
+    sizes = ["S", "M", "L", "XL", "XXL", "3XL"]
+    rows = []
+    for _ in range(300):
+        sent = {size: rng.randint(0, 60) for size in rng.sample(sizes, rng.randint(0, 6))}
+        # Over-returns, sizes that were never sent and missing mistake maps all occur in practice
+        received = {size: max(0, qty - rng.randint(-2, 5)) for size, qty in sent.items()}
+        if rng.random() < 0.1:
+            received[rng.choice(sizes)] = rng.randint(1, 5)
+        mistakes = {size: rng.randint(0, 3) for size in rng.sample(sizes, rng.randint(0, 2))} if rng.random() < 0.5 else None
+        rows.append((sent, received, mistakes, round(rng.uniform(0.5, 14), 2)))
+
+    for row, result in zip(rows, batch_receipt_totals(rows)):
+        assert result == reference(*row)
+        assert list(result["shortage_distribution"]) == [size for size in row[0] if size in result["shortage_distribution"]]
+
+
+def test_single_and_empty():
+    assert receipt_totals({"M": 10}, {"M": 7}, {"M": 1}, 2.5)["shortage_debit_amount"] == 7.5
+    assert batch_receipt_totals([]) == []
@@ -0,0 +1,16 @@
+"""Lazy rendering imports and the PNG renderers."""
+
+from bench_startup import run_once
+from rendering import qr_png, code128_png
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def test_server_import_does_not_load_rendering_libraries():
+    result = run_once()
+    assert not {"qrcode", "barcode", "PIL"} & set(result["heavy_loaded"])
+
+
+def test_renderers_produce_png():
+    assert qr_png('{"type": "lot", "lot": "cut 001"}').startswith(PNG_SIGNATURE)
+    assert code128_png("lot 001").startswith(PNG_SIGNATURE)
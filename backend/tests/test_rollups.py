@@ -0,0 +1,67 @@
+"""Daily rollups: per-document deltas, and period totals that match the source collections."""
+
+import calendar
+
+from rollups import rollup_delta, rollup_updates
+
+
+def test_editing_a_dc_moves_its_totals_between_buckets():
+    old = {"dc_date": "2026-03-01T00:00:00+00:00", "category": "Kids", "style_type": "Polo", "unit_name": "A",
+           "total_quantity": 100, "total_amount": 250.1}
+    new = {**old, "dc_date": "2026-03-02T09:30:00+00:00", "total_quantity": 120, "total_amount": 300.12}
+    delta = rollup_delta("outsourcing", old, new)
+    assert delta[("2026-03-01", "Kids", "Polo", "A")] == {"outsourcing_dcs": -1, "outsourcing_sent": -100,
+                                                           "outsourcing_cost": -250.1}
+    assert delta[("2026-03-02", "Kids", "Polo", "A")] == {"outsourcing_dcs": 1, "outsourcing_sent": 120,
+                                                           "outsourcing_cost": 300.12}
+
+
+def test_unchanged_totals_write_nothing():
+    receipt = {"receipt_date": "2026-03-05", "unit_name": "A", "total_received": 90, "total_shortage": 10,
+               "shortage_debit_amount": 0.1 + 0.2, "total_mistakes": 0, "mistake_debit_amount": 0}
+    dc = {"category": "Mens", "style_type": "Polo"}
+    assert rollup_updates(rollup_delta("outsourcing_receipt", receipt, {**receipt, "shortage_debit_amount": 0.3}, dc)) == []
+
+
+def test_scan_ironing_dcs_without_dc_date_count_on_their_sent_date():
+    dc = {"sent_date": "2026-03-04T10:00:00+00:00", "unit_name": "Iron A", "total_quantity": 60, "total_amount": 120.0}
+    assert rollup_delta("ironing", new=dc)[("2026-03-04", "", "", "Iron A")]["ironing_cost"] == 120.0
+
+
+def test_dispatch_items_land_in_their_own_category_and_style():
+    dispatch = {"dispatch_date": "2026-03-07T00:00:00+00:00", "customer_name": "Zudio", "items": [
+        {"category": "Kids", "style_type": "Polo", "total_quantity": 40},
+        {"category": "Kids", "style_type": "Polo", "total_quantity": 10},
+        {"category": "Mens", "style_type": "Hoodie", "total_quantity": 5},
+    ]}
+    buckets = rollup_delta("dispatch", new=dispatch)
+    assert buckets[("2026-03-07", "Kids", "Polo", "Zudio")]["pieces_dispatched"] == 50
+    assert buckets[("2026-03-07", "Mens", "Hoodie", "Zudio")]["pieces_dispatched"] == 5
+
+
+def test_period_summary_matches_the_source_collections(seeded_db, api_client, run_async):
+    import server
+    run_async(server.rebuild_daily_rollups)
+    summary = api_client.get("/api/reports/period-summary", params={"group_by": "month"}).json()
+    totals = summary["totals"]
+    assert totals["pieces_cut"] == sum(o["total_quantity"] for o in seeded_db.cutting_orders.find())
+    assert totals["outsourcing_sent"] == sum(o["total_quantity"] for o in seeded_db.outsourcing_orders.find())
+    assert totals["ironing_shortage"] == sum(r["total_shortage"] for r in seeded_db.ironing_receipts.find())
+    assert totals["pieces_dispatched"] == sum(d["grand_total_quantity"] for d in seeded_db.bulk_dispatches.find())
+    assert sum(row["pieces_cut"] for row in summary["rows"]) == totals["pieces_cut"]
+
+    month = summary["rows"][-1]["month"]
+    last_day = calendar.monthrange(int(month[:4]), int(month[5:]))[1]
+    in_month = api_client.get("/api/reports/period-summary",
+                              params={"start_date": f"{month}-01", "end_date": f"{month}-{last_day}"}).json()
+    assert in_month["totals"]["pieces_cut"] == sum(
+        o["total_quantity"] for o in seeded_db.cutting_orders.find({"cutting_date": {"$regex": f"^{month}"}}))
+
+
+def test_empty_rollups_are_built_at_startup(seeded_db, run_async):
+    import server
+    seeded_db.daily_rollups.delete_many({})
+    run_async(server.ensure_daily_rollups)
+    pieces = sum(r.get("pieces_cut", 0) for r in seeded_db.daily_rollups.find())
+    assert pieces == sum(o["total_quantity"] for o in seeded_db.cutting_orders.find())
+    assert seeded_db.system_meta.find_one({"type": "migration:daily-rollups"})["run_by"] == "startup"
@@ -0,0 +1,128 @@
+"""Batch scan rules applied against in-memory state (no database needed)."""
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import ScanBatchState, ScanOperation, SCAN_HANDLERS
+
+
+def make_state():
+    state = ScanBatchState()
+    cutting_order = {
+        "id": "co-1", "cutting_lot_number": "cut 001", "lot_number": "lot 001", "category": "Mens",
+        "style_type": "Polo", "color": "Navy", "bundle_distribution": {"M": 10, "L": 10}
+    }
+    state.cutting_orders = {"cut 001": cutting_order}
+    state.outsourcing_orders = {"cut 001": [{
+        "id": "oo-1", "dc_number": "DC-1", "cutting_lot_number": "cut 001", "unit_name": "Stitching Unit 1",
+        "operation_type": "Stitching", "size_distribution": {"M": 10, "L": 10}, "total_quantity": 20,
+        "rate_per_pcs": 5, "status": "Sent"
+    }]}
+    state.next_stock_number = 7
+    return state
+
+
+def apply(state, **fields):
+    op = ScanOperation(**fields)
+    return SCAN_HANDLERS[op.op](state, op)
+
+
+def test_ironing_requires_received_stitching():
+    state = make_state()
+    with pytest.raises(HTTPException) as error:
+        apply(state, op="create_ironing", lot_number="cut 001", unit_name="Ironing Unit 1")
+    assert error.value.status_code == 400
+
+
+def test_receive_then_iron_then_stock_in_one_batch():
+    state = make_state()
+    received = apply(state, op="receive_outsourcing", lot_number="cut 001", received_distribution={"M": 10, "L": 9})
+    assert received["shortage"] == 1
+
+    # Partial receipts do not complete stitching
+    with pytest.raises(HTTPException):
+        apply(state, op="create_ironing", lot_number="cut 001", unit_name="Ironing Unit 1")
+
+    state.outsourcing_orders["cut 001"][0]["status"] = "Received"
+    ironing = apply(state, op="create_ironing", lot_number="cut 001", unit_name="Ironing Unit 1",
+                    master_pack_ratio={"M": 1, "L": 1}, rate_per_pcs=2)
+    assert state.inserts["ironing_orders"][0]["size_distribution"] == {"M": 10, "L": 9}
+    assert ironing["dc_number"].startswith("IR-")
+
+    stocked = apply(state, op="receive_ironing", lot_number="cut 001", received_distribution={"M": 10, "L": 9})
+    assert stocked["stock_code"] == "STK-0007"
+    assert stocked["complete_packs"] == 9
+    assert state.next_stock_number == 8
+    assert [e[1] for e in state.events] == ["outsourcing_received", "sent_to_ironing", "ironing_received", "stock_created"]
+
+
+def test_send_rejects_lot_already_out():
+    state = make_state()
+    with pytest.raises(HTTPException) as error:
+        apply(state, op="send_outsourcing", lot_number="cut 001", unit_name="Printing Unit 1", operation_type="Printing")
+    assert error.value.detail == "Lot already sent to outsourcing"
+
+
+def test_batch_dc_numbers_are_distinct():
+    state = ScanBatchState()
+    assert state.next_dc_number("DC") != state.next_dc_number("DC")
+
+
+def test_bad_expected_return_date_is_a_400():
+    with pytest.raises(HTTPException) as error:
+        server.parse_expected_return_date("next tuesday", server.datetime.now(server.timezone.utc))
+    assert error.value.status_code == 400
+
+
+def test_malformed_operation_fails_alone(seeded_db, api_client):
+    lots = [o["cutting_lot_number"] for o in seeded_db.cutting_orders.find({"stage": "cutting"}).limit(2)]
+    response = api_client.post("/api/scan/batch", json={"operations": [
+        {"op": "send_outsourcing", "lot_number": lots[0], "unit_name": "Unit A", "operation_type": "Printing",
+         "expected_return_date": "not a date"},
+        {"op": "send_outsourcing", "lot_number": lots[1], "unit_name": "Unit A", "operation_type": "Printing"},
+    ]})
+    assert response.status_code == 200
+    assert [r["status"] for r in response.json()["results"]] == ["error", "ok"]
+    assert response.json()["results"][0]["status_code"] == 400
+
+
+def test_writes_to_documents_read_before_the_batch_are_guarded():
+    state = make_state()
+    apply(state, op="receive_outsourcing", lot_number="cut 001", received_distribution={"M": 10, "L": 10})
+    apply(state, op="create_ironing", lot_number="cut 001", unit_name="Ironing Unit 1")
+    guards = [(collection, filter_doc) for collection, filter_doc, *_ in state.guards]
+    assert guards == [("outsourcing_orders", {"id": "oo-1", "status": "Sent"}),
+                      ("cutting_orders", {"id": "co-1", "ironing_order_id": None})]
+
+    # The DC the batch creates is not in the database yet, so its receipt is a plain update
+    apply(state, op="receive_ironing", lot_number="cut 001", received_distribution={"M": 10, "L": 10})
+    assert len(state.guards) == 2
+
+
+def test_a_failed_operation_leaves_no_writes_in_the_batch(monkeypatch):
+    state = make_state()
+    state.outsourcing_orders["cut 001"][0]["status"] = "Received"
+
+    def broken_snapshot(*args):
+        raise ValueError("template error")
+
+    monkeypatch.setattr(server, "dc_snapshot", broken_snapshot)
+    checkpoint = state.checkpoint()
+    with pytest.raises(ValueError):
+        apply(state, op="create_ironing", lot_number="cut 001", unit_name="Ironing Unit 1")
+    assert state.inserts["ironing_orders"] and state.guards
+    state.rollback(checkpoint)
+    assert state.inserts["ironing_orders"] == [] and state.guards == [] and state.rollups == {}
+
+
+def test_ironing_follows_the_latest_stitching_dc():
+    state = make_state()
+    first = state.outsourcing_orders["cut 001"][0]
+    first["status"] = "Received"
+    state.outsourcing_orders["cut 001"].append({**first, "id": "oo-2", "dc_number": "DC-2"})
+    state.stitching_receipts = {"oo-1": {"id": "r-1", "received_distribution": {"M": 10, "L": 10}},
+                                "oo-2": {"id": "r-2", "received_distribution": {"M": 8, "L": 10}}}
+    apply(state, op="create_ironing", lot_number="cut 001", unit_name="Ironing Unit 1")
+    ironing = state.inserts["ironing_orders"][0]
+    assert (ironing["outsourcing_order_id"], ironing["receipt_id"], ironing["total_quantity"]) == ("oo-2", "r-2", 18)
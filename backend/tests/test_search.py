@@ -0,0 +1,69 @@
+"""Search key generation and ranking (the paging and backfill tests need MongoDB)."""
+
+from search import (query_terms, rank_results, rank_search_hits, search_filter, search_index_entry, search_keys,
+                    with_search_keys)
+
+
+def test_keys_hold_tokens_prefixes_and_compact_codes():
+    keys = search_keys(["STK-0007", "Navy Blue"])
+    for key in ("stk", "s", "0007", "000", "stk0007", "stk00", "navy", "na", "blue"):
+        assert key in keys
+    assert "avy" not in keys
+
+
+def test_search_input_is_reduced_to_literal_terms():
+    assert query_terms("  Lot.*(12 ") == ["lot", "12"]
+    assert search_filter("navy") == {"search_keys": "navy"}
+    assert search_filter("navy pol") == {"search_keys": {"$all": ["navy", "pol"]}}
+    assert search_filter("$^.*") == {}
+
+
+def test_code_matches_rank_above_attribute_matches():
+    newer = with_search_keys("stock", {"stock_code": "STK-0120", "lot_number": "12", "color": "Red"})
+    older = with_search_keys("stock", {"stock_code": "STK-0012", "lot_number": "88", "color": "Red"})
+    assert "12" in newer["search_keys"] and "0012" in older["search_keys"]
+    ranked = rank_results("stock", [newer, older], "stk 0012")
+    assert ranked[0] is older
+
+
+def test_search_index_entries_are_typed_and_keyed():
+    entry = search_index_entry("bulk_dispatches", {
+        "id": "d-1", "dispatch_number": "DSP-0042", "bora_number": "B-17", "customer_name": "Ravi Traders",
+        "created_at": "2024-05-01T00:00:00+00:00"
+    })
+    assert entry["type"] == "dispatch" and entry["code"] == "DSP-0042"
+    assert entry["detail"] == "Ravi Traders · B-17"
+    assert {"b17", "17", "ravi", "dsp00"} <= set(entry["keys"])
+
+
+def test_exact_code_hits_rank_first():
+    hits = [
+        {"code": "DC-20240501-0120", "type": "outsourcing_dc"},
+        {"code": "lot 12", "type": "lot"},
+        {"code": "STK-0012", "type": "stock"},
+    ]
+    assert rank_search_hits(hits, "12")[0]["code"] == "lot 12"
+    assert rank_search_hits(hits, "stk 0012")[0]["code"] == "STK-0012"
+
+
+def test_search_pages_reach_matches_past_the_ranked_window(seeded_db, run_async, monkeypatch):
+    import server
+    monkeypatch.setattr(server, "SEARCH_CANDIDATE_LIMIT", 2)
+    query = {"is_active": True, **search_filter("kids")}
+    expected = {s["id"] for s in seeded_db.stock.find(query, {"id": 1})}
+    assert len(expected) > 2
+    seen = []
+    for skip in range(0, len(expected) + 3, 3):
+        seen += [s["id"] for s in run_async(server.search_page, "stock", query, "kids", skip, 3)]
+    assert sorted(seen) == sorted(expected)
+
+
+def test_documents_without_search_keys_are_backfilled_at_startup(seeded_db, api_client, run_async):
+    import server
+    stock = seeded_db.stock.find_one({"is_active": True}, {"_id": 0, "id": 1, "stock_code": 1})
+    seeded_db.stock.update_one({"id": stock["id"]}, {"$unset": {"search_keys": ""}})
+    seeded_db.system_meta.delete_many({"type": "migration:search-keys"})
+    run_async(server.ensure_search_keys)
+    assert seeded_db.system_meta.find_one({"type": "migration:search-keys"})["run_by"] == "startup"
+    found = api_client.get("/api/stock", params={"search": stock["stock_code"]}).json()
+    assert stock["id"] in [s["id"] for s in found]
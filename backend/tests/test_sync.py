@@ -0,0 +1,70 @@
+"""Offline sync body parsing (no database needed)."""
+
+import asyncio
+import gzip
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from server import read_sync_batch
+
+
+class FakeRequest:
+    def __init__(self, body: bytes, headers: dict = None):
+        self._body = body
+        self.headers = headers or {}
+
+    async def body(self):
+        return self._body
+
+
+PAYLOAD = {
+    "device_id": "scanner-3",
+    "operations": [
+        {"idempotency_key": "k1", "client_timestamp": "2024-05-01T09:00:00Z",
+         "op": "receive_outsourcing", "lot_number": "cut 001", "received_distribution": {"M": 10}},
+        {"idempotency_key": "k2", "op": "create_ironing", "lot_number": "cut 001", "unit_name": "Ironing Unit 1"}
+    ]
+}
+
+
+def test_plain_and_gzip_bodies_parse_the_same():
+    raw = json.dumps(PAYLOAD).encode()
+    plain = asyncio.run(read_sync_batch(FakeRequest(raw)))
+    compressed = asyncio.run(read_sync_batch(FakeRequest(gzip.compress(raw), {"content-encoding": "gzip"})))
+    assert plain == compressed
+    assert [op.idempotency_key for op in compressed.operations] == ["k1", "k2"]
+
+
+def test_operations_need_an_idempotency_key():
+    body = json.dumps({"operations": [{"op": "send_outsourcing", "lot_number": "cut 001"}]}).encode()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(read_sync_batch(FakeRequest(body)))
+    assert error.value.status_code == 422
+
+
+def test_corrupt_gzip_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(read_sync_batch(FakeRequest(b"not gzip", {"content-encoding": "gzip"})))
+    assert error.value.status_code == 400
+
+
+def test_failed_sync_without_transactions_is_not_replayed(seeded_db, api_client, monkeypatch):
+    import server
+
+    async def fail_part_way(operations):
+        raise RuntimeError("connection lost mid-batch")
+
+    monkeypatch.setattr(server, "_transactions_supported", False)
+    monkeypatch.setattr(server, "run_scan_operations", fail_part_way)
+    payload = {"device_id": "scanner-9", "operations": [
+        {"idempotency_key": "doubt-1", "op": "receive_outsourcing", "lot_number": "cut 001", "received_distribution": {"M": 1}}
+    ]}
+    with pytest.raises(RuntimeError):
+        api_client.post("/api/sync", json=payload)
+    assert seeded_db.sync_operations.find_one({"idempotency_key": "doubt-1"})["status"] == "in_doubt"
+
+    monkeypatch.undo()
+    replay = api_client.post("/api/sync", json=payload).json()
+    assert replay["results"][0]["replayed"] and replay["results"][0]["status"] == "error"
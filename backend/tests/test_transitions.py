@@ -0,0 +1,60 @@
+"""Stage transitions apply all of their writes or none (needs MongoDB)."""
+
+import pytest
+
+import server
+from metrics import render_metrics
+
+
+def test_buffered_updates_keep_their_filters():
+    transition = server.Transition("test_filters")
+    transition.update("ironing_orders", {"id": "ir-1"}, {"$set": {"status": "Received"}})
+    transition.cutting_order_writes(server.lot_stage_writes(["co-1"], "stock"))
+    assert transition.updates["ironing_orders"][0][0] == {"id": "ir-1"}
+    assert transition.updates["cutting_orders"][0][0]["id"] == {"$in": ["co-1"]}
+
+
+def test_failed_guard_rejects_the_whole_transition(seeded_db, run_async):
+    ironing = seeded_db.ironing_orders.find_one({"status": "Received"}, {"_id": 0})
+    transition = server.Transition("test_receive_twice")
+    transition.guard("ironing_orders", {"id": ironing["id"], "status": {"$ne": "Received"}},
+                     {"$set": {"status": "Received"}}, "Ironing order has already been received")
+    transition.insert("ironing_receipts", {"id": "receipt-twice", "ironing_order_id": ironing["id"]})
+
+    with pytest.raises(server.HTTPException) as error:
+        run_async(server.run_transition, transition)
+    assert error.value.status_code == 409
+    assert seeded_db.ironing_receipts.find_one({"id": "receipt-twice"}) is None
+    assert 'outcome="rejected"' in render_metrics()
+
+
+def test_receive_ironing_creates_stock_with_its_lineage(seeded_db, run_async):
+    ironing = seeded_db.ironing_orders.find_one({"status": "Sent"}, {"_id": 0})
+    result = run_async(server.scan_receive_ironing, {
+        "lot_number": ironing["cutting_lot_number"], "received_distribution": ironing["size_distribution"]
+    })
+    stock = seeded_db.stock.find_one({"stock_code": result["stock_code"]}, {"_id": 0})
+    assert seeded_db.ironing_orders.find_one({"id": ironing["id"]})["stock_id"] == stock["id"]
+    assert seeded_db.ironing_receipts.find_one({"stock_id": stock["id"]})["ironing_order_id"] == ironing["id"]
+    cutting_order = seeded_db.cutting_orders.find_one({"id": {"$in": ironing["cutting_order_ids"]}})
+    assert cutting_order["stage"] == "stock" and cutting_order["stock_id"] == stock["id"]
+
+
+def test_a_write_failing_after_the_guards_leaves_nothing_behind(seeded_db, run_async):
+    lots = list(seeded_db.cutting_orders.find({"stage": "cutting"}, {"_id": 0}).limit(2))
+    ids = [lot["id"] for lot in lots]
+    existing_stock = seeded_db.stock.find_one({}, {"_id": 0, "stock_code": 1})
+    transition = server.Transition("test_late_failure")
+    transition.guard("cutting_orders", {"id": {"$in": ids}, "completed_operations": {"$ne": "Printing"}},
+                     {"$addToSet": {"completed_operations": "Printing", "outsourcing_order_ids": "dc-never"}},
+                     "Lot already sent", expected=2)
+    transition.insert("outsourcing_orders", {"id": "dc-never", "dc_number": "DC-NEVER"})
+    # A duplicate stock code fails the stock bulk write, after the guards and the DC insert
+    transition.insert("stock", {"id": "stock-dup", "stock_code": existing_stock["stock_code"]})
+
+    with pytest.raises(Exception):
+        run_async(server.run_transition, transition)
+    assert seeded_db.outsourcing_orders.find_one({"id": "dc-never"}) is None
+    for lot in seeded_db.cutting_orders.find({"id": {"$in": ids}}, {"_id": 0}):
+        assert "dc-never" not in (lot.get("outsourcing_order_ids") or [])
+        assert "Printing" not in (lot.get("completed_operations") or [])